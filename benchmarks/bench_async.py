@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# Runs NUM_JOBS short jobs on SLOTS concurrent device slots with the threaded
+# GPUSchedulerCore and with the asyncio AsyncSchedulerCore, and reports the
+# wall time, job throughput and the peak number of threads of the process.
+#
+# Usage:
+#   PYTHONPATH=. python benchmarks/bench_async.py [NUM_JOBS] [SLOTS] [SECONDS]
+#
+# Every job runs `sleep SECONDS` (default 0.5).
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import threading
+
+from gpupeasy.core.gpuscheduler import GPUSchedulerCore, Job
+from gpupeasy.core.gpuscheduler import STATE_SUCCEEDED, STATE_FAILED
+from gpupeasy.core.asyncscheduler import AsyncSchedulerCore
+from gpupeasy.utils import Logger
+
+
+class PeakThreads:
+    def __init__(self):
+        self.peak = threading.active_count()
+        self.__stop = threading.Event()
+        self.__thr = threading.Thread(target=self.__run, daemon=True)
+        self.__thr.start()
+
+    def __run(self):
+        while not self.__stop.wait(0.01):
+            self.peak = max(self.peak, threading.active_count() - 1)
+
+    def stop(self):
+        self.__stop.set()
+        self.__thr.join()
+        return self.peak
+
+
+def makeJobs(outdir, tag, numJobs, seconds):
+    return [Job('%s%d' % (tag, i), ['sleep', str(seconds)],
+                stdoutF=os.path.join(outdir, '%s%d' % (tag, i)))
+            for i in range(numJobs)]
+
+
+def runThreaded(jobs, slots, logger):
+    core = GPUSchedulerCore([''] * slots, wakesec=1, logger=logger,
+                            maxQueueSize=len(jobs))
+    core.startDaemon()
+    sub = core.subscribe()
+    peak = PeakThreads()
+    start = time.perf_counter()
+    core.addNewJobs(jobs)
+    done = 0
+    while done < len(jobs):
+        event = sub.get()
+        if event['type'] == 'job' and event['state'] in [STATE_SUCCEEDED,
+                                                         STATE_FAILED]:
+            done += 1
+    elapsed = time.perf_counter() - start
+    core.stopDaemon()
+    return elapsed, peak.stop()
+
+
+async def runAsync(jobs, slots, logger):
+    core = AsyncSchedulerCore([''] * slots, logger=logger,
+                              maxQueueSize=len(jobs))
+    await core.start()
+    peak = PeakThreads()
+    start = time.perf_counter()
+    futures = [await core.submit(job) for job in jobs]
+    await asyncio.gather(*futures)
+    elapsed = time.perf_counter() - start
+    await core.stop()
+    return elapsed, peak.stop()
+
+
+def main():
+    numJobs = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    slots = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 0.5
+    outdir = tempfile.mkdtemp(prefix='gpupeasy-bench-')
+    logger = Logger(fstdout=open(os.devnull, 'w'))
+    ideal = seconds * -(-numJobs // slots)
+    print('%d jobs of %.1fs on %d slots (ideal %.1fs)' % (numJobs, seconds,
+                                                         slots, ideal))
+    results = [
+        ('threaded core', runThreaded(makeJobs(outdir, 't', numJobs, seconds),
+                                      slots, logger)),
+        ('asyncio core', asyncio.run(runAsync(makeJobs(outdir, 'a', numJobs,
+                                                       seconds),
+                                              slots, logger))),
+    ]
+    for name, (elapsed, peak) in results:
+        print('  %-14s %7.2fs  %8.0f jobs/sec  peak threads %d' %
+              (name, elapsed, numJobs / elapsed, peak))
+
+
+if __name__ == '__main__':
+    main()
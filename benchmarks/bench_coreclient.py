@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# Measures the cost of web GUI -> core requests: a new connection per request
+# (module level requests.get) against a pooled keep-alive session, and then
+# the per endpoint latency the web GUI itself records while rendering pages.
+#
+# Usage:
+#   PYTHONPATH=. python benchmarks/bench_coreclient.py [NUM_REQUESTS]
+#
+# A GPUPeasyServer is started in-process on a free port. The event listener
+# of the web GUI is not started, so every page view goes to the core.
+import os
+import sys
+import time
+import logging
+import socket
+import tempfile
+import threading
+
+import requests
+
+from gpupeasy.core.server import GPUPeasyServer
+from gpupeasy.webapp.peasyWebGUI import GPUPeasyWebGUI
+
+
+def freePort():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def timeRequests(get, url, num):
+    start = time.perf_counter()
+    for _ in range(num):
+        get(url)
+    return (time.perf_counter() - start) / num
+
+
+def main():
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    # Request logging would dominate the timings.
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    outdir = tempfile.mkdtemp(prefix='gpupeasy-bench-')
+    port = freePort()
+    server = GPUPeasyServer(['gpu0', 'gpu1'], logdir=os.path.join(outdir, 'l'))
+    thr = threading.Thread(target=server.run, args=('127.0.0.1', port),
+                           daemon=True)
+    thr.start()
+    prefix = 'http://127.0.0.1:%d' % port
+    while True:
+        try:
+            requests.get(prefix + '/availabledevices')
+            break
+        except requests.ConnectionError:
+            time.sleep(0.05)
+    job = {'jobName': 'a', 'outFile': os.path.join(outdir, 'a.out'),
+           'jobCommand': ['true']}
+    jobID = requests.post(prefix + '/addnewjob', json={'job': job}).json()
+    jobID = jobID['jobID']
+
+    session = requests.Session()
+    print('core requests, mean of %d' % num)
+    for endpoint in ['/availabledevices', '/jobinfo/%d' % jobID,
+                     '/runningjobs']:
+        url = prefix + endpoint
+        fresh = timeRequests(requests.get, url, num)
+        pooled = timeRequests(session.get, url, num)
+        print('  %-18s new connection %7.2f ms  keep-alive %7.2f ms' %
+              (endpoint, fresh * 1000, pooled * 1000))
+
+    gui = GPUPeasyWebGUI('127.0.0.1', port)
+    client = gui._GPUPeasyWebGUI__frontend.test_client()
+    pages = ['/deviceutilization', '/jobinfo/%d' % jobID, '/scheduledjobs',
+             '/successfuljobs']
+    start = time.perf_counter()
+    for _ in range(num // 10):
+        for page in pages:
+            client.get(page)
+    elapsed = time.perf_counter() - start
+    print('web GUI, %d page views in %.2fs' % (len(pages) * (num // 10),
+                                               elapsed))
+    stats = client.get('/corestats').get_json()['value']
+    for endpoint in sorted(stats):
+        st = stats[endpoint]
+        print('  %-18s calls %5d cached %5d  p50 %6.2f ms  p95 %6.2f ms' %
+              (endpoint, st['count'], st['cached'], st['p50ms'], st['p95ms']))
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
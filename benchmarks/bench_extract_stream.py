@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# Compares summarizing one large training log with a string extractor
+# (extractor(), given the whole log) and with a streaming one
+# (extract_stream(), given a memory-mapped LogStream) through
+# gridgenerator.generator.LogSummarizer.
+#
+# Usage:
+#   PYTHONPATH=. python benchmarks/bench_extract_stream.py [--megabytes N]
+#
+# The log has --megabytes of epoch lines and ends with the final accuracy.
+# The string extractor searches the whole log for both; the streaming one
+# reads lines from the end and stops once it has found them, and a third
+# one runs a bytes regular expression over the mapped log. Memory is
+# measured as in bench_gridgen.py.
+import os
+import re
+import shutil
+import argparse
+import tempfile
+
+from gridgenerator.generator import GridConfigBase, LogSummarizer
+from isolated import measure, report, run
+
+LINE = 'epoch %d loss: %.4f accuracy: %.4f\n'
+
+
+class StringGrid(GridConfigBase):
+    def __init__(self):
+        super().__init__('/tmp', '/path/to/train.py',
+                         SUMMARY_KEYS=['accuracy', 'epochs'])
+
+    def extractor(self, keys, alldata):
+        acc = re.findall(r'final accuracy: ([0-9.]+)', alldata)
+        epochs = re.findall(r'^epoch (\d+)', alldata, re.MULTILINE)
+        return {'accuracy': [float(acc[-1]) if acc else None],
+                'epochs': [int(epochs[-1]) if epochs else None]}
+
+
+class TailGrid(StringGrid):
+    def extract_stream(self, keys, log):
+        acc, epochs = None, None
+        for line in log.reversed_lines():
+            if acc is None and line.startswith('final accuracy: '):
+                acc = float(line.split()[-1])
+            if epochs is None and line.startswith('epoch '):
+                epochs = int(line.split()[1])
+            if acc is not None and epochs is not None:
+                break
+        return {'accuracy': [acc], 'epochs': [epochs]}
+
+
+class BufferGrid(StringGrid):
+    def extract_stream(self, keys, log):
+        acc = re.findall(rb'final accuracy: ([0-9.]+)', log.buffer)
+        epochs = re.findall(rb'^epoch (\d+)', log.buffer, re.MULTILINE)
+        return {'accuracy': [float(acc[-1]) if acc else None],
+                'epochs': [int(epochs[-1]) if epochs else None]}
+
+
+MODES = {'string': StringGrid, 'stream, tail': TailGrid,
+         'stream, buffer': BufferGrid}
+
+
+def makeLog(job_dir, megabytes):
+    size, epoch = megabytes * 1000000, 0
+    with open(os.path.join(job_dir, 'gpupeasy_logs.out'), 'w') as fp:
+        while fp.tell() < size:
+            fp.write(''.join(LINE % (e, 1.0 / (e + 1), 0.5)
+                             for e in range(epoch, epoch + 10000)))
+            epoch += 10000
+        fp.write('final accuracy: 0.9000\n')
+
+
+def child(mode, job_dir):
+    summarizer = LogSummarizer(MODES[mode]())
+    r = measure(summarizer.summarize, job_dir)
+    values, error, _ = r.pop('value')
+    assert error is None, error
+    r['values'] = values
+    report(r)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--megabytes', type=int, default=300)
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child is not None:
+        child(*args.child)
+        return
+    job_dir = tempfile.mkdtemp(prefix='gpupeasy-log-')
+    try:
+        makeLog(job_dir, args.megabytes)
+        print('%d MB log:' % args.megabytes)
+        expected = None
+        for mode in MODES:
+            r = run(__file__, mode, job_dir)
+            if expected is None:
+                expected = r['values']
+            assert r['values'] == expected, 'Summaries differ'
+            print('  %-16s %8.3fs  peak +%7.1f MB' %
+                  (mode, r['seconds'], r['memory'] / 1e6))
+    finally:
+        shutil.rmtree(job_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# Simulates queue-wait times per project under FIFO and fair-share ordering.
+#
+# Usage:
+#   PYTHONPATH=. python benchmarks/bench_fairshare.py
+#
+# No processes are launched. A discrete event simulation drives the queue
+# classes from gpupeasy.utils: a large grid is submitted at t=0 and two smaller
+# sweeps trickle in afterwards. We report percentiles of the time each job
+# spent in the queue, per project.
+import heapq
+import random
+
+from gpupeasy.utils import LockedQueue, LockedFairShareQueue
+
+NUM_DEVICES = 8
+
+
+class SimJob:
+    def __init__(self, jobid, project, submit, duration, priority=0):
+        self.jobid = jobid
+        self.project = project
+        self.submit = submit
+        self.duration = duration
+        self.priority = priority
+        self.start = None
+
+
+def workload(seed=0):
+    rng = random.Random(seed)
+    jobs = []
+    # A 2000 point grid dumped at t=0
+    for i in range(2000):
+        jobs.append(SimJob(len(jobs), 'grid', 0.0, rng.uniform(60, 180)))
+    # Two smaller sweeps submitted over the first hour
+    for project in ['sweepA', 'sweepB']:
+        for i in range(100):
+            submit = rng.uniform(0, 3600)
+            jobs.append(SimJob(len(jobs), project, submit,
+                               rng.uniform(60, 180)))
+    return jobs
+
+
+def simulate(queue, jobs):
+    arrivals = sorted(jobs, key=lambda j: j.submit)
+    # (time, kind, seq) where kind 0 = job finished, 1 = arrival
+    events = [(j.submit, 1, j.jobid) for j in arrivals]
+    heapq.heapify(events)
+    byId = {j.jobid: j for j in jobs}
+    free = NUM_DEVICES
+    while events:
+        now, kind, jobid = heapq.heappop(events)
+        if kind == 1:
+            queue.append(byId[jobid])
+        else:
+            free += 1
+        while free > 0 and len(queue) > 0:
+            job = queue.pop()
+            job.start = now
+            free -= 1
+            heapq.heappush(events, (now + job.duration, 0, job.jobid))
+
+
+def percentile(vals, p):
+    vals = sorted(vals)
+    idx = min(len(vals) - 1, int(round(p / 100.0 * (len(vals) - 1))))
+    return vals[idx]
+
+
+def report(name, jobs):
+    print(name)
+    for project in ['grid', 'sweepA', 'sweepB']:
+        waits = [j.start - j.submit for j in jobs if j.project == project]
+        print('  %-7s p50: %8.0fs  p90: %8.0fs  p99: %8.0fs  max: %8.0fs' %
+              (project, percentile(waits, 50), percentile(waits, 90),
+               percentile(waits, 99), max(waits)))
+
+
+def main():
+    jobKey = lambda job: job.jobid
+    policies = [
+        ('FIFO', LockedQueue(key=jobKey)),
+        ('fair-share (equal weights)', LockedFairShareQueue(
+            key=jobKey, priority=lambda job: -job.priority,
+            tag=lambda job: job.project)),
+        ('fair-share (grid:2, sweeps:1)', LockedFairShareQueue(
+            key=jobKey, priority=lambda job: -job.priority,
+            tag=lambda job: job.project, weights={'grid': 2})),
+    ]
+    for name, queue in policies:
+        jobs = workload()
+        simulate(queue, jobs)
+        report(name, jobs)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# Compares building a grid whose validity is declared as constraints
+# (tie_param, add_conditional_param, add_constraint), enumerated by
+# backtracking, with building the full Cartesian product and filtering it in
+# reject_invalid, eagerly and streaming (gridgenerator.generator).
+#
+# Usage:
+#   PYTHONPATH=. python benchmarks/bench_gridconstraints.py [--eager-max N]
+#
+# The grid has k layer widths of 10 values each, increasing from layer to
+# layer, a second width per layer that has to equal the first, an optimizer
+# and a momentum that only applies to SGD. Written as independent parameters
+# that is 6 * 10^(2k) points, of which 3 * C(10, k) are valid. Memory is
+# measured as in bench_gridgen.py. The eager product of 3 layers takes about
+# 2 GB, so it is only run up to --eager-max points.
+import os
+import shutil
+import argparse
+import tempfile
+
+from gridgenerator.generator import GridConfigBase, ValidGridGenerator
+from isolated import measure, report, run
+
+WIDTHS = [16 * (i + 1) for i in range(10)]
+
+
+class ProductGrid(GridConfigBase):
+    def __init__(self, out_base_dir, layers):
+        super().__init__(out_base_dir, '/path/to/train.py')
+        self.layers = layers
+        for i in range(layers):
+            self.add_param('--width%d' % i, WIDTHS)
+            self.add_param('--out-width%d' % i, WIDTHS)
+        self.add_param('--optimizer', ['sgd', 'adam'])
+        self.add_param('--momentum', [0.9, 0.99, None])
+
+    def reject_invalid(self, df):
+        keep = df['--width0'] == df['--out-width0']
+        for i in range(1, self.layers):
+            keep &= df['--width%d' % i] == df['--out-width%d' % i]
+            keep &= df['--width%d' % (i - 1)] < df['--width%d' % i]
+        sgd = df['--optimizer'] == 'sgd'
+        keep &= sgd == df['--momentum'].notnull()
+        return df[keep]
+
+
+class ConstrainedGrid(GridConfigBase):
+    def __init__(self, out_base_dir, layers):
+        super().__init__(out_base_dir, '/path/to/train.py')
+        for i in range(layers):
+            self.add_param('--width%d' % i, WIDTHS)
+            self.tie_param('--out-width%d' % i, '--width%d' % i)
+            if i > 0:
+                self.add_constraint(('--width%d' % (i - 1), '--width%d' % i),
+                                    lambda a, b: a < b)
+        self.add_param('--optimizer', ['sgd', 'adam'])
+        self.add_conditional_param('--momentum', [0.9, 0.99],
+                                   {'--optimizer': 'sgd'})
+
+
+def child(mode, layers, chunk_size):
+    base = tempfile.mkdtemp(prefix='gpupeasy-grid-')
+    cwd = os.getcwd()
+    os.chdir(base)
+    try:
+        cls = ConstrainedGrid if mode == 'constraints' else ProductGrid
+        grid = cls(base, layers)
+        grid()
+        gen = ValidGridGenerator('bench', grid, chunk_size=chunk_size)
+        r = measure(gen.create_grid_gpupeasy)
+        with open('bench.csv') as fp:
+            r['jobs'] = sum(1 for _ in fp) - 1
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(base)
+    report(r)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--eager-max', type=int, default=1000000)
+    parser.add_argument('--chunk-size', type=int, default=100000)
+    parser.add_argument('--child', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child is not None:
+        child(args.child[0], int(args.child[1]), int(args.child[2]) or None)
+        return
+    for layers in [2, 3]:
+        points = 6 * 10 ** (2 * layers)
+        print('%d layers, %d points as a product:' % (layers, points))
+        modes = [('product, streaming', 'product', args.chunk_size),
+                 ('constraints', 'constraints', None)]
+        if points <= args.eager_max:
+            modes.insert(0, ('product, eager', 'product', None))
+        for name, mode, chunk_size in modes:
+            r = run(__file__, mode, layers, chunk_size or 0)
+            print('  %-20s %5d jobs  %7.2fs  peak +%7.1f MB' %
+                  (name, r['jobs'], r['seconds'], r['memory'] / 1e6))
+
+
+if __name__ == '__main__':
+    main()
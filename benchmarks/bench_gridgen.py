@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# Measures the time and peak memory of building a grid with
+# gridgenerator.generator.ValidGridGenerator, eagerly (the whole Cartesian
+# product as one DataFrame) and streaming (chunk_size points at a time).
+#
+# Usage:
+#   PYTHONPATH=. python benchmarks/bench_gridgen.py [--eager-max N]
+#       [--chunk-size N]
+#
+# Grids have 5 to 7 parameters of 10 values each, i.e. 100k to 10M points, of
+# which a vectorized reject_invalid keeps 0.1% (100 to 10k jobs). Memory is
+# measured as described in isolated.py. The eager build keeps every point in
+# memory (a few GB at 10M points), so it is only run up to --eager-max
+# points.
+import os
+import shutil
+import argparse
+import tempfile
+
+from gridgenerator.generator import GridConfigBase, ValidGridGenerator
+from isolated import measure, report, run
+
+
+class BenchGrid(GridConfigBase):
+    def __init__(self, out_base_dir, num_params):
+        super().__init__(out_base_dir, '/path/to/train.py')
+        for i in range(num_params):
+            self.add_param('--p%d' % i, list(range(10)))
+
+    def reject_invalid(self, df):
+        keep = (df['--p0'] == df['--p1']) & (df['--p2'] == df['--p3'])
+        return df[keep & (df['--p4'] == 0)]
+
+
+def child(num_params, chunk_size):
+    base = tempfile.mkdtemp(prefix='gpupeasy-grid-')
+    cwd = os.getcwd()
+    os.chdir(base)
+    try:
+        grid = BenchGrid(base, num_params)
+        grid()
+        gen = ValidGridGenerator('bench', grid, chunk_size=chunk_size)
+        r = measure(gen.create_grid_gpupeasy)
+        with open('bench.csv') as fp:
+            r['jobs'] = sum(1 for _ in fp) - 1
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(base)
+    report(r)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--eager-max', type=int, default=1000000)
+    parser.add_argument('--chunk-size', type=int, default=100000)
+    parser.add_argument('--child', nargs=2, type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child is not None:
+        child(args.child[0], args.child[1] or None)
+        return
+    for num_params in [5, 6, 7]:
+        points = 10 ** num_params
+        print('%d points:' % points)
+        modes = [('streaming', args.chunk_size)]
+        if points <= args.eager_max:
+            modes.insert(0, ('eager', None))
+        for name, chunk_size in modes:
+            r = run(__file__, num_params, chunk_size or 0)
+            print('  %-10s %6d jobs  %7.2fs  %8.1f Mpoints/s  peak +%7.1f MB'
+                  % (name, r['jobs'], r['seconds'],
+                     points / r['seconds'] / 1e6, r['memory'] / 1e6))
+
+
+if __name__ == '__main__':
+    main()
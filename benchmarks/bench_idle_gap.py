@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# Measures how long a device sits idle between two consecutive jobs.
+#
+# Usage:
+#   PYTHONPATH=. python benchmarks/bench_idle_gap.py [NUM_JOBS]
+#
+# A single device is used and every job prints the wall-clock time at which it
+# started and finished to its output file. The idle gap is the time between the
+# end of job i and the start of job i+1. We run the same workload with pure
+# wakesec polling and with the event driven daemon.
+import os
+import sys
+import time
+import tempfile
+import statistics
+
+from gpupeasy.core.gpuscheduler import GPUSchedulerCore, Job
+from gpupeasy.utils import Logger
+
+SCRIPT = 'import time; print(time.time()); time.sleep(0.05); print(time.time())'
+
+
+def runWorkload(numJobs, eventDriven, wakesec=1):
+    logger = Logger(fstdout=open(os.devnull, 'w'))
+    core = GPUSchedulerCore([''], wakesec=wakesec, logger=logger,
+                            eventDriven=eventDriven)
+    core.startDaemon()
+    outdir = tempfile.mkdtemp(prefix='gpupeasy-bench-')
+    files = []
+    for i in range(numJobs):
+        outF = os.path.join(outdir, '%d.out' % i)
+        files.append(outF)
+        core.addNewJob(Job('job%d' % i, [sys.executable, '-c', SCRIPT],
+                           stdoutF=outF))
+    while len(core.getSucceededJobs()) + len(core.getFailedJobs()) < numJobs:
+        time.sleep(0.05)
+    core.stopDaemon()
+    spans = []
+    for outF in files:
+        with open(outF) as fp:
+            start, end = [float(x) for x in fp.read().split()]
+        spans.append((start, end))
+    spans.sort()
+    gaps = [spans[i + 1][0] - spans[i][1] for i in range(len(spans) - 1)]
+    return gaps
+
+
+def main():
+    numJobs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    for name, eventDriven in [('polling', False), ('event-driven', True)]:
+        gaps = runWorkload(numJobs, eventDriven)
+        print('%-13s jobs: %d  idle gap mean: %.4fs  median: %.4fs  '
+              'max: %.4fs  total idle: %.2fs' %
+              (name, numJobs, statistics.mean(gaps), statistics.median(gaps),
+               max(gaps), sum(gaps)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# Measures GPUSchedulerCore.getJobInfo() latency with many retained jobs.
+#
+# Usage:
+#   PYTHONPATH=. python benchmarks/bench_jobinfo.py [NUM_JOBS]
+#
+# The only device is kept busy by a long running job so that every other job
+# stays in the queue. The index based lookup is compared against the previous
+# implementation, which copied and scanned every queue.
+import os
+import sys
+import time
+import random
+import tempfile
+
+from gpupeasy.core.gpuscheduler import GPUSchedulerCore, Job
+from gpupeasy.utils import Logger
+
+
+def scanLookup(core, jobID):
+    for getter in [core.getJobsToSchedule, core.getFailedJobs,
+                   core.getSucceededJobs, core.getRunningJobs]:
+        for job in getter():
+            if job.jobid == jobID:
+                return job
+    return None
+
+
+def timeLookups(fn, ids):
+    start = time.perf_counter()
+    for jobID in ids:
+        fn(jobID)
+    return (time.perf_counter() - start) / len(ids)
+
+
+def main():
+    numJobs = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    logger = Logger(fstdout=open(os.devnull, 'w'))
+    core = GPUSchedulerCore([''], wakesec=1, maxQueueSize=numJobs + 1,
+                            logger=logger)
+    core.startDaemon()
+    outF = os.path.join(tempfile.mkdtemp(prefix='gpupeasy-bench-'), 'out')
+    core.addNewJob(Job('blocker', ['sleep', '600'], stdoutF=outF))
+    while len(core.getRunningJobs()) == 0:
+        time.sleep(0.01)
+    for i in range(numJobs):
+        core.addNewJob(Job('job%d' % i, ['true']))
+    ids = [random.randint(1, numJobs + 1) for _ in range(200)]
+    scan = timeLookups(lambda x: scanLookup(core, x), ids)
+    ids = [random.randint(1, numJobs + 1) for _ in range(100000)]
+    index = timeLookups(core.getJobInfo, ids)
+    print('retained jobs: %d' % numJobs)
+    print('linear scan : %10.2f us/lookup' % (scan * 1e6))
+    print('job index   : %10.2f us/lookup' % (index * 1e6))
+    for job in core.getRunningJobs():
+        job.subprocess.kill()
+    core.stopDaemon()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# Compares ways of reading the end of a large job log: spawning `tail -n N`
+# (what /loadlogfile used to do), tailFile() and an incremental readFrom()
+# from the last offset, which is what a following client does.
+#
+# Usage:
+#   PYTHONPATH=. python benchmarks/bench_logtail.py [SIZE_MB] [LAST_N]
+#
+# A log of SIZE_MB (default 2048) is written to a temporary directory and
+# removed afterwards.
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+
+from gpupeasy.utils import tailFile, readFrom
+
+
+def writeLog(path, sizeMB):
+    line = b'epoch 0001 step 000001 loss 0.123456 acc 0.987654 lr 1e-4\n'
+    chunk = line * ((1024 * 1024) // len(line))
+    with open(path, 'wb') as fp:
+        written = 0
+        while written < sizeMB * 1024 * 1024:
+            fp.write(chunk)
+            written += len(chunk)
+
+
+def timeit(fn, repeat=20):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times[len(times) // 2]
+
+
+def main():
+    sizeMB = int(sys.argv[1]) if len(sys.argv) > 1 else 2048
+    lastN = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    outdir = tempfile.mkdtemp(prefix='gpupeasy-bench-')
+    path = os.path.join(outdir, 'job.out')
+    try:
+        writeLog(path, sizeMB)
+        expected = subprocess.check_output(['tail', '-n', str(lastN), path])
+        data, offset = tailFile(path, lastN)
+        assert data == expected
+        # A client that last saw the file 100 lines ago.
+        offset -= 100 * len(expected.splitlines(True)[-1])
+
+        def spawnTail():
+            subprocess.check_output(['tail', '-n', str(lastN), path])
+
+        results = [
+            ('tail -n subprocess', timeit(spawnTail)),
+            ('tailFile', timeit(lambda: tailFile(path, lastN))),
+            ('readFrom offset', timeit(lambda: readFrom(path, offset))),
+        ]
+        print('log size: %d MB, last %d lines' % (sizeMB, lastN))
+        for name, t in results:
+            print('  %-20s %10.1f us' % (name, t * 1e6))
+    finally:
+        shutil.rmtree(outdir)
+
+
+if __name__ == '__main__':
+    main()
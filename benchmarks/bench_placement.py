@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# Simulates device utilization under FIFO slot scheduling and under resource
+# aware placement (best-fit packing, with and without backfill).
+#
+# Usage:
+#   PYTHONPATH=. python benchmarks/bench_placement.py
+#
+# No processes are launched. A discrete event simulation drives
+# gpupeasy.core.placement on 8 devices with a mixed workload: jobs that need a
+# quarter or half of a GPU, whole-GPU jobs and 2 or 4 GPU jobs. The FIFO
+# baseline is the old behaviour: every job takes whole devices (one slot per
+# GPU asked for), in queue order. Utilization counts the GPU share the jobs
+# asked for, i.e. the work done, over the capacity till the last job exits.
+#
+# Two scenarios: a batch, where all jobs are queued at t=0 (utilization shows
+# how well the jobs are packed), and a stream of arrivals at about 0.8 of the
+# capacity when packed (0.97 with whole devices), where queue waits matter.
+# A last check queues CPU-only jobs (gpus=0) behind GPU jobs on a pool whose
+# devices are all taken: they need no device, so with backfill they should
+# start at once (without, they wait behind the GPU jobs, in queue order).
+import copy
+import time
+import heapq
+import random
+
+from gpupeasy.utils import LockedQueue
+from gpupeasy.core.placement import ResourcePool, selectJobs
+from gpupeasy.core.placement import BEST_FIT, FIRST_FIT
+
+NUM_DEVICES = 8
+DEVICE_MEMORY = 16000
+
+
+class SimJob:
+    def __init__(self, jobid, submit, duration, gpus, gpuShare, memory):
+        self.jobid = jobid
+        self.submit = submit
+        self.duration = duration
+        self.gpus = gpus
+        self.gpuShare = gpuShare
+        self.memory = memory
+        self.cpus = 0
+        self.start = None
+
+
+def workload(seed=0, numJobs=3000, interval=None):
+    '''
+    interval: Mean seconds between arrivals, None to queue all at t=0.
+    '''
+    rng = random.Random(seed)
+    jobs = []
+    now = 0.0
+    for i in range(numJobs):
+        if interval is not None:
+            now += rng.expovariate(1.0 / interval)
+        kind = rng.random()
+        if kind < 0.5:
+            share = rng.choice([0.25, 0.5])
+            job = SimJob(i, now, rng.uniform(60, 600), 1, share,
+                         int(DEVICE_MEMORY * share * 0.8))
+        elif kind < 0.85:
+            job = SimJob(i, now, rng.uniform(60, 600), 1, 1.0, None)
+        else:
+            job = SimJob(i, now, rng.uniform(300, 1200), rng.choice([2, 4]),
+                         1.0, None)
+        jobs.append(job)
+    return jobs
+
+
+def simulate(jobs, policy, backfill, wholeDevices=False):
+    if wholeDevices:
+        # One slot per GPU asked for, as before resource requests.
+        for job in jobs:
+            job.gpuShare = 1.0
+            job.memory = None
+    devices = [str(i) for i in range(NUM_DEVICES)]
+    memory = {d: DEVICE_MEMORY for d in devices}
+    pool = ResourcePool(devices, deviceMemory=memory)
+    queue = LockedQueue(key=lambda job: job.jobid)
+    byId = {j.jobid: j for j in jobs}
+    # (time, kind, jobid) where kind 0 = job finished, 1 = arrival
+    events = [(j.submit, 1, j.jobid) for j in jobs]
+    heapq.heapify(events)
+    passes, passTime = 0, 0.0
+    while events:
+        now, kind, jobid = heapq.heappop(events)
+        if kind == 1:
+            queue.append(byId[jobid])
+        else:
+            pool.release(byId[jobid])
+        # Handle all events at this instant before scheduling.
+        if events and events[0][0] == now:
+            continue
+        start = time.perf_counter()
+        placed = selectJobs(pool, queue, policy=policy, backfill=backfill)
+        passTime += time.perf_counter() - start
+        passes += 1
+        for job, _ in placed:
+            job.start = now
+            heapq.heappush(events, (now + job.duration, 0, job.jobid))
+    return passes, passTime
+
+
+def percentile(vals, p):
+    vals = sorted(vals)
+    idx = min(len(vals) - 1, int(round(p / 100.0 * (len(vals) - 1))))
+    return vals[idx]
+
+
+def report(name, jobs, requested, passes, passTime):
+    makespan = max(j.start + j.duration for j in jobs)
+    work = sum(r.gpus * r.gpuShare * r.duration for r in requested)
+    util = work / (NUM_DEVICES * makespan)
+    waits = [j.start - j.submit for j in jobs]
+    large = [j.start - j.submit for j in jobs if j.gpus > 1]
+    print('  %-26s util: %5.1f%%  makespan: %7.0fs  wait p50: %6.0fs  '
+          'p90: %6.0fs  multi-GPU p90: %6.0fs  pass: %5.0fus' %
+          (name, 100 * util, makespan, percentile(waits, 50),
+           percentile(waits, 90), percentile(large, 90),
+           1e6 * passTime / passes))
+
+
+def fullPool(policy, backfill):
+    '''
+    Returns (CPU-only jobs started, CPU-only jobs queued) with every device
+    taken and GPU jobs queued ahead of them.
+    '''
+    devices = [str(i) for i in range(NUM_DEVICES)]
+    pool = ResourcePool(devices, cpus=16)
+    queue = LockedQueue(key=lambda job: job.jobid)
+    queue.extend([SimJob(i, 0, 60, 1, 1.0, None)
+                  for i in range(2 * NUM_DEVICES)])
+    selectJobs(pool, queue, policy=policy, backfill=backfill)
+    cpuJobs = [SimJob(100 + i, 0, 60, 0, 1.0, None) for i in range(4)]
+    for job in cpuJobs:
+        job.cpus = 2
+    queue.extend(cpuJobs)
+    placed = selectJobs(pool, queue, policy=policy, backfill=backfill)
+    return len([j for j, _ in placed if j.gpus == 0]), len(cpuJobs)
+
+
+def main():
+    policies = [
+        ('FIFO (whole devices)', FIRST_FIT, False, True),
+        ('first-fit packing', FIRST_FIT, False, False),
+        ('best-fit packing', BEST_FIT, False, False),
+        ('best-fit + backfill', BEST_FIT, True, False),
+    ]
+    for scenario, interval in [('batch', None), ('stream', 80.0)]:
+        print('%s:' % scenario)
+        requested = workload(interval=interval)
+        for name, policy, backfill, whole in policies:
+            jobs = copy.deepcopy(requested)
+            passes, passTime = simulate(jobs, policy, backfill, whole)
+            report(name, jobs, requested, passes, passTime)
+    print('CPU-only jobs on a full pool (started / queued):')
+    for name, policy, backfill, _ in policies[1:]:
+        started, queued = fullPool(policy, backfill)
+        print('  %-26s %d / %d' % (name, started, queued))
+
+
+if __name__ == '__main__':
+    main()
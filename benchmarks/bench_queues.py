@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# Micro-benchmarks for the job queues in gpupeasy.utils.
+#
+# Usage:
+#   PYTHONPATH=. python benchmarks/bench_queues.py [SIZE ...]
+#
+# For each size we enqueue SIZE jobs, remove 10% of them by jobid and dequeue
+# the rest. The list based queue (pop from the front, remove by scanning) is
+# what LockedList used to do and is only run for sizes up to 100k.
+import sys
+import time
+import random
+
+from gpupeasy.utils import LockedQueue, LockedPriorityQueue
+
+
+class FakeJob:
+    def __init__(self, jobid, priority):
+        self.jobid = jobid
+        self.priority = priority
+
+
+class ListQueue:
+    def __init__(self):
+        self.container = []
+
+    def append(self, job):
+        self.container.append(job)
+
+    def pop(self):
+        if len(self.container) == 0:
+            return None
+        val = self.container[0]
+        del self.container[0]
+        return val
+
+    def remove(self, jobid):
+        for i, job in enumerate(self.container):
+            if job.jobid == jobid:
+                del self.container[i]
+                return job
+        return None
+
+
+def run(queue, jobs, removeIds):
+    t0 = time.perf_counter()
+    for job in jobs:
+        queue.append(job)
+    t1 = time.perf_counter()
+    for jobid in removeIds:
+        queue.remove(jobid)
+    t2 = time.perf_counter()
+    while queue.pop() is not None:
+        pass
+    t3 = time.perf_counter()
+    n, r = len(jobs), max(len(removeIds), 1)
+    return (t1 - t0) / n, (t2 - t1) / r, (t3 - t2) / (n - len(removeIds))
+
+
+def main():
+    sizes = [int(x) for x in sys.argv[1:]] or [10000, 100000, 1000000]
+    jobKey = lambda job: job.jobid
+    for size in sizes:
+        jobs = [FakeJob(i, random.randint(0, 10)) for i in range(size)]
+        removeIds = random.sample(range(size), size // 10)
+        queues = [
+            ('LockedQueue', LockedQueue(key=jobKey)),
+            ('LockedPriorityQueue', LockedPriorityQueue(
+                key=jobKey, priority=lambda job: job.priority)),
+        ]
+        if size <= 100000:
+            queues.append(('list (old)', ListQueue()))
+        print('size: %d' % size)
+        for name, queue in queues:
+            enq, rem, deq = run(queue, jobs, removeIds)
+            print('  %-20s enqueue: %8.3f us  remove: %10.3f us  '
+                  'dequeue: %8.3f us' % (name, enq * 1e6, rem * 1e6,
+                                         deq * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# Load test of the core server in each serving mode. Concurrent clients hit
+# /jobinfo/<id> and /addnewjob for a fixed time; requests/sec and latency
+# percentiles are reported per endpoint and mode.
+#
+# Usage:
+#   PYTHONPATH=. python benchmarks/bench_serving.py [CLIENTS] [SECONDS]
+#
+# The server runs in a subprocess (so that it does not share the GIL with
+# the load generator) with a single device kept busy, so submitted jobs stay
+# queued. Modes whose server is not installed are skipped.
+import os
+import sys
+import time
+import signal
+import socket
+import tempfile
+import threading
+import subprocess
+
+import requests
+
+from gpupeasy.serving import SERVERS
+
+SERVER_SCRIPT = '''
+import sys, logging
+logging.getLogger('werkzeug').setLevel(logging.ERROR)
+from gpupeasy.core.server import GPUPeasyServer
+server = GPUPeasyServer([''], logdir=sys.argv[3])
+server.run('127.0.0.1', int(sys.argv[1]), server=sys.argv[2], threads=16)
+'''
+
+
+def freePort():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def installed(server):
+    if server == 'flask':
+        return True
+    try:
+        __import__(server)
+    except ImportError:
+        return False
+    return True
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+def client(prefix, endpoint, outdir, cid, deadline, latencies, errors):
+    session = requests.Session()
+    i = 0
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            if endpoint == 'jobinfo':
+                resp = session.get(prefix + '/jobinfo/1', timeout=10)
+            else:
+                job = {'jobName': 'c%d-%d' % (cid, i),
+                       'outFile': os.path.join(outdir, 'c%d-%d' % (cid, i)),
+                       'jobCommand': ['true']}
+                resp = session.post(prefix + '/addnewjob', json={'job': job},
+                                    timeout=10)
+            ok = resp.status_code == 200
+        except requests.RequestException:
+            ok = False
+        if ok:
+            latencies.append(time.perf_counter() - start)
+        else:
+            errors.append(1)
+        i += 1
+
+
+def loadTest(prefix, endpoint, outdir, clients, seconds):
+    latencies, errors, threads = [], [], []
+    deadline = time.perf_counter() + seconds
+    for cid in range(clients):
+        thr = threading.Thread(target=client,
+                               args=(prefix, endpoint, outdir,
+                                     cid, deadline, latencies, errors))
+        thr.start()
+        threads.append(thr)
+    for thr in threads:
+        thr.join()
+    return latencies, len(errors)
+
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    print('%d clients, %.0fs per run' % (clients, seconds))
+    for mode in SERVERS:
+        if not installed(mode):
+            print('  %-9s not installed, skipped' % mode)
+            continue
+        outdir = tempfile.mkdtemp(prefix='gpupeasy-bench-')
+        port = freePort()
+        proc = subprocess.Popen([sys.executable, '-c', SERVER_SCRIPT,
+                                 str(port), mode, os.path.join(outdir, 'l')],
+                                start_new_session=True,
+                                stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL)
+        prefix = 'http://127.0.0.1:%d' % port
+        while True:
+            try:
+                requests.get(prefix + '/availabledevices')
+                break
+            except requests.ConnectionError:
+                time.sleep(0.05)
+        # Job 1 occupies the only device for the whole run.
+        blocker = {'jobName': 'blocker', 'outFile': os.path.join(outdir, 'b'),
+                   'jobCommand': ['sleep', '600']}
+        requests.post(prefix + '/addnewjob', json={'job': blocker})
+        for endpoint in ['jobinfo', 'addnewjob']:
+            latencies, errors = loadTest(prefix, endpoint, outdir, clients,
+                                         seconds)
+            print('  %-9s /%-10s %8.0f req/s  p50 %6.2f ms  p99 %7.2f ms  '
+                  'errors %d' % (mode, endpoint, len(latencies) / seconds,
+                                 percentile(latencies, 0.5) * 1000,
+                                 percentile(latencies, 0.99) * 1000, errors))
+        # Takes the blocker job down with the server.
+        os.killpg(proc.pid, signal.SIGKILL)
+        proc.wait()
+
+
+if __name__ == '__main__':
+    main()
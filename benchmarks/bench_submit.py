@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# Measures job submission throughput: one /addnewjob request per job against a
+# single /addjobs request (JSON and NDJSON) for the whole batch.
+#
+# Usage:
+#   PYTHONPATH=. python benchmarks/bench_submit.py [NUM_JOBS]
+#
+# A GPUPeasyServer is started in-process on a free port. The only device is
+# kept busy so that submitted jobs just sit in the queue.
+import os
+import sys
+import json
+import time
+import socket
+import subprocess
+import tempfile
+import threading
+
+import requests
+
+from gpupeasy.core.server import GPUPeasyServer
+
+
+def freePort():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def makeJobs(outdir, tag, numJobs):
+    return [{'jobName': '%s%d' % (tag, i),
+             'outFile': os.path.join(outdir, '%s%d.out' % (tag, i)),
+             'jobCommand': ['true']} for i in range(numJobs)]
+
+
+def main():
+    numJobs = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    outdir = tempfile.mkdtemp(prefix='gpupeasy-bench-')
+    port = freePort()
+    server = GPUPeasyServer([''], logdir=os.path.join(outdir, 'logs'))
+    thr = threading.Thread(target=server.run, args=('127.0.0.1', port),
+                           daemon=True)
+    thr.start()
+    prefix = 'http://127.0.0.1:%d' % port
+    while True:
+        try:
+            requests.get(prefix + '/availabledevices')
+            break
+        except requests.ConnectionError:
+            time.sleep(0.05)
+    blocker = {'jobName': 'blocker', 'outFile': os.path.join(outdir, 'b'),
+               'jobCommand': ['sleep', '600']}
+    requests.post(prefix + '/addnewjob', json={'job': blocker})
+
+    jobs = makeJobs(outdir, 'single', numJobs)
+    start = time.perf_counter()
+    for job in jobs:
+        requests.post(prefix + '/addnewjob', json={'job': job})
+    single = time.perf_counter() - start
+
+    jobs = makeJobs(outdir, 'bulk', numJobs)
+    start = time.perf_counter()
+    resp = requests.post(prefix + '/addjobs', json={'jobs': jobs}).json()
+    bulk = time.perf_counter() - start
+    assert resp['numAdded'] == numJobs, resp['numFailed']
+
+    jobs = makeJobs(outdir, 'ndjson', numJobs)
+    body = '\n'.join(json.dumps(job) for job in jobs)
+    start = time.perf_counter()
+    resp = requests.post(prefix + '/addjobs', data=body,
+                         headers={'Content-Type': 'application/x-ndjson'})
+    ndjson = time.perf_counter() - start
+    assert resp.json()['numAdded'] == numJobs
+
+    print('jobs per run: %d' % numJobs)
+    for name, t in [('/addnewjob x N', single), ('/addjobs json', bulk),
+                    ('/addjobs ndjson', ndjson)]:
+        print('  %-16s %8.2fs  %10.0f jobs/sec' % (name, t, numJobs / t))
+    # The scheduler daemon and the blocker job are not stopped cleanly.
+    subprocess.run(['pkill', '-P', str(os.getpid()), 'sleep'])
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# Measures the throughput of gridgenerator.generator.summarizer, serial and
+# with a pool of worker processes, on a synthetic project, and of a second
+# summary served from the summary cache.
+#
+# Usage:
+#   PYTHONPATH=. python benchmarks/bench_summarize.py [--jobs N]
+#       [--lines N] [--latency MS] [--workers 2 4 ...]
+#
+# Every job directory gets a log of --lines training lines ending with the
+# final accuracy, which the extractor finds with a regular expression. A few
+# logs are not valid UTF-8, to check that they fail on their own. --latency
+# sleeps that many milliseconds before each log is read, to stand in for a
+# network filesystem; the pool only beats the serial path on CPU time with
+# more than one core.
+import io
+import os
+import re
+import time
+import shutil
+import argparse
+import tempfile
+import contextlib
+
+import pandas as pd
+
+from gridgenerator.generator import GridConfigBase, summarizer
+
+PROJ = 'bench'
+
+
+class BenchGrid(GridConfigBase):
+    def __init__(self, out_base_dir, latency=0.0):
+        super().__init__(out_base_dir, '/path/to/train.py',
+                         SUMMARY_KEYS=['accuracy', 'epochs'])
+        self.latency = latency
+
+    def extractor(self, keys, alldata):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        acc = re.findall(r'final accuracy: ([0-9.]+)', alldata)
+        epochs = re.findall(r'^epoch (\d+)', alldata, re.MULTILINE)
+        return {'accuracy': [float(acc[-1]) if acc else None],
+                'epochs': [int(epochs[-1]) if epochs else None]}
+
+
+def makeProject(base, numJobs, numLines, numBad):
+    proj = os.path.join(base, PROJ)
+    os.mkdir(proj)
+    dirs = []
+    for i in range(numJobs):
+        d = os.path.join(proj, '%s_job_%d' % (PROJ, i))
+        os.mkdir(d)
+        dirs.append(d)
+        log = os.path.join(d, 'gpupeasy_logs.out')
+        if i < numBad:
+            with open(log, 'wb') as fp:
+                fp.write(b'epoch 1 loss \xff\xfe\n')
+            continue
+        with open(log, 'w') as fp:
+            for e in range(numLines):
+                fp.write('epoch %d loss: %.4f accuracy: %.4f\n' %
+                         (e, 1.0 / (e + 1), e / numLines))
+            fp.write('final accuracy: %.4f\n' % (i / numJobs))
+    pd.DataFrame({'--seed': range(numJobs), 'JOB_DIR': dirs}).to_csv(
+        os.path.join(proj, PROJ + '.csv'), index=False)
+
+
+def timeSummary(cfg, workers, useCache=False):
+    start = time.perf_counter()
+    # Keep the progress bar and warnings out of the report.
+    with contextlib.redirect_stdout(io.StringIO()), \
+            contextlib.redirect_stderr(io.StringIO()):
+        df = summarizer(PROJ, cfg, workers=workers, use_cache=useCache)
+    return time.perf_counter() - start, df
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=3000)
+    parser.add_argument('--lines', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--workers', type=int, nargs='+', default=[2, 4, 8])
+    args = parser.parse_args()
+    base = tempfile.mkdtemp(prefix='gpupeasy-summ-')
+    try:
+        makeProject(base, args.jobs, args.lines, numBad=3)
+        cfg = BenchGrid(base, latency=args.latency / 1000.0)
+        print('%d logs of %d lines, %.0fms latency, %d cores:' %
+              (args.jobs, args.lines, args.latency, os.cpu_count()))
+        serial, expected = timeSummary(cfg, None)
+        print('  %-12s %8.0f files/s' % ('serial', args.jobs / serial))
+        for workers in args.workers:
+            elapsed, df = timeSummary(cfg, workers)
+            assert df.equals(expected), 'Summaries differ'
+            print('  %-12s %8.0f files/s  (%.1fx)' %
+                  ('%d workers' % workers, args.jobs / elapsed,
+                   serial / elapsed))
+        # The first run fills the cache, the second one reads it.
+        timeSummary(cfg, None, useCache=True)
+        elapsed, df = timeSummary(cfg, None, useCache=True)
+        assert df.equals(expected), 'Summaries differ'
+        print('  %-12s %8.0f files/s  (%.1fx)' %
+              ('cached', args.jobs / elapsed, serial / elapsed))
+        print('  failed logs: %d' % expected['accuracy'].isnull().sum())
+    finally:
+        shutil.rmtree(base)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+# Runs benchmark cases in processes of their own, for the benchmarks that
+# report peak memory (bench_gridgen.py, bench_gridconstraints.py,
+# bench_extract_stream.py). Not a benchmark itself.
+#
+# The peak RSS of a process never goes down, so comparing two cases in one
+# process would only show the larger. A benchmark re-executes itself with
+# `--child ARGS...` for every case; the child sets the case up, calls
+# measure() on the part to be measured and report()s the result as the last
+# line of its output, which run() reads back. The memory reported is the
+# peak RSS over the RSS just before the measured call, i.e. what the call
+# added to what the setup (imports, test data) had already taken.
+import os
+import sys
+import json
+import time
+import resource
+import contextlib
+import subprocess
+
+
+def maxrss():
+    # KB on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def measure(func, *args):
+    '''
+    Calls func(*args), with its output discarded, and returns
+    {'seconds', 'memory', 'value': what it returned}.
+    '''
+    rss0 = maxrss()
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(devnull):
+        value = func(*args)
+    elapsed = time.perf_counter() - start
+    return {'seconds': elapsed, 'memory': maxrss() - rss0, 'value': value}
+
+
+def report(result):
+    '''
+    Sends result, a JSON serializable dict, back to run().
+    '''
+    print(json.dumps(result))
+
+
+def run(script, *args):
+    '''
+    Runs `script --child args` in a new interpreter and returns the dict its
+    child reported.
+    '''
+    cmd = [sys.executable, script, '--child'] + [str(a) for a in args]
+    out = subprocess.run(cmd, check=True, stdout=subprocess.PIPE)
+    return json.loads(out.stdout.decode().strip().splitlines()[-1])
@@ -0,0 +1,499 @@
+import os
+import sys
+import time
+import signal
+import asyncio
+from gpupeasy.utils import Logger, LockedQueue, LockedFairShareQueue
+from gpupeasy.utils import EventBroadcaster, AsyncSubscription, signalGroup
+from gpupeasy.core.gpuscheduler import STATE_SCHEDULED, STATE_RUNNING
+from gpupeasy.core.gpuscheduler import STATE_SUCCEEDED, STATE_FAILED
+from gpupeasy.core.gpuscheduler import STATE_CANCELLED, STATE_KILLED
+from gpupeasy.core.gpuscheduler import LIST_OF_STATE, LIST_FAILED, RC_UNKNOWN
+from gpupeasy.core.placement import ResourcePool, selectJobs, visibleDevices
+from gpupeasy.core.placement import BEST_FIT, POLICIES
+
+
+class AsyncSchedulerCore:
+    '''
+    An asyncio implementation of the GPU scheduler core.
+
+    Each running job is a task awaiting its process; there is no daemon
+    thread and nothing is polled. A job is dispatched as soon as it is added
+    or a device is released. All methods must be called from the thread
+    running the event loop.
+
+    Public functions:
+        start()  (coroutine)
+        stop()  (coroutine)
+        submit(job)  (coroutine)
+        wait(jobID)  (coroutine)
+        addNewJob(job)
+        addNewJobs(jobs)
+        cancelJob(jobID)
+        killJob(jobID, gracesec)
+        rerunJobs(jobIDs)
+        # Setters and getters
+        setShareWeights(shareWeights)
+        getShareWeights()
+        getAvailableGPUList()
+        getDeviceUsage()
+        getJobsToSchedule()
+        getRunningJobs()
+        getSucceededJobs()
+        getFailedJobs()
+        getJobInfo(jobID)
+        getJobVersion(jobID)
+        getVersion()
+        getListVersion(listName)
+        subscribe()
+        unsubscribe(subscription)
+
+    Jobs are not journaled; use GPUSchedulerCore if queues have to survive a
+    restart.
+    '''
+    def __init__(self, availableGPU, maxQueueSize=10000, logger=None,
+                 shareWeights=None, deviceMemory=None, cpus=None,
+                 placement=BEST_FIT, backfill=True, killGracesec=10):
+        '''
+        availableGPU: A list of strings which specify the device ID of the
+            GPU's to use. See GPUSchedulerCore.
+        maxQueueSize: Maximum number of queued jobs. submit() waits for
+            room, addNewJobs() rejects what does not fit.
+        shareWeights: A dict mapping project tags to weights. See
+            GPUSchedulerCore.
+        deviceMemory, cpus, placement, backfill: How jobs are placed on the
+            devices. See GPUSchedulerCore.
+        killGracesec: Seconds killJob() waits after SIGTERM before sending
+            SIGKILL.
+        '''
+        self.__logger = logger
+        if logger is None:
+            self.__logger = Logger()
+        assert len(availableGPU) > 0, "Available GPU list is empty"
+        self.__pool = ResourcePool(availableGPU, deviceMemory=deviceMemory,
+                                   cpus=cpus)
+        assert placement in POLICIES, 'Unknown placement: %s' % placement
+        self.__placement = placement
+        self.__backfill = backfill
+        self.__maxQueueSize = int(maxQueueSize)
+        self.__killGracesec = float(killGracesec)
+        # jobid -> asyncio.TimerHandle of the SIGKILL, for jobs being killed.
+        self.__killing = {}
+        # jobid -> asyncio.TimerHandle that queues a job waiting to be
+        # retried.
+        self.__retrying = {}
+        self.__running = False
+        self.__lastJobId = 1
+        jobKey = lambda job: job.jobid
+        self.__toScheduleJobs = LockedFairShareQueue(
+            key=jobKey, priority=lambda job: -job.priority,
+            tag=lambda job: job.project)
+        if shareWeights is not None:
+            self.setShareWeights(shareWeights)
+        self.__runningJobs = LockedQueue(key=jobKey)
+        self.__succeededJobs = LockedQueue(key=jobKey)
+        self.__failedJobs = LockedQueue(key=jobKey)
+        # jobid -> (job, state, version), as in GPUSchedulerCore.
+        self.__jobIndex = {}
+        self.__version = 0
+        self.__listVersion = {name: 0 for name in LIST_OF_STATE.values()}
+        # jobid -> future resolved with the return code, for jobs that have
+        # not finished yet.
+        self.__futures = {}
+        # Running job tasks. Referenced here so that they are not garbage
+        # collected while they wait.
+        self.__tasks = set()
+        # Set when jobs leave the queue; submit() waits on it when full.
+        self.__roomEvent = None
+        self.__events = EventBroadcaster(subscription=AsyncSubscription)
+
+    def __installChildWatcher(self, loop):
+        # Before Python 3.12, asyncio waits for every child in a thread of its
+        # own. A pidfd watcher waits for them on the event loop instead. From
+        # 3.12 this is the default.
+        if sys.version_info >= (3, 12) or not hasattr(os, 'pidfd_open'):
+            return
+        try:
+            os.close(os.pidfd_open(os.getpid()))
+        except OSError:
+            self.__logger.pWarn('pidfd not available. Child processes are',
+                                'watched by one thread each')
+            return
+        watcher = asyncio.PidfdChildWatcher()
+        watcher.attach_loop(loop)
+        asyncio.set_child_watcher(watcher)
+
+    def __getNewJobId(self):
+        val = self.__lastJobId
+        self.__lastJobId += 1
+        return val
+
+    def __setJobState(self, job, state):
+        self.__version += 1
+        version = self.__version
+        prev = self.__jobIndex.get(job.jobid)
+        self.__jobIndex[job.jobid] = (job, state, version)
+        self.__listVersion[LIST_OF_STATE[state]] = version
+        if prev is not None:
+            self.__listVersion[LIST_OF_STATE[prev[1]]] = version
+        if len(self.__events) > 0:
+            event = {'type': 'job', 'version': version, 'jobID': job.jobid,
+                     'jobName': job.name,
+                     'jobCommand': ' '.join(job.commandList),
+                     'state': state, 'gpu': job.gpu, 'devices': job.devices,
+                     'returnCode': job.returncode, 'priority': job.priority,
+                     'project': job.project}
+            self.__events.publish(event)
+
+    def __publishDevice(self, gpu, idle, job=None):
+        if len(self.__events) == 0:
+            return
+        event = {'type': 'device', 'version': self.__version, 'gpu': gpu,
+                 'idle': idle, 'jobID': None if job is None else job.jobid}
+        self.__events.publish(event)
+
+    def __dispatch(self):
+        '''
+        Starts the queued jobs that fit on the devices.
+        '''
+        if not self.__running:
+            return
+        placed = selectJobs(self.__pool, self.__toScheduleJobs,
+                            policy=self.__placement, backfill=self.__backfill)
+        for job, devices in placed:
+            task = asyncio.create_task(self.__runJob(job, devices))
+            self.__tasks.add(task)
+            task.add_done_callback(self.__tasks.discard)
+        if len(placed) > 0:
+            self.__roomEvent.set()
+
+    async def __runJob(self, job, devices):
+        gpu = visibleDevices(devices)
+        self.__logger.pInfo("Scheduling", job, "on gpu ", gpu)
+        env = os.environ.copy()
+        env["CUDA_VISIBLE_DEVICES"] = gpu
+        try:
+            job.openFiles()
+            job.startedAt = time.time()
+            proc = await asyncio.create_subprocess_exec(
+                *job.commandList, stdin=None, stdout=job.stdout,
+                stderr=asyncio.subprocess.STDOUT, env=env,
+                start_new_session=True)
+        except (OSError, ValueError) as e:
+            self.__logger.pError("Scheduling failed for", job, "on gpu", gpu)
+            self.__logger.pError("%s:" % type(e).__name__, str(e))
+            job.gpu = gpu
+            job.devices = devices
+            self.__finishJob(job, -1)
+            return
+        job.subprocess = proc
+        job.gpu = gpu
+        job.devices = devices
+        self.__runningJobs.append(job)
+        self.__setJobState(job, STATE_RUNNING)
+        for device in devices:
+            self.__publishDevice(device, False, job)
+        rt = await proc.wait()
+        self.__runningJobs.remove(job.jobid)
+        self.__finishJob(job, rt)
+
+    def __finishJob(self, job, rt):
+        job.returncode = rt
+        job.closeFiles()
+        timer = self.__killing.pop(job.jobid, None)
+        if timer is not None:
+            timer.cancel()
+            try:
+                # Whatever the job started and left behind.
+                os.killpg(job.subprocess.pid, signal.SIGKILL)
+            except OSError:
+                pass
+            self.__logger.pWarn("Process", job, "killed")
+            state = STATE_KILLED
+        elif rt != 0:
+            self.__logger.pWarn("Process", job,
+                                "exited with return code: %d" % rt)
+            state = STATE_FAILED
+        else:
+            self.__logger.pSuccess("Process", job,
+                                   "exited with return code: %d" % rt)
+            state = STATE_SUCCEEDED
+        for gpu, idle, _ in self.__pool.release(job):
+            self.__publishDevice(gpu, idle)
+        job.recordAttempt(state)
+        delay = job.retryDelay() if state == STATE_FAILED else None
+        if delay is not None:
+            self.__retryLater(job, delay)
+            self.__dispatch()
+            return
+        if state == STATE_SUCCEEDED:
+            self.__succeededJobs.append(job)
+        else:
+            self.__failedJobs.append(job)
+        self.__setJobState(job, state)
+        future = self.__futures.pop(job.jobid, None)
+        if future is not None and not future.done():
+            future.set_result(rt)
+        self.__dispatch()
+
+    def __retryLater(self, job, delay):
+        self.__logger.pWarn("Retrying", job, "in %d seconds" % delay)
+        job.reset()
+        job.retryAt = time.time() + delay
+        self.__setJobState(job, STATE_SCHEDULED)
+        loop = asyncio.get_running_loop()
+        self.__retrying[job.jobid] = loop.call_later(delay, self.__requeue,
+                                                     job)
+
+    def __requeue(self, job):
+        del self.__retrying[job.jobid]
+        job.retryAt = None
+        self.__toScheduleJobs.append(job)
+        self.__dispatch()
+
+    def __escalateKill(self, job):
+        if job.subprocess.returncode is not None:
+            return
+        self.__logger.pWarn("Process", job, "ignored SIGTERM. Sending",
+                            "SIGKILL")
+        signalGroup(job.subprocess.pid, signal.SIGKILL)
+
+    def cancelJob(self, jobID):
+        '''
+        Removes a queued job from the queue, see GPUSchedulerCore.cancelJob.
+        Its future resolves to RC_UNKNOWN. Returns (success, message).
+        '''
+        job, state = self.getJobInfo(jobID)
+        if job is None:
+            return False, 'Job not found'
+        if state != STATE_SCHEDULED:
+            return False, 'Job is not queued (%s)' % state
+        queued = self.__toScheduleJobs.remove(job.jobid) is not None
+        timer = self.__retrying.pop(job.jobid, None)
+        if timer is not None:
+            timer.cancel()
+        elif not queued:
+            # Placed, and its process is being started.
+            return False, 'Job is starting'
+        job.retryAt = None
+        job.returncode = RC_UNKNOWN
+        self.__failedJobs.append(job)
+        self.__setJobState(job, STATE_CANCELLED)
+        self.__logger.pInfo("Cancelled", job)
+        future = self.__futures.pop(job.jobid, None)
+        if future is not None and not future.done():
+            future.set_result(RC_UNKNOWN)
+        self.__roomEvent.set()
+        return True, 'Job cancelled'
+
+    def killJob(self, jobID, gracesec=None):
+        '''
+        Kills a running job, see GPUSchedulerCore.killJob. Returns (success,
+        message).
+        '''
+        job, state = self.getJobInfo(jobID)
+        if job is None:
+            return False, 'Job not found'
+        if state != STATE_RUNNING:
+            return False, 'Job is not running (%s)' % state
+        if job.jobid in self.__killing:
+            return True, 'Job is being killed'
+        if gracesec is None:
+            gracesec = self.__killGracesec
+        loop = asyncio.get_running_loop()
+        self.__killing[job.jobid] = loop.call_later(
+            float(gracesec), self.__escalateKill, job)
+        self.__logger.pWarn("Killing", job)
+        signalGroup(job.subprocess.pid, signal.SIGTERM)
+        return True, 'Job is being killed'
+
+    def rerunJobs(self, jobIDs):
+        '''
+        Puts failed jobs back in the queue, see GPUSchedulerCore.rerunJobs.
+        Returns a list with a (success, message) pair for each job.
+        '''
+        ret = []
+        loop = asyncio.get_running_loop()
+        for jobID in jobIDs:
+            job, state = self.getJobInfo(jobID)
+            if job is None:
+                ret.append((False, 'Job not found'))
+                continue
+            if LIST_OF_STATE[state] != LIST_FAILED:
+                ret.append((False, 'Job has not failed (%s)' % state))
+                continue
+            if len(self.__toScheduleJobs) >= self.__maxQueueSize:
+                ret.append((False, 'Queue full'))
+                continue
+            if self.__failedJobs.remove(job.jobid) is None:
+                ret.append((False, 'Job has not failed'))
+                continue
+            job.reset()
+            self.__futures[job.jobid] = loop.create_future()
+            self.__setJobState(job, STATE_SCHEDULED)
+            self.__toScheduleJobs.append(job)
+            self.__logger.pInfo("Re-running", job)
+            ret.append((True, 'Job queued'))
+        self.__dispatch()
+        return ret
+
+    async def start(self):
+        '''
+        Starts scheduling on the running event loop. Returns True on success
+        and False on failure.
+        '''
+        if self.__running:
+            self.__logger.pError('Scheduler already running')
+            return False
+        self.__installChildWatcher(asyncio.get_running_loop())
+        self.__roomEvent = asyncio.Event()
+        self.__running = True
+        self.__logger.pInfo("Scheduler started")
+        self.__dispatch()
+        return True
+
+    async def stop(self):
+        '''
+        Stops scheduling. Jobs that are running are left running but are no
+        longer waited for; their futures, and those of queued jobs, are
+        cancelled.
+        '''
+        self.__running = False
+        self.__logger.pInfo('Stop received')
+        tasks = list(self.__tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for timer in self.__retrying.values():
+            timer.cancel()
+        self.__retrying = {}
+        for future in self.__futures.values():
+            future.cancel()
+        self.__futures = {}
+        self.__roomEvent.set()
+        self.__logger.pInfo('Scheduler stopped')
+
+    def addNewJob(self, job):
+        return self.addNewJobs([job])[0]
+
+    def addNewJobs(self, jobs):
+        '''
+        Adds a batch of jobs to the queue without waiting. Returns a list
+        with a (success, jobid) pair for each job. Jobs that do not fit in
+        the queue are rejected with (False, None).
+        '''
+        if not self.__running:
+            self.__logger.pWarn('Add job attempted while scheduler not running')
+            return [(False, None)] * len(jobs)
+        room = self.__maxQueueSize - len(self.__toScheduleJobs)
+        accepted = jobs[:max(room, 0)]
+        loop = asyncio.get_running_loop()
+        for job in accepted:
+            job.jobid = self.__getNewJobId()
+            self.__futures[job.jobid] = loop.create_future()
+            self.__setJobState(job, STATE_SCHEDULED)
+        self.__toScheduleJobs.extend(accepted)
+        if len(accepted) < len(jobs):
+            self.__logger.pError("Adding %d new job(s) failed. Queue full." %
+                                 (len(jobs) - len(accepted)))
+        self.__dispatch()
+        ret = [(True, job.jobid) for job in accepted]
+        ret += [(False, None)] * (len(jobs) - len(accepted))
+        return ret
+
+    async def submit(self, job):
+        '''
+        Adds job to the queue, waiting for room if the queue is full.
+        Returns an asyncio.Future that resolves to the return code of the
+        job once it exits:
+
+            future = await core.submit(job)
+            returncode = await future
+        '''
+        while len(self.__toScheduleJobs) >= self.__maxQueueSize:
+            if not self.__running:
+                break
+            self.__roomEvent.clear()
+            await self.__roomEvent.wait()
+        ret, jobid = self.addNewJob(job)
+        if ret is False:
+            raise RuntimeError('Scheduler not running')
+        return self.__futures[jobid]
+
+    async def wait(self, jobID):
+        '''
+        Waits for the job to exit and returns its return code. Returns None
+        if the job is not known.
+        '''
+        job, state = self.getJobInfo(jobID)
+        if job is None:
+            return None
+        if job.jobid in self.__futures:
+            # Shielded: a cancelled waiter must not cancel the job's future.
+            return await asyncio.shield(self.__futures[job.jobid])
+        return job.returncode
+
+    def setShareWeights(self, shareWeights):
+        self.__toScheduleJobs.setWeights(shareWeights)
+
+    def getShareWeights(self):
+        return self.__toScheduleJobs.getWeights()
+
+    def getAvailableGPUList(self):
+        return self.__pool.getSlots()
+
+    def getDeviceUsage(self):
+        return self.__pool.getUsage()
+
+    def getJobsToSchedule(self):
+        return self.__toScheduleJobs.getCurrVals()
+
+    def getRunningJobs(self):
+        return self.__runningJobs.getCurrVals()
+
+    def getSucceededJobs(self):
+        return self.__succeededJobs.getCurrVals()
+
+    def getFailedJobs(self):
+        return self.__failedJobs.getCurrVals()
+
+    def getJobInfo(self, jobID):
+        '''
+        Returns (job, state), or (None, None) if the job is not known.
+        '''
+        try:
+            jobID = int(jobID)
+        except (TypeError, ValueError):
+            return None, None
+        ret = self.__jobIndex.get(jobID)
+        if ret is None:
+            return None, None
+        return ret[0], ret[1]
+
+    def getJobVersion(self, jobID):
+        '''
+        Returns the version of the last state transition of the job, None if
+        the job is not known.
+        '''
+        ret = self.__jobIndex.get(jobID)
+        return None if ret is None else ret[2]
+
+    def getVersion(self):
+        return self.__version
+
+    def getListVersion(self, listName):
+        '''
+        Returns the version of the last change to the listName listing, 0 if
+        it never changed.
+        '''
+        return self.__listVersion[listName]
+
+    def subscribe(self):
+        '''
+        Returns a gpupeasy.utils.AsyncSubscription receiving the job and
+        device events described in GPUSchedulerCore.subscribe().
+        '''
+        return self.__events.subscribe()
+
+    def unsubscribe(self, subscription):
+        self.__events.unsubscribe(subscription)
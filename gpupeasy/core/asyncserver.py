@@ -0,0 +1,350 @@
+import os
+import json
+import asyncio
+
+from gpupeasy.core.asyncscheduler import AsyncSchedulerCore
+from gpupeasy.core.gpuscheduler import LIST_SCHEDULED, LIST_SUCCEEDED
+from gpupeasy.core.gpuscheduler import LIST_FAILED, LIST_RUNNING
+from gpupeasy.core.gpuscheduler import STATE_RUNNING
+from gpupeasy.core.server import jobToDict, parseJob, releaseOutFile
+from gpupeasy.core.server import parseJobBatch, addParsedJobs
+from gpupeasy.utils import Logger, formatSSE
+
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+
+
+class AsyncPeasyServer:
+    '''
+    The asyncio counterpart of GPUPeasyServer. An AsyncSchedulerCore and an
+    aiohttp server share one event loop, so open connections and running
+    jobs cost no threads.
+
+    Serves the job end-points of GPUPeasyServer, so the web GUI works with
+    either, but not those that change the devices (/setdevices,
+    /adddevices, /removedevices, /draindevices, /undraindevices) nor those
+    of worker nodes (/worker/register, /worker/heartbeat, /workers): the
+    devices are fixed when the server starts. Jobs are not journaled and
+    cannot be snapshot. Listings are always returned whole (with 'full'
+    set), and /waitjob/<jobID> additionally waits for a job to exit.
+
+    Requires aiohttp (pip install aiohttp).
+    '''
+    def __init__(self, gpuList, logdir=None, debug=False, shareWeights=None,
+                 maxQueueSize=10000, deviceMemory=None, cpus=None,
+                 placement='best', backfill=True, killGracesec=10):
+        '''
+        gpuList: A list of gpu devices provided as an argument to
+            CUDA_VISIBLE_DEVICES environment variable. See GPUPeasyServer.
+        logdir: The directory to dump logs. Defaults to '/tmp/gpupeasy/'.
+        debug: To run in debug mode.
+        shareWeights: A dict mapping project tags to their share of the
+            devices. See GPUSchedulerCore.
+        maxQueueSize: Maximum number of queued jobs.
+        deviceMemory, cpus, placement, backfill: How jobs are placed on the
+            devices. See GPUPeasyServer.
+        killGracesec: Seconds /killjob waits after SIGTERM before sending
+            SIGKILL.
+        '''
+        if web is None:
+            raise ImportError('aiohttp is not installed. Install it with '
+                              '`pip install aiohttp` or use GPUPeasyServer')
+        self.__debug = debug
+        self.__setupLogging(logdir, debug)
+        self.__backend = AsyncSchedulerCore(gpuList, logger=self.__logger,
+                                            shareWeights=shareWeights,
+                                            maxQueueSize=maxQueueSize,
+                                            deviceMemory=deviceMemory,
+                                            cpus=cpus, placement=placement,
+                                            backfill=backfill,
+                                            killGracesec=killGracesec)
+        self.__frontend = web.Application()
+        fe = self.__frontend
+        fe.router.add_get('/deviceutilization', self.__getDeviceUtilization)
+        fe.router.add_get('/scheduledjobs', self.__getScheduledJobs)
+        fe.router.add_get('/successfuljobs', self.__getSuccessfulJobs)
+        fe.router.add_get('/failedjobs', self.__getFailedJobs)
+        fe.router.add_get('/runningjobs', self.__getRunningJobs)
+        fe.router.add_post('/addnewjob', self.__addNewJob)
+        fe.router.add_post('/addjobs', self.__addJobs)
+        fe.router.add_get('/availabledevices', self.__getAvailableGPUList)
+        fe.router.add_get('/jobinfo/{jobID}', self.__getJobInfo)
+        fe.router.add_get('/waitjob/{jobID}', self.__waitJob)
+        fe.router.add_post('/canceljob/{jobID}', self.__cancelJob)
+        fe.router.add_post('/killjob/{jobID}', self.__killJob)
+        fe.router.add_post('/rerun', self.__rerunJobs)
+        fe.router.add_get('/events', self.__getEvents)
+        fe.on_startup.append(self.__onStartup)
+        fe.on_shutdown.append(self.__onShutdown)
+        # Seconds between keep-alive comments on idle event streams.
+        self.__keepalivesec = 15
+
+    def __setupLogging(self, logdir, debug):
+        if logdir is None:
+            logdir = '/tmp/gpupeasy/'
+        if not os.path.exists(logdir):
+            os.makedirs(logdir)
+        logfile = logdir + '/logs.out'
+        logfile = open(logfile, 'a+')
+        self.__logger = Logger(fstdout=logfile, debug=debug)
+
+    async def __onStartup(self, app):
+        await self.__backend.start()
+
+    async def __onShutdown(self, app):
+        await self.__backend.stop()
+
+    # URL Handlers
+    async def __getAvailableGPUList(self, request):
+        ret = self.__backend.getAvailableGPUList()
+        return web.json_response({'status': 'successful', 'value': ret})
+
+    async def __getDeviceUtilization(self, request):
+        jobs = []
+        for job in self.__backend.getRunningJobs():
+            jobs.append({'jobID': job.jobid, 'jobName': job.name,
+                         'jobCommand': ' '.join(job.commandList),
+                         'gpu': job.gpu, 'devices': job.devices,
+                         'gpuShare': job.gpuShare})
+        return web.json_response({'status': 'successful', 'value': jobs,
+                                  'devices': self.__backend.getDeviceUsage()})
+
+    def __listJobs(self, request, listName, getter):
+        '''
+        Common handler for the job listings. Responds 304 to a matching
+        If-None-Match. ?since= and ?limit= are accepted for compatibility
+        with GPUPeasyServer but the whole listing is always returned, with
+        'full' set.
+        '''
+        backend = self.__backend
+        version = backend.getListVersion(listName)
+        etag = '"%s-%d"' % (listName, version)
+        headers = {'ETag': etag}
+        inm = request.headers.get('If-None-Match', '')
+        if etag in [x.strip() for x in inm.split(',')]:
+            return web.Response(status=304, headers=headers)
+        jobs = []
+        for job in getter():
+            jobD = jobToDict(job)
+            jobD['version'] = backend.getJobVersion(job.jobid)
+            jobs.append(jobD)
+        ret = {'status': 'successful', 'value': jobs, 'version': version}
+        if 'since' in request.query or 'limit' in request.query:
+            ret.update(removed=[], more=False, full=True)
+        return web.json_response(ret, headers=headers)
+
+    async def __getScheduledJobs(self, request):
+        return self.__listJobs(request, LIST_SCHEDULED,
+                               self.__backend.getJobsToSchedule)
+
+    async def __getSuccessfulJobs(self, request):
+        return self.__listJobs(request, LIST_SUCCEEDED,
+                               self.__backend.getSucceededJobs)
+
+    async def __getFailedJobs(self, request):
+        return self.__listJobs(request, LIST_FAILED,
+                               self.__backend.getFailedJobs)
+
+    async def __getRunningJobs(self, request):
+        return self.__listJobs(request, LIST_RUNNING,
+                               self.__backend.getRunningJobs)
+
+    async def __getJobInfo(self, request):
+        jobID = request.match_info['jobID']
+        job, state = self.__backend.getJobInfo(jobID)
+        if job is None:
+            msg = {'status': 'failed', 'value': {},
+                   'message': 'Job (jobid :%s) jot found' % jobID}
+            return web.json_response(msg)
+        msg = {'status': 'successful',
+               'value': {
+                   'jobid': job.jobid,
+                   'jobName': job.name,
+                   'jobCommand': ' '.join(job.commandList),
+                   'outFile': job.stdoutF,
+                   'status': state,
+                   'returnCode': job.returncode,
+                   'priority': job.priority,
+                   'project': job.project,
+                   'gpu': job.gpu,
+                   'devices': job.devices,
+                   'gpus': job.gpus,
+                   'gpuShare': job.gpuShare,
+                   'memory': job.memory,
+                   'cpus': job.cpus,
+                   'pid': None,
+                   'retry': None if job.retry is None else job.retry.toDict(),
+                   'retryAt': job.retryAt,
+                   'attempts': job.attempts,
+               },
+               'message': {}}
+        if state == STATE_RUNNING:
+            msg['value']['pid'] = job.subprocess.pid
+        return web.json_response(msg)
+
+    async def __cancelJob(self, request):
+        ret, msg = self.__backend.cancelJob(request.match_info['jobID'])
+        status = 'successful' if ret else 'failed'
+        return web.json_response({'status': status, 'message': msg})
+
+    async def __rerunJobs(self, request):
+        failed = {'status': 'failed'}
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        if not isinstance(data, dict) or 'jobIDs' not in data:
+            failed['message'] = 'Key \'jobIDs\' required'
+            return web.json_response(failed)
+        jobIDs = data['jobIDs']
+        if not isinstance(jobIDs, list):
+            failed['message'] = 'jobIDs should be a list'
+            return web.json_response(failed)
+        results = self.__backend.rerunJobs(jobIDs)
+        value = [{'jobID': jobID, 'message': msg,
+                  'status': 'successful' if ok else 'failed'}
+                 for jobID, (ok, msg) in zip(jobIDs, results)]
+        return web.json_response({'status': 'successful', 'value': value,
+                                  'numRequeued': sum(ok for ok, _ in results)})
+
+    async def __killJob(self, request):
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        gracesec = (data or {}).get('gracesec', None)
+        if gracesec is not None:
+            try:
+                gracesec = float(gracesec)
+            except (TypeError, ValueError):
+                gracesec = -1
+            if gracesec < 0:
+                return web.json_response({'status': 'failed', 'message':
+                                          'gracesec should be a '
+                                          'non-negative number'})
+        ret, msg = self.__backend.killJob(request.match_info['jobID'],
+                                          gracesec=gracesec)
+        status = 'successful' if ret else 'failed'
+        return web.json_response({'status': status, 'message': msg})
+
+    async def __waitJob(self, request):
+        '''
+        Responds once the job has exited:
+            {'status': 'successful' or 'failed',
+             'value': {'jobid': jobid, 'returnCode': returnCode}}
+        '''
+        jobID = request.match_info['jobID']
+        job, _ = self.__backend.getJobInfo(jobID)
+        if job is None:
+            msg = {'status': 'failed', 'value': {},
+                   'message': 'Job (jobid :%s) jot found' % jobID}
+            return web.json_response(msg)
+        returncode = await self.__backend.wait(job.jobid)
+        msg = {'status': 'successful',
+               'value': {'jobid': job.jobid, 'returnCode': returncode}}
+        return web.json_response(msg)
+
+    async def __addNewJob(self, request):
+        '''
+        See GPUPeasyServer's /addnewjob.
+        '''
+        failed = {'status': 'failed'}
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            failed['message'] = 'No JSON data was found'
+            return web.json_response(failed)
+        if 'job' not in data:
+            failed['message'] = 'Key \'job\' not found'
+            return web.json_response(failed)
+        # parseJob creates the output file: keep the disk off the loop.
+        loop = asyncio.get_running_loop()
+        job, msg = await loop.run_in_executor(None, parseJob, data['job'])
+        if job is None:
+            failed['message'] = msg
+            return web.json_response(failed)
+        ret, jobid = self.__backend.addNewJob(job)
+        if ret is False:
+            await loop.run_in_executor(None, releaseOutFile, job)
+            msg = 'Could not add new job: %s. Check logs for details' % job.name
+            failed['message'] = msg
+            return web.json_response(failed)
+        success = {'status': 'successful', 'message': 'Job added successfully',
+                   'jobID': jobid}
+        return web.json_response(success)
+
+    async def __addJobs(self, request):
+        '''
+        See GPUPeasyServer's /addjobs. Accepts json and NDJSON bodies.
+        '''
+        failed = {'status': 'failed'}
+        if request.content_type == 'application/x-ndjson':
+            try:
+                lines = (await request.text()).splitlines()
+                jobList = [json.loads(x) for x in lines if len(x.strip()) > 0]
+            except ValueError as e:
+                failed['message'] = 'Malformed NDJSON: %s' % str(e)
+                return web.json_response(failed)
+        else:
+            try:
+                data = await request.json()
+            except ValueError:
+                data = None
+            if not isinstance(data, dict):
+                failed['message'] = 'No JSON data was found'
+                return web.json_response(failed)
+            if 'jobs' not in data or not isinstance(data['jobs'], list):
+                failed['message'] = 'Key \'jobs\' not found'
+                return web.json_response(failed)
+            jobList = data['jobs']
+        loop = asyncio.get_running_loop()
+        results, parsed = await loop.run_in_executor(None, parseJobBatch,
+                                                     jobList)
+        return web.json_response(addParsedJobs(self.__backend, results,
+                                               parsed))
+
+    async def __getEvents(self, request):
+        '''
+        A server-sent event stream of job and device changes. See
+        GPUPeasyServer's /events.
+        '''
+        backend = self.__backend
+        sub = backend.subscribe()
+        resp = web.StreamResponse(headers={'Content-Type': 'text/event-stream',
+                                           'Cache-Control': 'no-cache',
+                                           'X-Accel-Buffering': 'no'})
+        try:
+            await resp.prepare(request)
+            msg = {'version': backend.getVersion()}
+            await resp.write(formatSSE(msg, event='hello').encode())
+            while True:
+                event = await sub.get(timeout=self.__keepalivesec)
+                if sub.overflowed:
+                    sub.clearOverflow()
+                    msg = {'version': backend.getVersion()}
+                    msg = formatSSE(msg, event='resync')
+                elif event is None:
+                    msg = ': keep-alive\n\n'
+                else:
+                    msg = formatSSE(event, event=event['type'],
+                                    eventId=event['version'])
+                await resp.write(msg.encode())
+        except (ConnectionResetError, ConnectionError):
+            pass
+        finally:
+            backend.unsubscribe(sub)
+        return resp
+
+    def run(self, host, port):
+        self.__logger.pDebug('Starting GPUPeasy async server on %s:%s' %
+                             (host, port))
+        web.run_app(self.__frontend, host=host, port=int(port), print=None)
+
+
+if __name__ == '__main__':
+    gpu = AsyncPeasyServer(['0', '1'], debug=True)
+    gpu.run(host='0.0.0.0', port='8888')
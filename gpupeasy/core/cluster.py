@@ -0,0 +1,205 @@
+import time
+import signal
+import threading
+from gpupeasy.utils import Logger
+from gpupeasy.core.gpuscheduler import launchLocal
+
+
+class RemoteProcess:
+    '''
+    Stands in for subprocess.Popen for a job that runs on a worker node.
+    returncode is set when the node reports the job as finished; lost is set
+    if the node dies (or never starts the job), which makes the core
+    re-queue it. kill() has the node kill the job on its next heartbeat.
+    '''
+    def __init__(self, node):
+        self.pid = None
+        self.node = node
+        self.returncode = None
+        self.lost = False
+        self.killed = False
+
+    def poll(self):
+        return self.returncode
+
+    def kill(self):
+        self.killed = True
+
+
+class Cluster:
+    '''
+    Book keeping of a coordinator: the worker nodes, their devices and the
+    jobs running on them.
+
+    Workers pull their work. A worker registers its devices (in the gpuList
+    format) and then sends a heartbeat every heartbeatsec seconds, reporting
+    the jobs it runs and the ones that finished. The reply lists the jobs it
+    should start and the ones it should kill. A node that misses heartbeats
+    for deadsec seconds is considered dead: its devices are removed and its
+    jobs are re-queued.
+
+    The devices of a node are added to the core as '<node>/<device>'. launch()
+    is meant to be the launcher of the GPUSchedulerCore; jobs on devices
+    without a node prefix are started locally.
+
+    Public functions:
+        start(core)
+        stop()
+        launch(job, gpu)
+        register(name, devices)
+        heartbeat(name, running, finished)
+        getNodes()
+    '''
+    def __init__(self, heartbeatsec=2, deadsec=10, logger=None):
+        '''
+        heartbeatsec: Seconds between heartbeats of a worker.
+        deadsec: Seconds without heartbeat after which a node is dead.
+        '''
+        self.__logger = logger
+        if logger is None:
+            self.__logger = Logger()
+        assert deadsec > heartbeatsec, 'deadsec should exceed heartbeatsec'
+        self.heartbeatsec = heartbeatsec
+        self.__deadsec = deadsec
+        self.__core = None
+        # name -> {'devices', 'lastSeen', 'pending', 'jobs'}. pending are
+        # (job, gpu, RemoteProcess) not yet handed to the node; jobs maps the
+        # jobids handed to it to their RemoteProcess.
+        self.__nodes = {}
+        self.__mutex = threading.Lock()
+        self.__quit = threading.Event()
+        self.__monitorThr = None
+
+    @staticmethod
+    def deviceName(node, gpu):
+        return '%s/%s' % (node, gpu)
+
+    def start(self, core):
+        self.__core = core
+        self.__quit.clear()
+        self.__monitorThr = threading.Thread(target=self.__monitorThread,
+                                             name='cluster-monitor',
+                                             daemon=True)
+        self.__monitorThr.start()
+
+    def stop(self):
+        self.__quit.set()
+        if self.__monitorThr is not None:
+            self.__monitorThr.join()
+            self.__monitorThr = None
+
+    def launch(self, job, gpu):
+        node, sep, local = gpu.partition('/')
+        if sep == '':
+            return launchLocal(job, gpu)
+        with self.__mutex:
+            proc = RemoteProcess(node)
+            if node not in self.__nodes:
+                # Died since the device was handed out.
+                proc.lost = True
+                return proc
+            self.__nodes[node]['pending'].append((job, local, proc))
+        return proc
+
+    def register(self, name, devices):
+        '''
+        Registers a node and adds its devices. A node registering again
+        (restarted, or declared dead) starts afresh: jobs it had are
+        re-queued.
+        '''
+        if '/' in name or len(name) == 0:
+            raise ValueError('Invalid worker name: %s' % name)
+        self.__dropNode(name, 'registered again')
+        with self.__mutex:
+            self.__nodes[name] = {'devices': list(devices),
+                                  'lastSeen': time.monotonic(),
+                                  'pending': [], 'jobs': {}}
+        self.__core.addDevices([Cluster.deviceName(name, gpu)
+                                for gpu in devices])
+        self.__logger.pInfo('Worker', name, 'registered with devices',
+                            devices)
+
+    def heartbeat(self, name, running, finished):
+        '''
+        running: jobids running on the node.
+        finished: (jobid, returncode) of jobs that exited since the last
+            acknowledged heartbeat.
+
+        Returns (launch, kill): the (job, device) pairs to start and the
+        jobids to kill. Returns (None, None) if the node is not registered.
+        '''
+        changed = False
+        with self.__mutex:
+            node = self.__nodes.get(name)
+            if node is None:
+                return None, None
+            node['lastSeen'] = time.monotonic()
+            jobs = node['jobs']
+            for jobid, returncode in finished:
+                proc = jobs.pop(jobid, None)
+                if proc is not None:
+                    proc.returncode = returncode
+                    changed = True
+            running = set(running)
+            for jobid in list(jobs.keys()):
+                if jobs[jobid].killed:
+                    # Left out of jobs, so it is in the kill list below.
+                    jobs.pop(jobid).returncode = -signal.SIGKILL
+                    changed = True
+                elif jobid not in running:
+                    # Handed out but never started, e.g. the reply was lost.
+                    jobs.pop(jobid).lost = True
+                    changed = True
+            kill = [jobid for jobid in running if jobid not in jobs]
+            launch = []
+            for job, gpu, proc in node['pending']:
+                if proc.killed:
+                    proc.returncode = -signal.SIGKILL
+                    changed = True
+                    continue
+                jobs[job.jobid] = proc
+                launch.append((job, gpu))
+            node['pending'] = []
+        if changed:
+            self.__core.wake()
+        return launch, kill
+
+    def getNodes(self):
+        '''
+        Returns {name: {'devices', 'lastSeen' (seconds ago), 'jobs'}}.
+        '''
+        now = time.monotonic()
+        ret = {}
+        with self.__mutex:
+            for name, node in self.__nodes.items():
+                jobs = list(node['jobs'].keys())
+                jobs += [job.jobid for job, _, _ in node['pending']]
+                ret[name] = {'devices': list(node['devices']),
+                             'lastSeen': now - node['lastSeen'],
+                             'jobs': sorted(jobs)}
+        return ret
+
+    def __dropNode(self, name, reason):
+        with self.__mutex:
+            node = self.__nodes.pop(name, None)
+        if node is None:
+            return
+        self.__logger.pWarn('Worker', name, reason + '. Re-queuing its jobs')
+        # Remove the devices first so that the lost jobs do not release
+        # them back into the pool.
+        self.__core.removeDevices([Cluster.deviceName(name, gpu)
+                                   for gpu in node['devices']])
+        for proc in node['jobs'].values():
+            proc.lost = True
+        for _, _, proc in node['pending']:
+            proc.lost = True
+        self.__core.wake()
+
+    def __monitorThread(self):
+        while not self.__quit.wait(self.heartbeatsec):
+            now = time.monotonic()
+            with self.__mutex:
+                dead = [name for name, node in self.__nodes.items()
+                        if now - node['lastSeen'] > self.__deadsec]
+            for name in dead:
+                self.__dropNode(name, 'missed heartbeats')
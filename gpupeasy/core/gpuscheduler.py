@@ -1,35 +1,161 @@
 import sys
 import os
 import time
+import heapq
+import signal
 import threading
 import subprocess
-from gpupeasy.utils import Logger, LockedList
+from collections import Counter
+from gpupeasy.utils import Logger, LockedQueue
+from gpupeasy.utils import LockedFairShareQueue, procStartTime, pidAlive
+from gpupeasy.utils import EventBroadcaster, signalGroup, tailFile
+from gpupeasy.core.placement import ResourcePool, selectJobs, visibleDevices
+from gpupeasy.core.placement import BEST_FIT, POLICIES
+from gpupeasy.core.health import ProgressMonitor, groupAlive
+from gpupeasy.core.retry import RetryPolicy
+from bisect import bisect_right
+
+
+DEFAULT_PROJECT = 'default'
+# Return code reported for jobs whose exit status could not be collected,
+# i.e. jobs adopted after a restart or lost while the server was down, and
+# for jobs cancelled before they ran.
+RC_UNKNOWN = -1
 
 
 class Job:
-    def __init__(self, jobname, commandList, stdoutF=None):
+    def __init__(self, jobname, commandList, stdoutF=None, priority=0,
+                 project=None, gpus=1, gpuShare=1.0, memory=None, cpus=0,
+                 retry=None):
         '''
         jobname: A identifier for the job.
         commandList: The commands to pass onto shell.
         stdoutF: The file to redirect std out and std err to.
+        priority: Jobs with higher priority are scheduled first among the
+            jobs of the same project.
+        project: The project (or user) tag of the job. GPUs are shared
+            between projects according to the scheduler's share weights.
+        gpus: Number of devices the job needs, 0 for none.
+        gpuShare: Fraction (0 to 1] of each device the job needs. 0.5 lets
+            two such jobs share a device.
+        memory: Estimate of the memory, in MB, the job needs on each
+            device. None if not known.
+        cpus: Number of CPU cores the job needs.
+        retry: A gpupeasy.core.retry.RetryPolicy. None to never retry the
+            job automatically.
         '''
         self.name = jobname
         self.commandList = commandList
+        self.priority = int(priority)
+        if project is None:
+            project = DEFAULT_PROJECT
+        self.project = project
+        self.gpus = int(gpus)
+        self.gpuShare = float(gpuShare)
+        self.memory = None if memory is None else int(memory)
+        self.cpus = int(cpus)
+        self.retry = retry
+        # One dict per finished run, see GPUSchedulerCore.getJobInfo.
+        self.attempts = []
+        # Wall clock time before which a job waiting to be retried is not
+        # queued.
+        self.retryAt = None
+        # The code snapshot (see gpupeasy.core.snapshot) the job runs from,
+        # its root, and the command as submitted, before it was rewritten
+        # to run from the snapshot.
+        self.snapshot = None
+        self.snapshotRoot = None
+        self.sourceCommand = None
         # File names
         self.stdoutF = stdoutF
         # This will be set once the process has started
         # or finished
         self.subprocess = None
         self.gpu = None
+        # The devices (see placement.ResourcePool) the job runs on. gpu is
+        # what CUDA_VISIBLE_DEVICES is set to.
+        self.devices = None
         self.jobid = None
         self.returncode = None
+        self.startedAt = None
 
     def openFiles(self):
+        # Runs after the first keep the output of the earlier ones.
+        mode = 'w+' if len(self.attempts) == 0 else 'a+'
         if self.stdoutF is not None:
-            self.stdout = open(self.stdoutF, 'w+')
+            self.stdout = open(self.stdoutF, mode)
 
     def closeFiles(self):
-        self.stdout.close()
+        stdout = getattr(self, 'stdout', None)
+        if stdout is not None:
+            stdout.close()
+
+    def recordAttempt(self, state):
+        '''
+        Adds the run that just ended in state to attempts.
+        '''
+        self.attempts.append({'attempt': len(self.attempts) + 1,
+                              'state': state, 'returnCode': self.returncode,
+                              'gpu': self.gpu, 'devices': self.devices,
+                              'startedAt': self.startedAt,
+                              'endedAt': time.time()})
+
+    def retryDelay(self):
+        '''
+        Returns the seconds to wait before running the job, which just
+        failed, again. None if its retry policy says not to.
+        '''
+        if self.retry is None:
+            return None
+        # Runs lost with a node or killed do not use up the budget.
+        failures = len([a for a in self.attempts
+                        if a['state'] == STATE_FAILED])
+        output = None
+        if self.retry.needsOutput() and self.stdoutF is not None:
+            try:
+                output = tailFile(self.stdoutF, 50)[0]
+                output = output.decode('utf-8', 'replace')
+            except OSError:
+                pass
+        if not self.retry.shouldRetry(failures, self.returncode, output):
+            return None
+        return self.retry.delay(failures)
+
+    def reset(self):
+        '''
+        Clears what the last run set, before the job is queued again.
+        '''
+        self.subprocess = None
+        self.gpu = None
+        self.devices = None
+        self.returncode = None
+        self.startedAt = None
+
+    def toDict(self):
+        return {'jobid': self.jobid, 'name': self.name,
+                'commandList': self.commandList, 'stdoutF': self.stdoutF,
+                'priority': self.priority, 'project': self.project,
+                'gpus': self.gpus, 'gpuShare': self.gpuShare,
+                'memory': self.memory, 'cpus': self.cpus,
+                'retry': None if self.retry is None else self.retry.toDict(),
+                'attempts': list(self.attempts), 'retryAt': self.retryAt,
+                'snapshot': self.snapshot, 'snapshotRoot': self.snapshotRoot,
+                'sourceCommand': self.sourceCommand}
+
+    @staticmethod
+    def fromDict(d):
+        job = Job(d['name'], d['commandList'], stdoutF=d.get('stdoutF'),
+                  priority=d.get('priority', 0), project=d.get('project'),
+                  gpus=d.get('gpus', 1), gpuShare=d.get('gpuShare', 1.0),
+                  memory=d.get('memory'), cpus=d.get('cpus', 0),
+                  retry=RetryPolicy.fromDict(d.get('retry')))
+        job.jobid = d.get('jobid')
+        job.attempts = list(d.get('attempts') or [])
+        job.retryAt = d.get('retryAt')
+        job.snapshot = d.get('snapshot')
+        job.snapshotRoot = d.get('snapshotRoot')
+        job.sourceCommand = d.get('sourceCommand')
+        return job
 
     def __str__(self):
         return '<' + str(self.jobid) + ', ' + self.name + '>'
@@ -38,6 +164,61 @@ class Job:
         return '<' + str(self.jobid) + ', ' + self.name + '>'
 
 
+# Job states as reported by getJobInfo()
+STATE_SCHEDULED = 'Scheduled'
+STATE_RUNNING = 'Running'
+STATE_SUCCEEDED = 'Succeeded'
+STATE_FAILED = 'Failed'
+# Removed from the queue before it ran, and killed while running.
+STATE_CANCELLED = 'Cancelled'
+STATE_KILLED = 'Killed'
+# The job listings (see getJobChanges) and the states they contain.
+LIST_SCHEDULED = 'scheduled'
+LIST_RUNNING = 'running'
+LIST_SUCCEEDED = 'succeeded'
+LIST_FAILED = 'failed'
+LIST_OF_STATE = {
+    STATE_SCHEDULED: LIST_SCHEDULED,
+    STATE_RUNNING: LIST_RUNNING,
+    STATE_SUCCEEDED: LIST_SUCCEEDED,
+    STATE_FAILED: LIST_FAILED,
+    STATE_CANCELLED: LIST_FAILED,
+    STATE_KILLED: LIST_FAILED,
+}
+
+
+class AdoptedProcess:
+    '''
+    Stands in for subprocess.Popen for a job that was already running when
+    the scheduler was restarted. We are not its parent, so its exit status
+    cannot be collected; once it is gone, returncode is RC_UNKNOWN.
+    '''
+    def __init__(self, pid, pidStart=None):
+        self.pid = pid
+        self.pidStart = pidStart
+        self.returncode = None
+
+    def poll(self):
+        if self.returncode is None and not pidAlive(self.pid, self.pidStart):
+            self.returncode = RC_UNKNOWN
+        return self.returncode
+
+
+def launchLocal(job, gpu):
+    '''
+    The default launcher of GPUSchedulerCore: starts job on this machine
+    with CUDA_VISIBLE_DEVICES set to gpu. Returns the subprocess.Popen.
+
+    The job leads a session (and process group) of its own, so that killing
+    the group kills every process it started.
+    '''
+    env = os.environ.copy()
+    env["CUDA_VISIBLE_DEVICES"] = gpu
+    return subprocess.Popen(job.commandList, stdin=None, stdout=job.stdout,
+                            stderr=subprocess.STDOUT, env=env,
+                            start_new_session=True)
+
+
 class GPUSchedulerCore:
     '''
     The GPU Scheduler core.
@@ -51,31 +232,102 @@ class GPUSchedulerCore:
     Public functions:
         staratDaemon()
         addNewJob(job)
+        addNewJobs(jobs)
+        cancelJob(jobID)
+        killJob(jobID, gracesec)
+        rerunJobs(jobIDs)
+        addDevices(devices)
+        removeDevices(devices)
+        drainDevices(devices)
+        undrainDevices(devices)
+        wake()
         stopDaemon()
         # Setters and getters
         setAvailableGPU(availableGPU)
         setWakeSec(wakesec)
         setMaxQueueSize(maxQueueSize)
+        setShareWeights(shareWeights)
         getAvailableGPUList()
+        getDrainingDevices()
         getCurrAvailableGPUs()
+        getDeviceUsage()
+        getDeviceTelemetry()
+        getJobHealth(jobID)
         getWakesec()
         getJobsToSchedule()
         getRunningJobs()
         getFailedJobs()
         getJobInfo()
+        getVersion()
+        getListVersion(listName)
+        getJobChanges(listName, since, limit)
+        subscribe()
+        unsubscribe(subscription)
     '''
     def __init__(self, availableGPU, wakesec=10, maxQueueSize=10000,
-                 logger=None):
+                 logger=None, eventDriven=True, shareWeights=None,
+                 journal=None, launcher=None, deviceMemory=None, cpus=None,
+                 placement=BEST_FIT, backfill=True, monitor=None,
+                 killGracesec=10, hungsec=None, killHung=False,
+                 checksec=30, codeCache=None):
         '''
         availableGPU: is a list of strings which specify the device ID of the
             GPU's to use. For example, ['1', '2', '3'] will schedule
             jobs on GPU 1, 2 and 3. Also, pass [''], to shedule 1 job on CPU,
             ['', ''] to shedule 2 jobs on CPU and so forth. Further, pass
             ['1', '2', '2'] to schedule 1 job on GPU1 and 2 jobs on GPU2.
+            Each entry is one GPU worth of capacity: jobs asking for a
+            fraction of a GPU (see Job) are packed together on a device, and
+            jobs asking for several GPUs get that many distinct devices.
         wakesec: The number of seconds between checking of completed jobs/free
-            GPUs.
+            GPUs. When eventDriven is set, this is only an upper bound on how
+            long the daemon sleeps; it is woken up as soon as a job is added
+            or a child process exits.
+        eventDriven: Set to False to fall back to pure wakesec polling.
+        shareWeights: A dict mapping project tags to weights. Queued jobs
+            are dispatched across projects in proportion to these weights
+            (fair-share); projects not listed get weight 1. Within a
+            project, jobs are ordered by priority and then FIFO.
+        journal: A gpupeasy.core.journal.Journal. If provided, every state
+            transition is journaled and startDaemon() first restores the
+            queues from it: queued jobs are re-queued, finished jobs are
+            kept and jobs that are still running are adopted.
+        launcher: A callable launcher(job, gpu) that starts job on gpu and
+            returns an object like subprocess.Popen: with pid (None if the
+            process is not on this machine), poll() and returncode. If the
+            returned object has lost set to True, the job is put back in
+            the queue. Defaults to launchLocal. A launcher that starts
+            processes elsewhere should call wake() when they exit.
+        deviceMemory: A dict mapping devices to their memory in MB. Jobs
+            with a memory estimate are only placed where it fits.
+        cpus: Number of CPU cores jobs on this machine can claim in total.
+            None for no limit.
+        placement: 'best' to pack jobs on the devices they fit tightest,
+            'first' to use the first devices they fit on. See
+            gpupeasy.core.placement.
+        backfill: If set, jobs behind one that does not fit yet are started
+            on what it does not need. Otherwise jobs start strictly in queue
+            order.
+        monitor: A gpupeasy.core.telemetry.DeviceMonitor. If provided, it is
+            started and stopped with the daemon, and jobs are not placed on
+            devices it reports as busy or short of memory.
+        killGracesec: Seconds killJob() waits after SIGTERM before sending
+            SIGKILL.
+        hungsec: Seconds after which a running job that neither used CPU
+            time nor wrote output is reported hung. None to not look for
+            hung jobs.
+        killHung: Kill hung jobs, and processes left behind by jobs that
+            exited, instead of only logging them.
+        checksec: Seconds between checks of the running jobs against /proc
+            (see gpupeasy.core.health). Jobs whose processes are gone
+            without the scheduler noticing are marked failed.
+        codeCache: A gpupeasy.core.snapshot.CodeCache holding the code
+            snapshots of jobs. A job's reference on its snapshot is released
+            when it ends for good, and a rerun snapshots its code again.
+            Snapshots no job references are removed on startup.
 
-        availableGPU cannot be changed once the process has started. TODO
+        availableGPU can be changed while running with setAvailableGPU(),
+        addDevices(), removeDevices() and drainDevices().
 
         Note that the public methods, only which should be used to modify
         internals, are not thread-safe.
@@ -84,11 +336,34 @@ class GPUSchedulerCore:
         if logger is None:
             self.__logger = Logger()
         self.__logger.pInfo("Scheduler core initializing")
-        self.__availableGPU = LockedList()
-        assert len(availableGPU) >= 0, 'Available GPU list cannot be empty'
-        for val in availableGPU:
-            self.__availableGPU.append(val)
-        assert len(availableGPU) > 0, "Available GPU list is empty"
+        # An empty list is allowed: devices can be added with addDevices().
+        self.__monitor = monitor
+        admit = None if monitor is None else monitor.admit
+        self.__pool = ResourcePool(availableGPU, deviceMemory=deviceMemory,
+                                   cpus=cpus, admit=admit)
+        assert placement in POLICIES, 'Unknown placement: %s' % placement
+        self.__placement = placement
+        self.__backfill = backfill
+        self.__killGracesec = float(killGracesec)
+        # jobid -> monotonic time at which a job being killed gets SIGKILL,
+        # None once it has.
+        self.__killing = {}
+        # Jobs waiting out a retry backoff: a heap of (monotonic time, jobid)
+        # and jobid -> job. Cancelled jobs leave stale heap entries.
+        self.__retryHeap = []
+        self.__retrying = {}
+        self.__retryLock = threading.Lock()
+        self.__progress = ProgressMonitor(hungsec=hungsec)
+        self.__killHung = killHung
+        self.__checksec = float(checksec)
+        self.__nextCheck = 0
+        if not self.__progress.available():
+            self.__logger.pWarn("/proc not available. Running jobs are not",
+                                "checked for progress")
+            self.__progress = None
+        self.__launcher = launcher
+        if launcher is None:
+            self.__launcher = launchLocal
         # in-case user provides bad value
         self.__wakesec = 10
         self.setWakesec(wakesec)
@@ -99,13 +374,54 @@ class GPUSchedulerCore:
         self.__quitFlag = False
         self.__daemonRunning = False
         self.__daemonThr = None
+        # Set by the daemon thread once it is up (or failed to start).
+        self.__startedEvent = threading.Event()
         self.__lastJobId = 1
+        # The daemon waits on wakeCond instead of sleeping for wakesec. The
+        # reaper thread, addNewJob and stopDaemon notify it.
+        self.__eventDriven = eventDriven
+        self.__wakeCond = threading.Condition()
+        self.__wakePending = False
+        self.__reaperThr = None
+        # Set when a child is launched (reaper has something to wait on) and
+        # when the daemon has completed a status pass (reaper can block in
+        # waitid again).
+        self.__childEvent = threading.Event()
+        self.__reapedEvent = threading.Event()
 
-        self.__toScheduleJobs = LockedList()
-        self.__runningJobs = LockedList()
-        self.__succeededJobs = LockedList()
-        self.__failedJobs = LockedList()
-        self.__currAvailableGPUs = LockedList()
+        # Job queues are indexed by jobid.
+        jobKey = lambda job: job.jobid
+        self.__toScheduleJobs = LockedFairShareQueue(
+            key=jobKey, priority=lambda job: -job.priority,
+            tag=lambda job: job.project)
+        if shareWeights is not None:
+            self.setShareWeights(shareWeights)
+        self.__runningJobs = LockedQueue(key=jobKey)
+        self.__succeededJobs = LockedQueue(key=jobKey)
+        self.__failedJobs = LockedQueue(key=jobKey)
+        # jobid -> (job, state, version). Updated on every state transition
+        # so that getJobInfo() is a single dictionary lookup. version is a
+        # counter bumped on every transition.
+        self.__jobIndex = {}
+        self.__indexLock = threading.Lock()
+        self.__version = 0
+        # For each listing, a version ordered list of (version, jobid) with
+        # an entry for every job entering, changing in or leaving the
+        # listing. lastChange maps jobid to the version of its latest entry
+        # in the log; earlier entries are stale and skipped. Compaction drops
+        # stale entries and removals; compactedAt is the version at which
+        # this last happened.
+        lists = set(LIST_OF_STATE.values())
+        self.__changeLogs = {name: [] for name in lists}
+        self.__lastChange = {name: {} for name in lists}
+        self.__listSize = {name: 0 for name in lists}
+        self.__compactedAt = {name: 0 for name in lists}
+        # Job and device events for subscribers (see subscribe()).
+        self.__events = EventBroadcaster()
+        self.__journal = journal
+        self.__codeCache = codeCache
+        # Serializes job id assignment and the queue-size check.
+        self.__addLock = threading.Lock()
         self.__logger.pDebug("Scheduler object: ", self)
         self.__logger.pInfo("Scheduler core initialized")
 
@@ -115,62 +431,374 @@ class GPUSchedulerCore:
         self.__lastJobId += 1
         return val
 
+    def __setJobState(self, job, state, journal=True):
+        with self.__indexLock:
+            self.__version += 1
+            version = self.__version
+            prev = self.__jobIndex.get(job.jobid)
+            self.__jobIndex[job.jobid] = (job, state, version)
+            newList = LIST_OF_STATE[state]
+            oldList = None if prev is None else LIST_OF_STATE[prev[1]]
+            if oldList != newList:
+                self.__listSize[newList] += 1
+                if oldList is not None:
+                    self.__listSize[oldList] -= 1
+                    self.__appendChange(oldList, version, job.jobid)
+            self.__appendChange(newList, version, job.jobid)
+            # Published under the lock so that events arrive in version
+            # order.
+            if len(self.__events) > 0:
+                self.__events.publish(self.__jobEvent(job, state, version))
+        if self.__codeCache is not None and job.snapshot is not None and \
+                oldList in [LIST_SCHEDULED, LIST_RUNNING] and \
+                newList in [LIST_SUCCEEDED, LIST_FAILED]:
+            self.__codeCache.release(job.snapshot)
+        if self.__journal is None or journal is False:
+            return
+        if state == STATE_SCHEDULED:
+            jobD = job.toDict()
+            del jobD['jobid']
+            self.__journal.record('enqueue', job.jobid, job=jobD)
+        elif state == STATE_RUNNING:
+            pid = job.subprocess.pid
+            pidStart = procStartTime(pid) if pid is not None else None
+            self.__journal.record('start', job.jobid, gpu=job.gpu,
+                                  devices=job.devices, pid=pid,
+                                  pidStart=pidStart, startedAt=job.startedAt)
+        else:
+            # Cancelled jobs did not run; their last attempt, if any, is
+            # in the 'enqueue' record already.
+            attempt = None
+            if state != STATE_CANCELLED and len(job.attempts) > 0:
+                attempt = job.attempts[-1]
+            self.__journal.record('exit', job.jobid,
+                                  returncode=job.returncode, state=state,
+                                  attempt=attempt)
+
+    def __jobEvent(self, job, state, version):
+        return {'type': 'job', 'version': version, 'jobID': job.jobid,
+                'jobName': job.name, 'jobCommand': ' '.join(job.commandList),
+                'state': state, 'gpu': job.gpu, 'devices': job.devices,
+                'returnCode': job.returncode, 'priority': job.priority,
+                'project': job.project}
+
+    def __publishDevice(self, gpu, idle, job=None):
+        if len(self.__events) == 0:
+            return
+        event = {'type': 'device', 'version': self.__version, 'gpu': gpu,
+                 'idle': idle, 'jobID': None if job is None else job.jobid}
+        self.__events.publish(event)
+
+    def __publishDeviceList(self):
+        if len(self.__events) == 0:
+            return
+        event = {'type': 'devicelist', 'version': self.__version,
+                 'devices': self.__pool.getSlots(),
+                 'draining': self.__pool.getDraining()}
+        self.__events.publish(event)
+
+    def __appendChange(self, listName, version, jobid):
+        # Called with the index lock held.
+        log = self.__changeLogs[listName]
+        lastChange = self.__lastChange[listName]
+        log.append((version, jobid))
+        lastChange[jobid] = version
+        if len(log) < 2 * self.__listSize[listName] + 1024:
+            return
+        # Mostly stale entries and removals: keep the current members only.
+        index = self.__jobIndex
+        members = [(v, j) for v, j in log if lastChange[j] == v and
+                   LIST_OF_STATE[index[j][1]] == listName]
+        self.__changeLogs[listName] = members
+        self.__lastChange[listName] = {j: v for v, j in members}
+        self.__compactedAt[listName] = version
+
+    def __recover(self):
+        '''
+        Rebuilds the queues from the journal. Called from the daemon thread
+        before it starts accepting jobs.
+        '''
+        records = self.__journal.replay()
+        counts = {'queued': 0, 'adopted': 0, 'lost': 0, 'finished': 0,
+                  'requeued': 0}
+        for rec in records:
+            job = Job.fromDict(rec)
+            self.__lastJobId = max(self.__lastJobId, job.jobid + 1)
+            if rec['op'] == 'enqueue':
+                self.__pinSnapshot(job)
+                self.__setJobState(job, STATE_SCHEDULED, journal=False)
+                if job.retryAt is not None:
+                    self.__addRetry(job)
+                else:
+                    self.__toScheduleJobs.append(job)
+                counts['queued'] += 1
+                continue
+            if rec['op'] == 'start' and rec['pid'] is None:
+                # It ran on a remote node; we cannot tell what became of it.
+                # The node kills it on its next heartbeat, run it again.
+                self.__pinSnapshot(job)
+                self.__toScheduleJobs.append(job)
+                self.__setJobState(job, STATE_SCHEDULED)
+                counts['requeued'] += 1
+                continue
+            if rec['op'] == 'start':
+                job.gpu = rec['gpu']
+                job.startedAt = rec.get('startedAt')
+                job.devices = rec.get('devices') or [rec['gpu']]
+                if pidAlive(rec['pid'], rec.get('pidStart')):
+                    self.__pinSnapshot(job)
+                    self.__adoptJob(job, rec['pid'], rec.get('pidStart'))
+                    counts['adopted'] += 1
+                    continue
+                # Exited while we were not watching.
+                self.__logger.pWarn("Process", job, "exited while the",
+                                    "scheduler was down. Marking as failed")
+                job.returncode = RC_UNKNOWN
+                self.__failedJobs.append(job)
+                self.__setJobState(job, STATE_FAILED)
+                counts['lost'] += 1
+                continue
+            job.returncode = rec['returncode']
+            state = rec.get('state')
+            if state not in [STATE_CANCELLED, STATE_KILLED]:
+                state = STATE_FAILED
+            if job.returncode == 0 and state == STATE_FAILED:
+                self.__succeededJobs.append(job)
+                self.__setJobState(job, STATE_SUCCEEDED, journal=False)
+            else:
+                self.__failedJobs.append(job)
+                self.__setJobState(job, state, journal=False)
+            counts['finished'] += 1
+        self.__logger.pInfo("Recovered from journal:", counts)
+
+    def __pinSnapshot(self, job):
+        # Takes the reference of a recovered job that is queued or running
+        # on its code snapshot.
+        if self.__codeCache is None or job.snapshot is None:
+            return
+        if not self.__codeCache.acquire(job.snapshot):
+            self.__logger.pWarn("Code snapshot of", job, "is missing")
+
+    def __adoptJob(self, job, pid, pidStart):
+        job.subprocess = AdoptedProcess(pid, pidStart)
+        # Take what the job holds out of the pool.
+        allocated = self.__pool.allocate(job, job.devices)
+        if len(allocated) < len(job.devices):
+            self.__logger.pWarn("Adopted", job, "runs on unknown gpu",
+                                job.gpu)
+        self.__runningJobs.append(job)
+        self.__setJobState(job, STATE_RUNNING, journal=False)
+        self.__logger.pInfo("Adopted running process", job, "pid", pid)
+
     def __updateRunningJobStatus(self):
         # Scan through the list of running jobs. Check if any of them have
         # finished. If they have, move them to finished or succeeded and
         # free-up the GPU.
-        idList = []
         runningJobs = self.__runningJobs.getCurrVals()
-        for i in range(len(runningJobs)):
-            job = runningJobs[i]
+        for job in runningJobs:
             assert job.subprocess is not None, 'No subprocess for running jobs?'
             assert job.returncode is None, 'Return code for running jobs?'
+            if getattr(job.subprocess, 'lost', False):
+                self.__requeueJob(job)
+                continue
             if job.subprocess.poll() is None:
+                self.__escalateKill(job)
                 continue
             rt = job.subprocess.returncode
             job.returncode = rt
-            if rt != 0:
+            self.__runningJobs.remove(job.jobid)
+            if self.__progress is not None:
+                self.__progress.forget(job.jobid)
+            killed = job.jobid in self.__killing
+            self.__killing.pop(job.jobid, None)
+            if killed:
+                self.__killGroup(job)
+                self.__logger.pWarn("Process", job, "killed")
+                state = STATE_KILLED
+            elif rt != 0:
+                self.__checkLeftovers(job)
                 self.__logger.pWarn("Process", job,
                                     "exited with return code: %d" % rt)
-                self.__failedJobs.append(job)
-                idList.append(job.jobid)
+                state = STATE_FAILED
             else:
+                self.__checkLeftovers(job)
                 self.__logger.pSuccess("Process", job,
                                        "exited with return code: %d" % rt)
-                self.__succeededJobs.append(job)
-            idList.append(job.jobid)
-            gpu = job.gpu
+                state = STATE_SUCCEEDED
             job.closeFiles()
-            self.__currAvailableGPUs.push(gpu)
+            self.__releaseDevices(job)
+            self.__endJob(job, state)
             self.__logger.pDebug("Current available gpus",
                                  self.getCurrAvailableGPUs())
-        # There is no way to do this safely or cleanly other than using
-        # markers. That is, mark objects for deletion and cleanup at different
-        # points. I prefer to do this: Slow but cleaner (?).
-        for i in range(len(idList)):
-            currId = idList[i]
-            self.__runningJobs.lock()
-            for j in range(len(self.__runningJobs.getCurrVals(unsafe=True))):
-                job = self.__runningJobs.getCurrVals(unsafe=True)[j]
-                if job.jobid is not currId:
-                    continue
-                self.__runningJobs.deleteValue(j, unsafe=True)
-                gpu = job.gpu
-                break
-            self.__runningJobs.release()
 
-    def __scheduleNextJob(self):
+    def __endJob(self, job, state):
+        '''
+        Records the attempt of job, which exited and released its devices,
+        and moves it to the list of its final state, or back to the queue if
+        its retry policy says so.
+        '''
+        job.recordAttempt(state)
+        if state == STATE_FAILED and self.__retryLater(job):
+            return
+        if state == STATE_SUCCEEDED:
+            self.__succeededJobs.append(job)
+        else:
+            self.__failedJobs.append(job)
+        self.__setJobState(job, state)
+
+    def __retryLater(self, job):
+        delay = job.retryDelay()
+        if delay is None:
+            return False
+        self.__logger.pWarn("Retrying", job, "in %d seconds" % delay)
+        job.reset()
+        job.retryAt = time.time() + delay
+        self.__setJobState(job, STATE_SCHEDULED)
+        self.__addRetry(job)
+        return True
+
+    def __addRetry(self, job):
+        delay = max(job.retryAt - time.time(), 0)
+        with self.__retryLock:
+            self.__retrying[job.jobid] = job
+            heapq.heappush(self.__retryHeap,
+                           (time.monotonic() + delay, job.jobid))
+
+    def __takeRetry(self, jobid):
+        with self.__retryLock:
+            return self.__retrying.pop(jobid, None)
+
+    def __releaseRetries(self):
+        # Queues the jobs whose backoff is over.
+        now = time.monotonic()
+        due = []
+        with self.__retryLock:
+            heap = self.__retryHeap
+            while len(heap) > 0 and heap[0][0] <= now:
+                _, jobid = heapq.heappop(heap)
+                job = self.__retrying.pop(jobid, None)
+                if job is not None:
+                    due.append(job)
+        for job in due:
+            job.retryAt = None
+        self.__toScheduleJobs.extend(due)
+
+    def __killGroup(self, job):
+        pid = job.subprocess.pid
+        try:
+            # Whatever the job started and left behind.
+            if pid is not None:
+                os.killpg(pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    def __checkLeftovers(self, job):
+        # A job that exits can leave processes running (e.g. detached data
+        # loaders) that hold on to the devices we are about to release.
+        pid = job.subprocess.pid
+        if pid is None or not groupAlive(pid):
+            return
+        if self.__killHung:
+            self.__logger.pWarn("Process", job, "left processes running.",
+                                "Killing them")
+            self.__killGroup(job)
+            return
+        self.__logger.pWarn("Process", job, "left processes running in",
+                            "process group", pid)
+
+    def __reconcile(self):
         '''
-        Moves a job from the __toScheduleJobs queue to the __runningJobs queue
-        after consuming one gpu device.
+        Cross-checks the running jobs against /proc every checksec seconds:
+        logs (and with killHung, kills) jobs that stopped making progress,
+        and fails jobs whose processes are gone without poll() noticing.
+        '''
+        now = time.monotonic()
+        if self.__progress is None or now < self.__nextCheck:
+            return
+        self.__nextCheck = now + self.__checksec
+        jobs = [job for job in self.__runningJobs.getCurrVals()
+                if job.jobid not in self.__killing]
+        hung, gone = self.__progress.check(jobs, now)
+        for job in gone:
+            if job.subprocess.poll() is not None:
+                # Exited since the status pass; collected on the next one.
+                self.__wakeDaemon()
+                continue
+            self.__logger.pWarn("Process", job, "is gone but was never",
+                                "reaped. Marking as failed")
+            job.subprocess.returncode = RC_UNKNOWN
+            self.__wakeDaemon()
+        for job in hung:
+            health = self.__progress.getHealth(job.jobid)
+            self.__logger.pWarn("Process", job, "made no progress for",
+                                "%d seconds" % health['idlesec'])
+            if self.__killHung:
+                self.killJob(job.jobid)
+
+    def __escalateKill(self, job):
+        deadline = self.__killing.get(job.jobid)
+        if deadline is None or time.monotonic() < deadline:
+            return
+        self.__logger.pWarn("Process", job, "ignored SIGTERM. Sending",
+                            "SIGKILL")
+        self.__killing[job.jobid] = None
+        self.__signalJob(job, signal.SIGKILL)
+
+    def __signalJob(self, job, sig):
+        proc = job.subprocess
+        if proc.poll() is not None:
+            # Exited; the pid may not be ours any more.
+            return
+        if proc.pid is not None:
+            signalGroup(proc.pid, sig)
+        elif hasattr(proc, 'kill'):
+            # Runs elsewhere; the launcher's process object kills it.
+            proc.kill()
+
+    def __nextWakeup(self):
+        # Seconds till the daemon has to check on the jobs, at most wakesec.
+        deadlines = [d for d in list(self.__killing.values()) if d is not None]
+        if self.__progress is not None and len(self.__runningJobs) > 0:
+            deadlines.append(self.__nextCheck)
+        with self.__retryLock:
+            if len(self.__retryHeap) > 0:
+                deadlines.append(self.__retryHeap[0][0])
+        if len(deadlines) == 0:
+            return self.__wakesec
+        return max(min(min(deadlines) - time.monotonic(), self.__wakesec), 0)
+
+    def __requeueJob(self, job):
+        # The job was lost with the node it ran on. Run it again.
+        self.__logger.pWarn("Process", job, "was lost on", job.gpu,
+                            ". Re-queuing")
+        self.__runningJobs.remove(job.jobid)
+        if self.__progress is not None:
+            self.__progress.forget(job.jobid)
+        job.closeFiles()
+        self.__releaseDevices(job)
+        job.recordAttempt('Lost')
+        job.reset()
+        self.__setJobState(job, STATE_SCHEDULED)
+        self.__toScheduleJobs.append(job)
+
+    def __releaseDevices(self, job):
+        # Devices removed or drained while busy leave the pool here.
+        removed = False
+        for gpu, idle, gone in self.__pool.release(job):
+            self.__publishDevice(gpu, idle)
+            if gone:
+                self.__logger.pInfo("Device", gpu, "removed")
+                removed = True
+        if removed:
+            self.__publishDeviceList()
+
+    def __startJob(self, job, devices):
+        '''
+        Moves job, taken off the __toScheduleJobs queue with devices
+        allocated to it, to the __runningJobs queue.
         '''
-        # There is no conceivable cases in which this should happen; if I'm
-        # being careful. SchduleNextJob should only be called after a gpu is
-        # made available.
         msg = "Internal error"
-        assert len(self.__currAvailableGPUs) > 0, self.__logger.pCritial(msg)
-        gpu = self.__currAvailableGPUs.pop()
-        job = self.__toScheduleJobs.pop()
+        gpu = visibleDevices(devices)
         # Open stdout and stderr
         job.openFiles()
         assert job.jobid is not None, 'No jobID for in-queue job?'
@@ -182,15 +810,16 @@ class GPUSchedulerCore:
         # TODO: Make the argument passing task a little easier. By this point,
         # i'm assuming the commandlist is valid
         try:
-            env = os.environ.copy()
-            env["CUDA_VISIBLE_DEVICES"] = gpu
-            subpro = subprocess.Popen(job.commandList, stdin=None,
-                                      stdout=job.stdout,
-                                      stderr=subprocess.STDOUT,
-                                      env=env)
+            job.startedAt = time.time()
+            subpro = self.__launcher(job, gpu)
             job.subprocess = subpro
             job.gpu = gpu
+            job.devices = devices
             self.__runningJobs.append(job)
+            self.__setJobState(job, STATE_RUNNING)
+            for device in devices:
+                self.__publishDevice(device, False, job)
+            self.__childEvent.set()
             return
         except OSError as e:
             self.__logger.pError("Scheduling failed for", job, "on gpu", gpu)
@@ -201,8 +830,62 @@ class GPUSchedulerCore:
         # Document this somewhere. TODO:
         job.returncode = -1
         job.closeFiles()
-        self.__failedJobs.append(job)
-        self.__currAvailableGPUs.push(gpu)
+        self.__releaseDevices(job)
+        job.gpu = gpu
+        job.devices = devices
+        self.__endJob(job, STATE_FAILED)
+
+    def __wakeDaemon(self):
+        with self.__wakeCond:
+            self.__wakePending = True
+            self.__wakeCond.notify_all()
+
+    def __waitForEvent(self, timeout):
+        '''
+        Blocks till __wakeDaemon is called or timeout seconds elapse. Since
+        the pending flag is cleared before the daemon re-checks the queues, a
+        wake-up sent while the daemon was busy is never lost.
+        '''
+        with self.__wakeCond:
+            if not self.__wakePending:
+                self.__wakeCond.wait(timeout)
+            self.__wakePending = False
+
+    def __reaperThread(self):
+        '''
+        Blocks in waitid() till one of our children exits and wakes the daemon
+        up. WNOWAIT leaves the zombie for Popen.poll() to collect, so we wait
+        for the daemon to finish a status pass before calling waitid() again;
+        otherwise it would keep returning the same child.
+        '''
+        flags = os.WEXITED | os.WNOWAIT
+        while self.__quitFlag is False:
+            try:
+                os.waitid(os.P_ALL, 0, flags)
+            except ChildProcessError:
+                # No children. Wait till a job is launched.
+                self.__childEvent.wait(self.__wakesec)
+                self.__childEvent.clear()
+                continue
+            self.__reapedEvent.clear()
+            self.__wakeDaemon()
+            self.__reapedEvent.wait(self.__wakesec)
+
+    def __startReaper(self):
+        if not self.__eventDriven:
+            return
+        if not hasattr(os, 'waitid'):
+            self.__logger.pWarn('os.waitid not available. Falling back to',
+                                'polling every %d seconds' % self.__wakesec)
+            return
+        if self.__reaperThr is not None and self.__reaperThr.is_alive():
+            return
+        # The reaper may be blocked in waitid() indefinitely; don't let it
+        # keep the interpreter alive.
+        self.__reaperThr = threading.Thread(target=self.__reaperThread,
+                                            name='scheduler-reaper',
+                                            daemon=True)
+        self.__reaperThr.start()
 
     def __daemonThread(self):
         # There is no conceivable cases in which this error should happen.
@@ -212,40 +895,256 @@ class GPUSchedulerCore:
         assert len(self.__toScheduleJobs) == 0, self.__logger.pCritial(msg)
         assert len(self.__succeededJobs) == 0, self.__logger.pCritial(msg)
         assert len(self.__failedJobs) == 0, self.__logger.pCritial(msg)
-        assert len(self.__currAvailableGPUs) == 0, self.__logger.pCritial(msg)
         assert self.__daemonRunning == False, self.__logger.pCritial(msg)
-        self.__daemonRunning = True
-        tmp = self.__availableGPU.getCurrVals()
-        for val in tmp:
-            self.__currAvailableGPUs.append(val)
+        try:
+            if self.__journal is not None:
+                self.__recover()
+                self.__journal.start()
+            if self.__codeCache is not None:
+                removed = self.__codeCache.collect()
+                if removed > 0:
+                    self.__logger.pInfo("Removed %d unused code snapshots" %
+                                        removed)
+            if self.__monitor is not None:
+                # Devices that clear up are worth a scheduling pass.
+                self.__monitor.start(onChange=self.__wakeDaemon)
+            self.__daemonRunning = True
+        finally:
+            self.__startedEvent.set()
+        self.__startReaper()
         while self.__quitFlag is False:
             self.__updateRunningJobStatus()
-            sleep = (len(self.__currAvailableGPUs) == 0)
-            sleep = sleep or (len(self.__toScheduleJobs) == 0)
-            if sleep:
-                time.sleep(self.__wakesec)
-                continue
-            # At this point, GPUs are free.
-            if len(self.__toScheduleJobs) == 0:
+            self.__reapedEvent.set()
+            self.__reconcile()
+            self.__releaseRetries()
+            placed = selectJobs(self.__pool, self.__toScheduleJobs,
+                                policy=self.__placement,
+                                backfill=self.__backfill)
+            for job, devices in placed:
+                self.__startJob(job, devices)
+            if len(placed) > 0:
                 continue
-            self.__scheduleNextJob()
+            if self.__eventDriven:
+                self.__waitForEvent(self.__nextWakeup())
+            else:
+                time.sleep(self.__nextWakeup())
         self.__logger.pInfo('Exiting daemon')
+        if self.__monitor is not None:
+            self.__monitor.stop()
+        if self.__journal is not None:
+            self.__journal.close()
         self.__daemonRunning = False
 
     def addNewJob(self, job):
+        return self.addNewJobs([job])[0]
+
+    def addNewJobs(self, jobs):
+        '''
+        Adds a batch of jobs to the queue with a single lock acquisition.
+        Returns a list with a (success, jobid) pair for each job. Jobs that
+        do not fit in the queue are rejected with (False, None).
+        '''
         if not self.__daemonRunning:
             self.__logger.pWarn('Add job attempted while daemon not running')
-            return False, None
-        # check if we can add a new job
-        if len(self.__toScheduleJobs) >= self.__maxQueueSize:
-            self.__logger.pError("Adding new job failed. Queue full.")
-            return False, None
-        job.jobid = self.__getNewJobId()
-        self.__toScheduleJobs.append(job)
-        return True, job.jobid
+            return [(False, None)] * len(jobs)
+        with self.__addLock:
+            # check if we can add new jobs
+            room = self.__maxQueueSize - len(self.__toScheduleJobs)
+            room = max(room, 0)
+            accepted = jobs[:room]
+            for job in accepted:
+                job.jobid = self.__getNewJobId()
+                self.__setJobState(job, STATE_SCHEDULED)
+            self.__toScheduleJobs.extend(accepted)
+        for job in accepted:
+            if not self.__pool.fits(job):
+                self.__logger.pWarn(job, "does not fit on the current",
+                                    "devices. It waits till devices are added")
+        if len(accepted) < len(jobs):
+            self.__logger.pError("Adding %d new job(s) failed. Queue full." %
+                                 (len(jobs) - len(accepted)))
+        if len(accepted) > 0:
+            self.__wakeDaemon()
+        ret = [(True, job.jobid) for job in accepted]
+        ret += [(False, None)] * (len(jobs) - len(accepted))
+        return ret
+
+    def cancelJob(self, jobID):
+        '''
+        Removes a queued job from the queue. It is listed with the failed
+        jobs, in state 'Cancelled'. Running jobs are killed with killJob().
+
+        Returns (success, message).
+        '''
+        job, state = self.getJobInfo(jobID)
+        if job is None:
+            return False, 'Job not found'
+        if state != STATE_SCHEDULED:
+            return False, 'Job is not queued (%s)' % state
+        if self.__toScheduleJobs.remove(job.jobid) is None and \
+                self.__takeRetry(job.jobid) is None:
+            # Started (or was re-queued) meanwhile.
+            return False, 'Job is not queued'
+        job.retryAt = None
+        job.returncode = RC_UNKNOWN
+        self.__failedJobs.append(job)
+        self.__setJobState(job, STATE_CANCELLED)
+        self.__logger.pInfo("Cancelled", job)
+        return True, 'Job cancelled'
+
+    def killJob(self, jobID, gracesec=None):
+        '''
+        Kills a running job: its process group gets SIGTERM and, if it is
+        still there gracesec seconds later (killGracesec if None), SIGKILL.
+        The devices are released as soon as the job exits, and it is listed
+        with the failed jobs in state 'Killed'. Jobs on worker nodes are
+        killed by the node on its next heartbeat.
+
+        Returns (success, message).
+        '''
+        job, state = self.getJobInfo(jobID)
+        if job is None:
+            return False, 'Job not found'
+        if state != STATE_RUNNING:
+            return False, 'Job is not running (%s)' % state
+        if job.jobid in self.__killing:
+            return True, 'Job is being killed'
+        if gracesec is None:
+            gracesec = self.__killGracesec
+        self.__killing[job.jobid] = time.monotonic() + float(gracesec)
+        self.__logger.pWarn("Killing", job)
+        self.__signalJob(job, signal.SIGTERM)
+        # Recompute the daemon's timeout for the SIGKILL deadline.
+        self.__wakeDaemon()
+        return True, 'Job is being killed'
 
-    def setAvailabelGPU(self, availableGPU):
-        raise NotImplementedError
+    def rerunJobs(self, jobIDs):
+        '''
+        Puts failed (and killed or cancelled) jobs back in the queue. Their
+        earlier runs are kept in job.attempts, and the output of the new run
+        is appended to the same file. Jobs that ran from a code snapshot get
+        a new one, of the code as it is now.
+
+        Returns a list with a (success, message) pair for each job.
+        '''
+        ret = []
+        with self.__addLock:
+            for jobID in jobIDs:
+                job, state = self.getJobInfo(jobID)
+                if job is None:
+                    ret.append((False, 'Job not found'))
+                    continue
+                if LIST_OF_STATE[state] != LIST_FAILED:
+                    ret.append((False, 'Job has not failed (%s)' % state))
+                    continue
+                if len(self.__toScheduleJobs) >= self.__maxQueueSize:
+                    ret.append((False, 'Queue full'))
+                    continue
+                ok, msg = self.__resnapshot(job)
+                if not ok:
+                    ret.append((False, msg))
+                    continue
+                if self.__failedJobs.remove(job.jobid) is None:
+                    if job.snapshot is not None:
+                        self.__codeCache.release(job.snapshot)
+                    ret.append((False, 'Job has not failed'))
+                    continue
+                job.reset()
+                job.retryAt = None
+                self.__setJobState(job, STATE_SCHEDULED)
+                self.__toScheduleJobs.append(job)
+                self.__logger.pInfo("Re-running", job)
+                ret.append((True, 'Job queued'))
+        if any(ok for ok, _ in ret):
+            self.__wakeDaemon()
+        return ret
+
+    def __resnapshot(self, job):
+        # Jobs that ran from a code snapshot are rerun with the code as it
+        # is now, like a new submission.
+        if self.__codeCache is None or job.snapshot is None:
+            return True, None
+        try:
+            self.__codeCache.snapshot(job)
+        except (ValueError, OSError) as e:
+            return False, 'Could not snapshot the code: %s' % str(e)
+        return True, None
+
+    def setAvailableGPU(self, availableGPU):
+        '''
+        Makes availableGPU the device slots: missing slots are added, extra
+        slots of the devices listed are removed (see removeDevices) and the
+        devices not listed are drained (see drainDevices).
+        '''
+        current = Counter(self.__pool.getSlots())
+        wanted = Counter(availableGPU)
+        add, remove = [], []
+        for gpu, n in wanted.items():
+            add += [gpu] * max(n - current[gpu], 0)
+            remove += [gpu] * max(current[gpu] - n, 0)
+        self.__pool.undrain(list(wanted.keys()))
+        self.__pool.add(add)
+        self.__pool.remove(remove)
+        self.__pool.drain([gpu for gpu in current if gpu not in wanted])
+        self.__logger.pInfo("Available gpus set to", availableGPU)
+        self.__publishDeviceList()
+        self.__wakeDaemon()
+
+    def addDevices(self, devices):
+        '''
+        Adds device slots (see availableGPU) to the pool. Jobs are scheduled
+        on them right away. Adding a draining device stops the drain.
+        '''
+        self.__pool.add(devices)
+        self.__logger.pInfo("Added devices", devices)
+        self.__publishDeviceList()
+        self.__wakeDaemon()
+
+    def removeDevices(self, devices):
+        '''
+        Removes one device slot for every entry of devices. Idle slots are
+        removed at once; busy ones are removed when their job exits, which
+        is left running. Unknown devices are ignored.
+
+        Returns the number of slots removed.
+        '''
+        removed = self.__pool.remove(devices)
+        if removed > 0:
+            self.__publishDeviceList()
+        return removed
+
+    def drainDevices(self, devices):
+        '''
+        Stops scheduling on devices (all their slots). Idle devices are
+        removed at once; busy ones once their jobs finish. Unknown devices
+        are ignored.
+
+        Returns the devices removed at once and those left draining.
+        '''
+        removed, draining = self.__pool.drain(devices)
+        if len(removed) + len(draining) > 0:
+            self.__logger.pInfo("Removed devices", removed, "draining",
+                                draining)
+            self.__publishDeviceList()
+        return removed, draining
+
+    def undrainDevices(self, devices):
+        '''
+        Resumes scheduling on draining devices. Returns the devices that were
+        draining.
+        '''
+        ret = self.__pool.undrain(devices)
+        if len(ret) > 0:
+            self.__publishDeviceList()
+            self.__wakeDaemon()
+        return ret
+
+    def wake(self):
+        '''
+        Makes the daemon check the running jobs now. Launchers that run jobs
+        out of process call this when one of them exits.
+        '''
+        self.__wakeDaemon()
 
     def setWakesec(self, wakesec):
         try:
@@ -275,14 +1174,66 @@ class GPUSchedulerCore:
         self.__maxQueueSize = maxQueueSize
         self.__logger.pInfo("maxQueueSize updated to: %d" % maxQueueSize)
 
+    def setShareWeights(self, shareWeights):
+        try:
+            shareWeights = {k: float(v) for k, v in shareWeights.items()}
+        except (AttributeError, TypeError, ValueError):
+            self.__logger.pError("shareWeights not updated. Should be a " +
+                                 "dict of project to positive weight")
+            return
+        if any(v <= 0 for v in shareWeights.values()):
+            self.__logger.pError("shareWeights not updated. Weights " +
+                                 "should be positive")
+            return
+        self.__toScheduleJobs.setWeights(shareWeights)
+        self.__logger.pInfo("shareWeights updated to: ", shareWeights)
+
+    def getShareWeights(self):
+        return self.__toScheduleJobs.getWeights()
+
     def getAvailableGPUList(self):
-        val = self.__availableGPU.getCurrVals()
+        val = self.__pool.getSlots()
         return val
 
+    def getDrainingDevices(self):
+        return self.__pool.getDraining()
+
     def getCurrAvailableGPUs(self):
-        val = self.__availableGPU.getCurrVals()
+        '''
+        Returns the devices with some share left that take jobs.
+        '''
+        val = self.__pool.getFree()
         return val
 
+    def getDeviceUsage(self):
+        '''
+        Returns what is in use on every device, see
+        gpupeasy.core.placement.ResourcePool.getUsage.
+        '''
+        return self.__pool.getUsage()
+
+    def getDeviceTelemetry(self):
+        '''
+        Returns the last device samples (see DeviceMonitor.getSamples), None
+        if there is no monitor.
+        '''
+        if self.__monitor is None:
+            return None
+        return self.__monitor.getSamples()
+
+    def getJobHealth(self, jobID):
+        '''
+        Returns what the last /proc check saw of a running job:
+        {'processes', 'cpuSeconds', 'outputBytes', 'idlesec', 'hung'}. None
+        if it was not checked (yet), see gpupeasy.core.health.
+        '''
+        if self.__progress is None:
+            return None
+        try:
+            return self.__progress.getHealth(int(jobID))
+        except (TypeError, ValueError):
+            return None
+
     def getWakesec(self):
         return self.__wakesec
 
@@ -315,54 +1266,116 @@ class GPUSchedulerCore:
     def stopDaemon(self):
         self.__quitFlag = True
         self.__logger.pInfo('Stop received')
-        while (self.__daemonRunning is True) and (self.__daemonThr.isAlive()):
-            time.sleep(0.05)
+        self.__wakeDaemon()
+        self.__childEvent.set()
+        self.__reapedEvent.set()
+        if self.__daemonThr is not None:
+            self.__daemonThr.join()
         self.__logger.pInfo('Daemon exited')
         return
 
     def getJobInfo(self, jobID):
         '''
-        I am conflicted between implementing an internal scheme that will keep
-        a track of the jobs and can allow for O(1) access and this search for
-        each call approach. The first one will put more load on the periodic
-        scans which I don't want to do. The second is expensive.
-
-        I could combine the two and have a lazy update, only performing queue
-        updates on job status on request and only after 10 seconds or so. But
-        this introduces usage of a clock which I don't want to do.
-
-        There is a slim chance that the job is not found due to the other
-        thread medling with the queues, but with a 10s granularity between
-        updates, this is unlikely.
-
-        TODO: Think more about this.
-        '''
-        # Check if a scheduled job
-        jobID = int(jobID)
-        jobs = self.getJobsToSchedule()
-        for job in jobs:
-            if job.jobid == jobID:
-                job.status = 'Scheduled'
-                return job
-        # Else check if a failed job
-        jobs = self.getFailedJobs()
-        for job in jobs:
-            if job.jobid == jobID:
-                job.status = 'Failed'
-                return job
-        # Else check if a successful job
-        jobs = self.getSucceededJobs()
-        for job in jobs:
-            if job.jobid == jobID:
-                job.status = 'Succeeded'
-                return job
-        # else check if running job
-        jobs = self.getRunningJobs()
-        for job in jobs:
-            if job.jobid == jobID:
-                job.status = 'Running'
-                return job
-        return None
+        Returns (job, state) where state is one of 'Scheduled', 'Running',
+        'Succeeded', 'Failed', 'Cancelled' or 'Killed'. Returns (None, None)
+        if the job is not known.
+
+        The lookup goes through the job index, which is updated on every
+        state transition, and does not touch the queues.
+        '''
+        try:
+            jobID = int(jobID)
+        except (TypeError, ValueError):
+            return None, None
+        with self.__indexLock:
+            ret = self.__jobIndex.get(jobID)
+        if ret is None:
+            return None, None
+        return ret[0], ret[1]
+
+    def subscribe(self):
+        '''
+        Returns a gpupeasy.utils.Subscription that receives an event for
+        every job state transition,
+            {'type': 'job', 'version', 'jobID', 'jobName', 'jobCommand',
+             'state', 'gpu', 'returnCode', 'priority', 'project'}
+        every time a device is taken or released,
+            {'type': 'device', 'version', 'gpu', 'idle', 'jobID'}
+        and every time devices are added, removed or drained,
+            {'type': 'devicelist', 'version', 'devices', 'draining'}
+        Call unsubscribe() when done.
+        '''
+        return self.__events.subscribe()
+
+    def unsubscribe(self, subscription):
+        self.__events.unsubscribe(subscription)
+
+    def getVersion(self):
+        '''
+        Returns a counter that is incremented on every job state transition.
+        '''
+        return self.__version
+
+    def getListVersion(self, listName):
+        '''
+        Returns the version of the last change to the listName listing
+        ('scheduled', 'running', 'succeeded' or 'failed'), 0 if it never
+        changed.
+        '''
+        with self.__indexLock:
+            log = self.__changeLogs[listName]
+            if len(log) == 0:
+                return 0
+            return log[-1][0]
+
+    def getJobChanges(self, listName, since=0, limit=None):
+        '''
+        Returns the changes to the listName listing after version since, in
+        version order, as a dict:
+            'jobs': list of (job, state, version) of jobs that entered the
+                listing (or changed) after since.
+            'removed': jobids of jobs that left the listing after since.
+            'version': the version to pass as since to get the next changes.
+            'more': True if limit cut the changes short; call again with
+                since=version for the rest.
+            'full': True if since was too old to compute removals; the
+                caller should drop what it has and use 'jobs' as is.
+
+        since=0 lists the whole listing. The cost is proportional to the
+        number of changes to this listing after since, not to the number of
+        jobs ever seen.
+        '''
+        since = int(since)
+        ret = {'jobs': [], 'removed': [], 'more': False, 'full': False}
+        with self.__indexLock:
+            log = self.__changeLogs[listName]
+            lastChange = self.__lastChange[listName]
+            index = self.__jobIndex
+            full = since < self.__compactedAt[listName] or since <= 0
+            if full:
+                since = 0
+            ret['full'] = full
+            ret['version'] = log[-1][0] if len(log) > 0 else 0
+            start = bisect_right(log, (since, float('inf')))
+            count = 0
+            for i in range(start, len(log)):
+                version, jobid = log[i]
+                if lastChange[jobid] != version:
+                    continue
+                job, state, _ = index[jobid]
+                isMember = LIST_OF_STATE[state] == listName
+                if full and not isMember:
+                    continue
+                if limit is not None and count >= limit:
+                    ret['more'] = True
+                    ret['version'] = log[i - 1][0]
+                    break
+                count += 1
+                if isMember:
+                    ret['jobs'].append((job, state, version))
+                else:
+                    ret['removed'].append(jobid)
+        return ret
 
     def startDaemon(self):
         '''
@@ -378,9 +1391,12 @@ class GPUSchedulerCore:
         self.__daemonThr = threading.Thread(target=self.__daemonThread,
                                             name='scheduler-daemon')
         self.__logger.pInfo("Starting up")
+        self.__startedEvent.clear()
         self.__daemonThr.start()
-        while self.__daemonRunning is False:
-            time.sleep(0.05)
+        self.__startedEvent.wait()
+        if self.__daemonRunning is False:
+            self.__logger.pError('Daemon failed to start')
+            return False
         self.__logger.pInfo("Daemon started")
         return True
 
@@ -0,0 +1,169 @@
+import os
+import time
+
+PROC_ROOT = '/proc'
+
+
+def groupAlive(pgid):
+    '''
+    Returns True if some process is left in the process group pgid.
+    '''
+    try:
+        os.killpg(pgid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def readProcTable(procRoot=PROC_ROOT):
+    '''
+    Returns {pid: (ppid, pgrp, state, cpu ticks)} for every process, read
+    from /proc/<pid>/stat. cpu ticks is user plus system time in clock ticks.
+    Processes exiting while the table is read are skipped.
+    '''
+    ret = {}
+    for name in os.listdir(procRoot):
+        if not name.isdigit():
+            continue
+        try:
+            with open(os.path.join(procRoot, name, 'stat'), 'rb') as fp:
+                data = fp.read()
+        except OSError:
+            continue
+        # The command name (field 2) can hold spaces and parentheses.
+        fields = data[data.rfind(b')') + 2:].split()
+        try:
+            ret[int(name)] = (int(fields[1]), int(fields[2]),
+                              fields[0].decode(),
+                              int(fields[11]) + int(fields[12]))
+        except (IndexError, ValueError):
+            continue
+    return ret
+
+
+class ProcessTree:
+    '''
+    Indexes a process table (see readProcTable) by parent and by process
+    group, so that the processes of every running job can be looked up
+    without rescanning /proc.
+    '''
+    def __init__(self, table):
+        self.__table = table
+        self.__children = {}
+        self.__groups = {}
+        for pid, (ppid, pgrp, _, _) in table.items():
+            self.__children.setdefault(ppid, []).append(pid)
+            self.__groups.setdefault(pgrp, []).append(pid)
+
+    def members(self, pid):
+        '''
+        Returns the live (not zombie) processes of the job started as pid:
+        those in its process group and their descendants, which catches
+        children that moved to a group of their own.
+        '''
+        seen = set()
+        stack = [pid] + self.__groups.get(pid, [])
+        while len(stack) > 0:
+            p = stack.pop()
+            if p in seen or p not in self.__table:
+                continue
+            seen.add(p)
+            stack.extend(self.__children.get(p, []))
+        return [p for p in seen if self.__table[p][2] != 'Z']
+
+    def cpuTicks(self, pids):
+        return sum(self.__table[p][3] for p in pids)
+
+
+class ProgressMonitor:
+    '''
+    Cross-checks the running jobs of this machine against /proc. A job makes
+    progress while its processes use CPU time or its output file grows; one
+    that makes none for hungsec seconds is reported hung. A job none of
+    whose processes is alive any more is reported gone, which catches
+    processes killed or reaped behind the scheduler's back.
+
+    check() scans /proc once for all jobs, so the daemon only calls it every
+    few seconds. Jobs without a local pid (on worker nodes) are skipped.
+
+    Public functions:
+        available()
+        check(jobs)
+        forget(jobid)
+        getHealth(jobid)
+    '''
+    def __init__(self, hungsec=None, procRoot=PROC_ROOT):
+        '''
+        hungsec: Seconds without progress after which a job is hung. None
+            to never report jobs hung.
+        procRoot: Where procfs is mounted.
+        '''
+        self.__hungsec = None if hungsec is None else float(hungsec)
+        self.__procRoot = procRoot
+        self.__ticksPerSec = float(os.sysconf('SC_CLK_TCK'))
+        # jobid -> {'processes', 'cpuSeconds', 'outputBytes', 'idlesec',
+        # 'hung'} plus the time progress was last seen.
+        self.__health = {}
+
+    def available(self):
+        return os.path.isdir(os.path.join(self.__procRoot, 'self'))
+
+    def __outputSize(self, job):
+        if job.stdoutF is None:
+            return None
+        try:
+            return os.stat(job.stdoutF).st_size
+        except OSError:
+            return None
+
+    def check(self, jobs, now=None):
+        '''
+        Updates the health of jobs, the running jobs. Returns (hung, gone):
+        the jobs that became hung in this check, and those with no live
+        process left.
+        '''
+        now = time.monotonic() if now is None else now
+        tree = ProcessTree(readProcTable(self.__procRoot))
+        hung, gone = [], []
+        for job in jobs:
+            pid = getattr(job.subprocess, 'pid', None)
+            if pid is None:
+                continue
+            pids = tree.members(pid)
+            if len(pids) == 0:
+                gone.append(job)
+                continue
+            cpu = tree.cpuTicks(pids) / self.__ticksPerSec
+            size = self.__outputSize(job)
+            prev = self.__health.get(job.jobid)
+            if prev is None or cpu > prev['cpuSeconds'] or \
+                    size != prev['outputBytes']:
+                last, wasHung = now, False
+            else:
+                last, wasHung = prev['lastProgress'], prev['hung']
+            isHung = self.__hungsec is not None and \
+                now - last >= self.__hungsec
+            self.__health[job.jobid] = {'processes': len(pids),
+                                        'cpuSeconds': cpu,
+                                        'outputBytes': size,
+                                        'lastProgress': last,
+                                        'idlesec': now - last,
+                                        'hung': isHung}
+            if isHung and not wasHung:
+                hung.append(job)
+        return hung, gone
+
+    def forget(self, jobid):
+        self.__health.pop(jobid, None)
+
+    def getHealth(self, jobid):
+        '''
+        Returns {'processes', 'cpuSeconds', 'outputBytes', 'idlesec', 'hung'}
+        as of the last check, None if the job was not checked.
+        '''
+        health = self.__health.get(jobid)
+        if health is None:
+            return None
+        return {k: v for k, v in health.items() if k != 'lastProgress'}
@@ -0,0 +1,225 @@
+import os
+import json
+import time
+import threading
+from gpupeasy.utils import Logger
+
+
+class Journal:
+    '''
+    An append-only journal of job state transitions, used to rebuild the
+    scheduler queues after a restart.
+
+    Every transition is written as one JSON line to journal.log:
+        {'op': 'enqueue', 'jobid': .., 'job': {..}}
+        {'op': 'start', 'jobid': .., 'gpu': .., 'devices': [..], 'pid': ..,
+         'pidStart': .., 'startedAt': ..}
+        {'op': 'exit', 'jobid': .., 'returncode': .., 'state': ..,
+         'attempt': {..}}
+
+    A job that is queued again (a retry or a rerun) is recorded with a new
+    'enqueue', carrying its attempts so far.
+
+    record() only appends to an in-memory buffer; a writer thread writes the
+    buffer out and fsyncs it every fsyncsec seconds, so callers never wait
+    on the disk. The writer also keeps the folded state of every job and,
+    every snapshotEvery records, writes it to snapshot.json and truncates the
+    log.
+
+    Public functions:
+        replay()
+        start()
+        record(op, jobid, **fields)
+        close()
+    '''
+    JOURNAL_FILE = 'journal.log'
+    SNAPSHOT_FILE = 'snapshot.json'
+
+    def __init__(self, journalDir, fsyncsec=1.0, snapshotEvery=10000,
+                 logger=None):
+        '''
+        journalDir: The directory to keep the journal and snapshot in.
+            Created if it does not exist.
+        fsyncsec: Seconds between journal flushes. Transitions recorded in
+            the last fsyncsec seconds can be lost on a crash.
+        snapshotEvery: Number of records after which the journal is
+            compacted into a snapshot.
+        '''
+        self.__logger = logger
+        if logger is None:
+            self.__logger = Logger()
+        if not os.path.exists(journalDir):
+            os.makedirs(journalDir)
+        self.__journalF = os.path.join(journalDir, Journal.JOURNAL_FILE)
+        self.__snapshotF = os.path.join(journalDir, Journal.SNAPSHOT_FILE)
+        self.__fsyncsec = float(fsyncsec)
+        self.__snapshotEvery = int(snapshotEvery)
+        self.__buffer = []
+        self.__cond = threading.Condition()
+        self.__quitFlag = False
+        self.__writerThr = None
+        self.__fp = None
+        # jobid -> folded record. Only touched by the writer thread once
+        # started.
+        self.__state = {}
+        self.__sinceSnapshot = 0
+
+    @staticmethod
+    def fold(state, rec):
+        '''
+        Applies one journal record to state (jobid -> job record). The journal
+        always holds complete, ordered transitions since the last snapshot,
+        so replaying it on top of a snapshot that already contains it (a
+        crash between writing the snapshot and truncating the journal) gives
+        the same state.
+        '''
+        jobid = rec['jobid']
+        op = rec['op']
+        if op == 'enqueue':
+            state[jobid] = dict(rec['job'])
+            state[jobid]['jobid'] = jobid
+            state[jobid]['op'] = 'enqueue'
+            return
+        if jobid not in state:
+            return
+        if op == 'start':
+            state[jobid].update(op='start', gpu=rec['gpu'],
+                                devices=rec.get('devices'), pid=rec['pid'],
+                                pidStart=rec.get('pidStart'),
+                                startedAt=rec.get('startedAt'))
+        elif op == 'exit':
+            state[jobid].update(op='exit', returncode=rec['returncode'],
+                                state=rec.get('state'))
+            if rec.get('attempt') is not None:
+                attempts = list(state[jobid].get('attempts') or [])
+                state[jobid]['attempts'] = attempts + [rec['attempt']]
+
+    def replay(self):
+        '''
+        Reads the snapshot and the journal. Returns a list of job records
+        sorted by jobid. Each record contains the job fields given to
+        record('enqueue', ..) and 'op', the last transition seen: 'enqueue',
+        'start' (with 'gpu', 'devices', 'pid', 'pidStart') or 'exit' (with
+        'returncode' and 'state', the final state of the job).
+        '''
+        state = {}
+        if os.path.exists(self.__snapshotF):
+            with open(self.__snapshotF, 'r') as fp:
+                for rec in json.load(fp):
+                    state[rec['jobid']] = rec
+        if os.path.exists(self.__journalF):
+            with open(self.__journalF, 'r') as fp:
+                for line in fp:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        # A torn write at the tail of the journal.
+                        self.__logger.pWarn('Skipping corrupt journal line')
+                        continue
+                    Journal.fold(state, rec)
+        self.__state = state
+        return [state[k] for k in sorted(state)]
+
+    def start(self):
+        self.__truncateTornTail()
+        self.__fp = open(self.__journalF, 'a')
+        self.__writerThr = threading.Thread(target=self.__writerThread,
+                                            name='journal-writer',
+                                            daemon=True)
+        self.__writerThr.start()
+
+    def __truncateTornTail(self):
+        '''
+        Cuts a torn write (a last line without its newline, which replay()
+        skips) off the journal, so that the next record does not get
+        appended to it and lost as well.
+        '''
+        if not os.path.exists(self.__journalF):
+            return
+        with open(self.__journalF, 'rb+') as fp:
+            size = fp.seek(0, os.SEEK_END)
+            if size == 0:
+                return
+            fp.seek(size - 1)
+            if fp.read(1) == b'\n':
+                return
+            # The complete lines end at the last newline.
+            end, pos = 0, size
+            while pos > 0 and end == 0:
+                start = max(pos - 65536, 0)
+                fp.seek(start)
+                idx = fp.read(pos - start).rfind(b'\n')
+                if idx >= 0:
+                    end = start + idx + 1
+                pos = start
+            fp.truncate(end)
+            fp.flush()
+            os.fsync(fp.fileno())
+        self.__logger.pWarn('Truncated torn journal tail (%d bytes)' %
+                            (size - end))
+
+    def record(self, op, jobid, **fields):
+        rec = dict(fields)
+        rec['op'] = op
+        rec['jobid'] = jobid
+        with self.__cond:
+            self.__buffer.append(rec)
+
+    def close(self):
+        with self.__cond:
+            self.__quitFlag = True
+            self.__cond.notify_all()
+        if self.__writerThr is not None:
+            self.__writerThr.join()
+            self.__writerThr = None
+
+    def __writerThread(self):
+        while True:
+            with self.__cond:
+                if not self.__quitFlag:
+                    self.__cond.wait(self.__fsyncsec)
+                batch, self.__buffer = self.__buffer, []
+                quit = self.__quitFlag
+            if len(batch) > 0:
+                self.__write(batch)
+            if quit:
+                break
+        self.__fp.close()
+
+    def __write(self, batch):
+        lines = []
+        for rec in batch:
+            lines.append(json.dumps(rec))
+            Journal.fold(self.__state, rec)
+        try:
+            self.__fp.write('\n'.join(lines) + '\n')
+            self.__fp.flush()
+            os.fsync(self.__fp.fileno())
+        except OSError as e:
+            self.__logger.pError('Journal write failed:', str(e))
+            return
+        self.__sinceSnapshot += len(batch)
+        if self.__sinceSnapshot >= self.__snapshotEvery:
+            self.__snapshot()
+
+    def __snapshot(self):
+        start = time.time()
+        tmp = self.__snapshotF + '.tmp'
+        try:
+            with open(tmp, 'w') as fp:
+                state = self.__state
+                json.dump([state[k] for k in sorted(state)], fp)
+                fp.flush()
+                os.fsync(fp.fileno())
+            os.replace(tmp, self.__snapshotF)
+            # The snapshot now has everything; start a new journal.
+            self.__fp.close()
+            self.__fp = open(self.__journalF, 'w')
+        except OSError as e:
+            self.__logger.pError('Journal snapshot failed:', str(e))
+            if self.__fp.closed:
+                self.__fp = open(self.__journalF, 'a')
+            return
+        self.__sinceSnapshot = 0
+        self.__logger.pDebug('Journal compacted (%d jobs) in %.3fs' %
+                             (len(self.__state), time.time() - start))
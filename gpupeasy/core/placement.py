@@ -0,0 +1,462 @@
+import threading
+from collections import OrderedDict
+
+
+# The capacity of one availableGPU entry. GPU shares are kept as integers in
+# these units so that fractions add up exactly.
+SHARE_UNITS = 1000
+# Placement policies.
+BEST_FIT = 'best'
+FIRST_FIT = 'first'
+POLICIES = [BEST_FIT, FIRST_FIT]
+
+
+def deviceGroup(device):
+    '''
+    Returns the node a device belongs to: the name before the '/' for the
+    devices of worker nodes (see gpupeasy.core.cluster), '' for local ones.
+    '''
+    node, sep, _ = device.partition('/')
+    return node if sep else ''
+
+
+def visibleDevices(devices):
+    '''
+    Returns the gpu string of a job placed on devices: the value of
+    CUDA_VISIBLE_DEVICES, prefixed with '<node>/' if the devices belong to a
+    worker node. All devices belong to the same node.
+    '''
+    if len(devices) == 0:
+        return ''
+    group = deviceGroup(devices[0])
+    if group == '':
+        return ','.join(devices)
+    return group + '/' + ','.join(d.partition('/')[2] for d in devices)
+
+
+def shareUnits(job):
+    return max(1, int(round(job.gpuShare * SHARE_UNITS)))
+
+
+class ResourcePool:
+    '''
+    The devices of a scheduler and the resources running jobs hold on them.
+
+    A device is a CUDA_VISIBLE_DEVICES value. Every time it is listed (see
+    GPUSchedulerCore's availableGPU) it gets SHARE_UNITS of capacity, so that
+    ['2', '2'] fits two jobs asking for a whole GPU, or four asking for half
+    of one. A device may also have a memory size in MB; jobs declaring a
+    memory estimate only go where that much is left. Devices of unknown size
+    accept any estimate.
+
+    A job asks for job.gpus distinct devices, job.gpuShare of each,
+    job.memory MB on each and job.cpus cores. All devices of a job are on
+    the same node. Cores are only limited on nodes given a core count with
+    setCpus(). Jobs asking for no GPU run on the local node.
+
+    A draining device takes no new jobs and leaves the pool once the jobs
+    running on it exit.
+
+    admit(device, memory, running), if given, can veto placing a job with a
+    memory estimate of memory MB on a device running `running` of our jobs,
+    e.g. gpupeasy.core.telemetry.DeviceMonitor.admit. It is called with the
+    pool lock held and should not block.
+
+    All methods are thread-safe.
+
+    Public functions:
+        add(devices)
+        remove(devices)
+        drain(devices)
+        undrain(devices)
+        setMemory(device, memory)
+        setCpus(group, cpus)
+        fits(job)
+        place(job, policy, hold)
+        reserve(job)
+        allocate(job, devices)
+        release(job)
+        hasDevice(device)
+        getSlots()
+        getDraining()
+        getFree()
+        getUsage()
+        getUtilization()
+    '''
+    def __init__(self, devices=(), deviceMemory=None, cpus=None,
+                 admit=None):
+        '''
+        devices: Device slots, in the format of availableGPU.
+        deviceMemory: A dict mapping devices to their memory in MB.
+        cpus: Number of cores of this machine jobs can claim. None for no
+            limit.
+        admit: See above. None to admit jobs wherever they fit.
+        '''
+        # name -> {'slots', 'used', 'usedMemory', 'jobs', 'draining'}, in the
+        # order the devices were added.
+        self.__devices = OrderedDict()
+        self.__memory = dict(deviceMemory or {})
+        # group -> [cores, used]
+        self.__cpus = {'': [cpus, 0]}
+        # jobid -> (devices, units, memory, cpus, group)
+        self.__allocs = {}
+        self.__admit = admit
+        self.__mutex = threading.Lock()
+        self.add(devices)
+
+    def add(self, devices):
+        '''
+        Adds one slot for every entry of devices. A draining device that is
+        added again stops draining.
+        '''
+        with self.__mutex:
+            for name in devices:
+                dev = self.__devices.get(name)
+                if dev is None:
+                    dev = {'slots': 0, 'used': 0, 'usedMemory': 0,
+                           'jobs': set(), 'draining': False}
+                    self.__devices[name] = dev
+                dev['slots'] += 1
+                dev['draining'] = False
+
+    def remove(self, devices):
+        '''
+        Removes one slot for every entry of devices. Jobs running on a
+        removed slot are left running; its capacity is gone once they exit.
+        Unknown devices are ignored. Returns the number of slots removed.
+        '''
+        removed = 0
+        with self.__mutex:
+            for name in devices:
+                dev = self.__devices.get(name)
+                if dev is None or dev['slots'] == 0:
+                    continue
+                dev['slots'] -= 1
+                removed += 1
+                if dev['slots'] == 0 and len(dev['jobs']) == 0:
+                    del self.__devices[name]
+        return removed
+
+    def drain(self, devices):
+        '''
+        Stops placing jobs on devices. Idle ones are removed at once, the
+        others when their last job exits. Unknown devices are ignored.
+        Returns the devices removed at once and those left draining.
+        '''
+        removed, draining = [], []
+        with self.__mutex:
+            for name in devices:
+                dev = self.__devices.get(name)
+                if dev is None:
+                    continue
+                if len(dev['jobs']) == 0:
+                    del self.__devices[name]
+                    removed.append(name)
+                    continue
+                dev['draining'] = True
+                draining.append(name)
+        return removed, draining
+
+    def undrain(self, devices):
+        '''
+        Places jobs on draining devices again. Returns the devices that were
+        draining.
+        '''
+        ret = []
+        with self.__mutex:
+            for name in devices:
+                dev = self.__devices.get(name)
+                if dev is not None and dev['draining']:
+                    dev['draining'] = False
+                    ret.append(name)
+        return ret
+
+    def setMemory(self, device, memory):
+        '''
+        Sets the memory of device in MB, None if not known.
+        '''
+        with self.__mutex:
+            if memory is None:
+                self.__memory.pop(device, None)
+            else:
+                self.__memory[device] = int(memory)
+
+    def setCpus(self, group, cpus):
+        '''
+        Sets the number of cores of a node ('' for this machine). None for no
+        limit.
+        '''
+        with self.__mutex:
+            self.__cpus.setdefault(group, [None, 0])[0] = cpus
+
+    def __cores(self, group):
+        cores = self.__cpus.get(group, (None, 0))[0]
+        return float('inf') if cores is None else cores
+
+    def __freeCpus(self, group, hold):
+        cores, used = self.__cpus.get(group, (None, 0))
+        if cores is None:
+            return float('inf')
+        if hold is not None and hold['group'] == group:
+            used += hold['cpus']
+        return cores - used
+
+    def __candidates(self, job, units, exclude, free=True, admit=None):
+        '''
+        Yields (group, leftover, memLeft, name) of the devices job fits on.
+        With free False, fit is checked against the capacity instead of what
+        is left of it. admit() is consulted if admit is set, which it is by
+        default when free is.
+        '''
+        admit = free if admit is None else admit
+        memory = job.memory or 0
+        for name, dev in self.__devices.items():
+            if name in exclude or dev['draining']:
+                continue
+            left = dev['slots'] * SHARE_UNITS
+            memLeft = self.__memory.get(name)
+            if free:
+                left -= dev['used']
+                if memLeft is not None:
+                    memLeft -= dev['usedMemory']
+            if left < units:
+                continue
+            if memLeft is None:
+                memLeft = float('inf')
+            elif memLeft < memory:
+                continue
+            if admit and self.__admit is not None:
+                if not self.__admit(name, job.memory, len(dev['jobs'])):
+                    continue
+            yield deviceGroup(name), left - units, memLeft - memory, name
+
+    def fits(self, job):
+        '''
+        Returns True if job fits on the devices when nothing else runs.
+        '''
+        with self.__mutex:
+            if job.gpus == 0:
+                return job.cpus <= self.__cores('')
+            count = {}
+            for group, _, _, _ in self.__candidates(job, shareUnits(job), (),
+                                                     free=False):
+                count[group] = count.get(group, 0) + 1
+            for group, n in count.items():
+                if n >= job.gpus and job.cpus <= self.__cores(group):
+                    return True
+            return False
+
+    def place(self, job, policy=BEST_FIT, hold=None):
+        '''
+        Returns the devices to start job on now, None if it does not fit.
+        Nothing is allocated.
+
+        BEST_FIT picks, on the node where the job fits tightest, the devices
+        that would have the least share (then memory) left, so that whole
+        devices are kept free for large jobs. FIRST_FIT picks the first
+        devices it fits on, in the order they were added.
+
+        hold: A reservation from reserve(). Its devices and cores are not
+            used.
+        '''
+        with self.__mutex:
+            if job.gpus == 0:
+                return [] if job.cpus <= self.__freeCpus('', hold) else None
+            exclude = () if hold is None else hold['devices']
+            groups = OrderedDict()
+            cands = self.__candidates(job, shareUnits(job), exclude)
+            for group, left, memLeft, name in cands:
+                groups.setdefault(group, []).append((left, memLeft, name))
+            best = None
+            for group, cands in groups.items():
+                if len(cands) < job.gpus:
+                    continue
+                if job.cpus > self.__freeCpus(group, hold):
+                    continue
+                if policy == FIRST_FIT:
+                    return [name for _, _, name in cands[:job.gpus]]
+                # sorted is stable: ties go to the device added first.
+                chosen = sorted(cands, key=lambda c: c[:2])[:job.gpus]
+                score = (sum(c[0] for c in chosen), sum(c[1] for c in chosen))
+                if best is None or score < best[0]:
+                    best = (score, [name for _, _, name in chosen])
+            return None if best is None else best[1]
+
+    def reserve(self, job):
+        '''
+        Returns a reservation for a job that does not fit now: the devices
+        (with the most share left) and the cores it waits for. Jobs placed
+        with this hold do not use them, so the job starts as soon as the
+        jobs running there exit. Devices admit() turns the job away from are
+        not reserved: our jobs are not what keeps it off them. If no devices
+        qualify, nothing is held.
+        '''
+        with self.__mutex:
+            if job.gpus == 0:
+                return {'devices': set(), 'group': '', 'cpus': job.cpus}
+            groups = OrderedDict()
+            cands = self.__candidates(job, shareUnits(job), (), free=False,
+                                      admit=True)
+            for group, _, _, name in cands:
+                dev = self.__devices[name]
+                left = dev['slots'] * SHARE_UNITS - dev['used']
+                groups.setdefault(group, []).append((-left, name))
+            best = None
+            for group, cands in groups.items():
+                if len(cands) < job.gpus or job.cpus > self.__cores(group):
+                    continue
+                chosen = sorted(cands)[:job.gpus]
+                score = sum(c[0] for c in chosen)
+                if best is None or score < best[0]:
+                    best = (score, group, [name for _, name in chosen])
+            if best is None:
+                return {'devices': set(), 'group': '', 'cpus': 0}
+            return {'devices': set(best[2]), 'group': best[1],
+                    'cpus': job.cpus}
+
+    def allocate(self, job, devices):
+        '''
+        Records job as running on devices. Devices that are not known are
+        skipped. Returns the devices allocated.
+        '''
+        units, memory = shareUnits(job), job.memory or 0
+        with self.__mutex:
+            devices = [d for d in devices if d in self.__devices]
+            group = deviceGroup(devices[0]) if len(devices) > 0 else ''
+            for name in devices:
+                dev = self.__devices[name]
+                dev['used'] += units
+                dev['usedMemory'] += memory
+                dev['jobs'].add(job.jobid)
+            self.__cpus.setdefault(group, [None, 0])[1] += job.cpus
+            self.__allocs[job.jobid] = (devices, units, memory, job.cpus,
+                                        group)
+        return devices
+
+    def release(self, job):
+        '''
+        Frees what job holds. Returns the list of (device, idle, removed) it
+        ran on: idle is True if no other job runs there, removed if the
+        device left the pool (it was removed or drained while busy).
+        '''
+        with self.__mutex:
+            alloc = self.__allocs.pop(job.jobid, None)
+            if alloc is None:
+                return []
+            devices, units, memory, cpus, group = alloc
+            self.__cpus[group][1] -= cpus
+            ret = []
+            for name in devices:
+                dev = self.__devices[name]
+                dev['used'] -= units
+                dev['usedMemory'] -= memory
+                dev['jobs'].discard(job.jobid)
+                idle = len(dev['jobs']) == 0
+                removed = idle and (dev['slots'] == 0 or dev['draining'])
+                if removed:
+                    del self.__devices[name]
+                ret.append((name, idle, removed))
+            return ret
+
+    def hasDevice(self, device):
+        with self.__mutex:
+            return device in self.__devices
+
+    def getSlots(self):
+        '''
+        Returns the device slots, in the format of availableGPU.
+        '''
+        with self.__mutex:
+            ret = []
+            for name, dev in self.__devices.items():
+                ret += [name] * dev['slots']
+            return ret
+
+    def getDraining(self):
+        with self.__mutex:
+            return [name for name, dev in self.__devices.items()
+                    if dev['draining']]
+
+    def getFree(self):
+        '''
+        Returns the devices with some share left that take jobs.
+        '''
+        with self.__mutex:
+            return [name for name, dev in self.__devices.items()
+                    if dev['slots'] * SHARE_UNITS > dev['used'] and
+                    not dev['draining']]
+
+    def getUsage(self):
+        '''
+        Returns {device: {'slots', 'share' (used, in GPUs), 'memory',
+        'usedMemory', 'jobs', 'admitting', 'draining'}}. memory is None if
+        not known. admitting is False if admit() currently turns jobs away
+        from the device.
+        '''
+        with self.__mutex:
+            ret = OrderedDict()
+            for name, dev in self.__devices.items():
+                admitting = True
+                if self.__admit is not None:
+                    admitting = self.__admit(name, None, len(dev['jobs']))
+                ret[name] = {'slots': dev['slots'],
+                             'share': dev['used'] / SHARE_UNITS,
+                             'memory': self.__memory.get(name),
+                             'usedMemory': dev['usedMemory'],
+                             'jobs': sorted(dev['jobs']),
+                             'admitting': admitting,
+                             'draining': dev['draining']}
+            return ret
+
+    def getUtilization(self):
+        '''
+        Returns the fraction of the device capacity in use.
+        '''
+        with self.__mutex:
+            capacity = sum(d['slots'] for d in self.__devices.values())
+            if capacity == 0:
+                return 0.0
+            used = sum(d['used'] for d in self.__devices.values())
+            return used / float(capacity * SHARE_UNITS)
+
+
+def selectJobs(pool, queue, policy=BEST_FIT, backfill=True, depth=64):
+    '''
+    Picks the queued jobs to start now, takes them out of queue and
+    allocates their devices. Returns a list of (job, devices).
+
+    Jobs are considered in queue order. Without backfill, this stops at the
+    first job that does not fit. With backfill, the first job that does not
+    fit gets a reservation (see ResourcePool.reserve) and the jobs behind it
+    are started on what is left, looking up to depth jobs ahead. The
+    reservation keeps smaller jobs from starving a large one. Jobs that can
+    never fit on the current devices are skipped.
+
+    queue is a gpupeasy.utils.LockedQueue of jobs keyed by jobid.
+    '''
+    started = []
+    while True:
+        batch = queue.getFirstVals(depth)
+        if len(pool.getFree()) == 0 and \
+                not any(job.gpus == 0 for job in batch):
+            # Only jobs without devices (gpus=0) can start on a full pool.
+            return started
+        hold = None
+        progress = False
+        for job in batch:
+            if not pool.fits(job):
+                continue
+            devices = pool.place(job, policy, hold)
+            if devices is None:
+                if not backfill:
+                    return started
+                if hold is None:
+                    hold = pool.reserve(job)
+                continue
+            if queue.take(job.jobid) is None:
+                continue
+            pool.allocate(job, devices)
+            started.append((job, devices))
+            progress = True
+        if not progress:
+            return started
@@ -0,0 +1,109 @@
+import re
+import math
+
+
+class RetryPolicy:
+    '''
+    When and how often a failed job is run again.
+
+    A job that fails (exits with a non-zero code, not killed or cancelled)
+    is put back in the queue as long as it has run fewer than maxAttempts
+    times and the failure matches the policy: its exit code is in exitCodes
+    (any non-zero code if None) or, if patterns are given, the tail of its
+    output matches one of them. Both lists given means either matching
+    retries. The n-th retry waits backoff * factor ** (n - 1) seconds, at
+    most maxBackoff.
+
+        RetryPolicy(maxAttempts=3, backoff=30, patterns=['CUDA error',
+                                                         'Stale file handle'])
+    '''
+    def __init__(self, maxAttempts=1, backoff=30, factor=2, maxBackoff=3600,
+                 exitCodes=None, patterns=None):
+        '''
+        Raises ValueError for invalid values, e.g. a pattern that does not
+        compile.
+        '''
+        self.maxAttempts = int(maxAttempts)
+        self.backoff = float(backoff)
+        self.factor = float(factor)
+        self.maxBackoff = float(maxBackoff)
+        if self.maxAttempts < 1:
+            raise ValueError('maxAttempts should be at least 1')
+        values = [self.backoff, self.factor, self.maxBackoff]
+        if not all(math.isfinite(x) for x in values):
+            raise ValueError('backoff, factor and maxBackoff should be '
+                             'finite')
+        if self.backoff < 0 or self.factor < 1 or self.maxBackoff < 0:
+            raise ValueError('backoff and maxBackoff should be non-negative '
+                             'and factor at least 1')
+        self.exitCodes = None
+        if exitCodes is not None:
+            self.exitCodes = [int(x) for x in exitCodes]
+        self.patterns = None
+        self.__compiled = []
+        if patterns is not None:
+            self.patterns = [str(x) for x in patterns]
+            try:
+                self.__compiled = [re.compile(x) for x in self.patterns]
+            except re.error as e:
+                raise ValueError('Invalid pattern: %s' % str(e))
+
+    def needsOutput(self):
+        '''
+        True if shouldRetry() looks at the output of the job.
+        '''
+        return len(self.__compiled) > 0
+
+    def shouldRetry(self, attempts, returncode, output=None):
+        '''
+        attempts: Number of times the job has run, this failure included.
+        returncode: Its exit code.
+        output: The tail of its output as a string, if needsOutput().
+        '''
+        if returncode == 0 or attempts >= self.maxAttempts:
+            return False
+        if self.exitCodes is None and self.patterns is None:
+            return True
+        if self.exitCodes is not None and returncode in self.exitCodes:
+            return True
+        if output is not None:
+            return any(p.search(output) for p in self.__compiled)
+        return False
+
+    def delay(self, attempts):
+        '''
+        Seconds to wait before the retry following attempt number attempts.
+        '''
+        try:
+            delay = self.backoff * self.factor ** (attempts - 1)
+        except OverflowError:
+            # Far past maxBackoff.
+            return self.maxBackoff
+        return min(delay, self.maxBackoff)
+
+    def toDict(self):
+        return {'maxAttempts': self.maxAttempts, 'backoff': self.backoff,
+                'factor': self.factor, 'maxBackoff': self.maxBackoff,
+                'exitCodes': self.exitCodes, 'patterns': self.patterns}
+
+    @staticmethod
+    def fromDict(d):
+        '''
+        Raises ValueError on invalid or unknown keys.
+        '''
+        if d is None:
+            return None
+        if not isinstance(d, dict):
+            raise ValueError('Retry policy should be a dictionary')
+        keys = ['maxAttempts', 'backoff', 'factor', 'maxBackoff',
+                'exitCodes', 'patterns']
+        unknown = [k for k in d if k not in keys]
+        if len(unknown) > 0:
+            raise ValueError('Unknown retry keys: %s' % ', '.join(unknown))
+        for k in ['exitCodes', 'patterns']:
+            if d.get(k) is not None and not isinstance(d[k], list):
+                raise ValueError('%s should be a list' % k)
+        try:
+            return RetryPolicy(**d)
+        except TypeError as e:
+            raise ValueError(str(e))
@@ -1,8 +1,221 @@
 import os
-from flask import Flask, request, jsonify
+import json
+from flask import Flask, Response, request, jsonify
 
 from gpupeasy.core.gpuscheduler import GPUSchedulerCore, Job
-from gpupeasy.utils import Logger
+from gpupeasy.core.gpuscheduler import LIST_SCHEDULED, LIST_SUCCEEDED
+from gpupeasy.core.gpuscheduler import LIST_FAILED, LIST_RUNNING
+from gpupeasy.core.gpuscheduler import STATE_RUNNING
+from gpupeasy.core.journal import Journal
+from gpupeasy.core.cluster import Cluster
+from gpupeasy.core.telemetry import DeviceMonitor, makeProvider
+from gpupeasy.core.retry import RetryPolicy
+from gpupeasy.core.snapshot import CodeCache
+from gpupeasy.utils import Logger, formatSSE
+from gpupeasy.serving import serveApp
+
+
+def validateJob(jobName, jobOutFile, jobCommand):
+    '''
+    Returns false if error occurred along with error message.
+    Else, returns true with None as message
+    If user wants to implement custom validator, it should be part of the
+    GUI layer and not the core server.
+    '''
+    jobOutF = jobOutFile
+    if len(jobCommand) == 0:
+        message = 'No jobs were submitted'
+        return False, message
+    if len(jobName) == 0:
+        message = 'No job name was provided'
+        return False, message
+    if len(jobOutF) == 0:
+        message = 'Output file not specified'
+        return False, message
+    if os.path.exists(jobOutF):
+        message = 'Output file already exists: %s' % jobOutF
+        return False, message
+    return True, None
+
+
+def validatePriority(priority, project):
+    try:
+        int(priority)
+    except (TypeError, ValueError):
+        message = 'Priority should be an integer: %s' % str(priority)
+        return False, message
+    if project is not None and not isinstance(project, str):
+        message = 'Project should be a string: %s' % str(project)
+        return False, message
+    if project is not None and len(project) == 0:
+        message = 'Project cannot be empty'
+        return False, message
+    return True, None
+
+
+def validateResources(gpus, gpuShare, memory, cpus):
+    '''
+    Validates the resource requests of a job, see Job.
+    '''
+    try:
+        assert int(gpus) == gpus and gpus >= 0
+    except (TypeError, ValueError, AssertionError):
+        message = 'gpus should be a non-negative integer: %s' % str(gpus)
+        return False, message
+    try:
+        assert 0 < float(gpuShare) <= 1
+    except (TypeError, ValueError, AssertionError):
+        message = 'gpuShare should be in (0, 1]: %s' % str(gpuShare)
+        return False, message
+    try:
+        assert memory is None or (int(memory) == memory and memory >= 0)
+    except (TypeError, ValueError, AssertionError):
+        message = 'memory should be a non-negative integer (MB): %s'
+        return False, message % str(memory)
+    try:
+        assert int(cpus) == cpus and cpus >= 0
+    except (TypeError, ValueError, AssertionError):
+        message = 'cpus should be a non-negative integer: %s' % str(cpus)
+        return False, message
+    return True, None
+
+
+def jobToDict(job):
+    return {'jobID': job.jobid, 'jobName': job.name,
+            'jobCommand': ' '.join(job.commandList),
+            'priority': job.priority, 'project': job.project,
+            'returnCode': job.returncode, 'gpu': job.gpu,
+            'devices': job.devices, 'gpus': job.gpus,
+            'gpuShare': job.gpuShare, 'memory': job.memory,
+            'cpus': job.cpus, 'attempts': len(job.attempts)}
+
+
+def parseJob(job, codeCache=None):
+    '''
+    Validates a job dictionary as accepted by /addnewjob and creates its
+    output file. Jobs asking for it are snapshot into codeCache (a
+    gpupeasy.core.snapshot.CodeCache). Returns a Job and None, or None and
+    an error message.
+    '''
+    if not isinstance(job, dict):
+        return None, 'Job should be a dictionary'
+    keys = ['outFile', 'jobName', 'jobCommand']
+    for key in keys:
+        if key not in job:
+            return None, 'Key \'%s\' not found' % key
+    jobName, outFile = job['jobName'], job['outFile']
+    jobCommand = job['jobCommand']
+    priority, project = job.get('priority', 0), job.get('project', None)
+    ret, msg = validateJob(jobName, outFile, jobCommand)
+    if ret is False:
+        return None, msg
+    ret, msg = validatePriority(priority, project)
+    if ret is False:
+        return None, msg
+    resources = {'gpus': job.get('gpus', 1),
+                 'gpuShare': job.get('gpuShare', 1.0),
+                 'memory': job.get('memory', None),
+                 'cpus': job.get('cpus', 0)}
+    ret, msg = validateResources(**resources)
+    if ret is False:
+        return None, msg
+    try:
+        retry = RetryPolicy.fromDict(job.get('retry', None))
+    except ValueError as e:
+        return None, str(e)
+    snapshot = job.get('snapshot', False)
+    if snapshot is not False and snapshot is not None:
+        if codeCache is None:
+            return None, 'Code snapshots are not enabled on this server'
+        if snapshot is not True and not isinstance(snapshot, dict):
+            return None, 'snapshot should be true or {\'root\': path}'
+    # O_EXCL so that two jobs in flight cannot claim the same file.
+    try:
+        fd = os.open(outFile, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+    except FileExistsError:
+        return None, 'Output file already exists: %s' % outFile
+    except OSError:
+        return None, 'Could not open output file: %s' % outFile
+    os.close(fd)
+    job = Job(jobName, jobCommand, stdoutF=outFile, priority=priority,
+              project=project, retry=retry, **resources)
+    if snapshot is True or isinstance(snapshot, dict):
+        root = None if snapshot is True else snapshot.get('root')
+        try:
+            codeCache.snapshot(job, root=root)
+        except (ValueError, OSError) as e:
+            releaseOutFile(job)
+            return None, 'Could not snapshot the code: %s' % str(e)
+    return job, None
+
+
+def releaseOutFile(job, codeCache=None):
+    # Removes the (empty) output file created by parseJob for a job
+    # the core did not accept, so that it can be resubmitted, and drops its
+    # code snapshot.
+    try:
+        os.remove(job.stdoutF)
+    except OSError:
+        pass
+    if codeCache is not None and job.snapshot is not None:
+        codeCache.release(job.snapshot)
+
+
+def addJobBatch(backend, jobList, codeCache=None):
+    '''
+    Parses and validates a list of job dictionaries (see /addnewjob) and
+    adds the valid ones to backend together. Returns the /addjobs response.
+    codeCache: Where jobs asking for a code snapshot are snapshot, see
+        parseJob.
+    '''
+    results, parsed = parseJobBatch(jobList, codeCache)
+    return addParsedJobs(backend, results, parsed, codeCache)
+
+
+def parseJobBatch(jobList, codeCache=None):
+    '''
+    The parsing half of addJobBatch, which touches the filesystem. Returns
+    (results, parsed): the /addjobs result of each job, None for the jobs
+    that parsed, and (index, job) for those.
+    '''
+    results = [None] * len(jobList)
+    parsed = []
+    seenOutFiles = set()
+    for i, jobD in enumerate(jobList):
+        outFile = jobD.get('outFile') if isinstance(jobD, dict) else None
+        if outFile is not None and outFile in seenOutFiles:
+            msg = 'Output file common to multiple jobs: %s' % outFile
+            results[i] = {'status': 'failed', 'jobID': None,
+                          'message': msg}
+            continue
+        job, msg = parseJob(jobD, codeCache)
+        if job is None:
+            results[i] = {'status': 'failed', 'jobID': None,
+                          'message': msg}
+            continue
+        seenOutFiles.add(outFile)
+        parsed.append((i, job))
+    return results, parsed
+
+
+def addParsedJobs(backend, results, parsed, codeCache=None):
+    '''
+    The second half of addJobBatch: adds the jobs parseJobBatch returned to
+    backend and returns the /addjobs response.
+    '''
+    added = backend.addNewJobs([job for _, job in parsed])
+    for (i, job), (ret, jobid) in zip(parsed, added):
+        if ret is False:
+            releaseOutFile(job, codeCache)
+            msg = 'Could not add new job: %s. Check logs for details'
+            results[i] = {'status': 'failed', 'jobID': None,
+                          'message': msg % job.name}
+            continue
+        results[i] = {'status': 'successful', 'jobID': jobid,
+                      'message': None}
+    numAdded = len([x for x in results if x['status'] == 'successful'])
+    return {'status': 'successful', 'value': results,
+            'numAdded': numAdded, 'numFailed': len(results) - numAdded}
 
 
 class GPUPeasyServer:
@@ -12,7 +225,13 @@ class GPUPeasyServer:
     commands. This is a simple flask based server. Security features and
     what not are not implemented.
     '''
-    def __init__(self, gpuList, logdir=None, debug=False, wakesec=5):
+    def __init__(self, gpuList, logdir=None, debug=False, wakesec=5,
+                 shareWeights=None, journalDir=None, fsyncsec=1,
+                 coordinator=False, heartbeatsec=2, deadsec=10,
+                 deviceMemory=None, cpus=None, placement='best',
+                 backfill=True, telemetry=None, samplesec=2,
+                 maxUtilization=90, minFreeMemory=0, killGracesec=10,
+                 hungsec=None, killHung=False, codeCacheDir=None):
         '''
         The GPUPeasyServer.
         This server initializes the gpupeasy core scheduler and awaits
@@ -29,13 +248,77 @@ class GPUPeasyServer:
         debug: To run in debug mode.
         wakesec: The wakesec argument for the core scheduler. Defines the
             time in seconds between process status checks and updates.
+        shareWeights: A dict mapping project tags to their share of the
+            devices. See GPUSchedulerCore.
+        journalDir: If provided, job state transitions are journaled to this
+            directory and the queues are restored from it on startup.
+        fsyncsec: Seconds between journal flushes to disk.
+        coordinator: Run as the coordinator of several machines. Worker
+            agents (see gpupeasy.core.worker) register their devices and
+            are sent jobs; gpuList can then be empty.
+        heartbeatsec: Seconds between heartbeats of the workers.
+        deadsec: Seconds without heartbeat after which a worker is
+            considered dead and its jobs are re-queued.
+        deviceMemory: A dict mapping devices to their memory in MB, for
+            jobs that declare a memory estimate.
+        cpus: Number of CPU cores jobs on this machine can claim. None for
+            no limit.
+        placement: 'best' or 'first' fit. See GPUSchedulerCore.
+        backfill: Start smaller jobs while a large one waits for devices.
+            See GPUSchedulerCore.
+        telemetry: 'nvml' to sample the GPUs through NVML (pip install
+            nvidia-ml-py), or the path of a JSON file with the samples (see
+            gpupeasy.core.telemetry.FileProvider). Jobs are then kept off
+            devices that are busy or short of memory. None to trust gpuList.
+        samplesec: Seconds between telemetry samples.
+        maxUtilization: Utilization (%) above which a device none of our
+            jobs runs on is considered in use.
+        minFreeMemory: Free memory (MB) a device needs to take a job
+            without a memory estimate.
+        killGracesec: Seconds /killjob waits after SIGTERM before sending
+            SIGKILL.
+        hungsec: Seconds without CPU time used or output written after
+            which a running job is reported hung. None to not check.
+        killHung: Kill hung jobs, and processes left behind by jobs that
+            exited, instead of only logging them.
+        codeCacheDir: If provided, jobs submitted with 'snapshot' run from
+            a copy of their code kept in this directory, taken when they are
+            queued. See gpupeasy.core.snapshot.
         '''
         # Should probably have debug levels for the logger: TODO?
         self.__debug = debug
         self.__setupLogging(logdir, debug)
         self.__frontend = Flask('gpupeasy-server')
+        journal = None
+        if journalDir is not None:
+            journal = Journal(journalDir, fsyncsec=fsyncsec,
+                              logger=self.__logger)
+        monitor = None
+        if telemetry is not None:
+            monitor = DeviceMonitor(makeProvider(telemetry),
+                                    samplesec=samplesec,
+                                    maxUtilization=maxUtilization,
+                                    minFreeMemory=minFreeMemory,
+                                    logger=self.__logger)
+        self.__codeCache = None
+        if codeCacheDir is not None:
+            self.__codeCache = CodeCache(codeCacheDir, logger=self.__logger)
+        self.__cluster = None
+        launcher = None
+        if coordinator:
+            self.__cluster = Cluster(heartbeatsec=heartbeatsec,
+                                     deadsec=deadsec, logger=self.__logger)
+            launcher = self.__cluster.launch
         self.__backend = GPUSchedulerCore(gpuList, wakesec=wakesec,
-                                          logger=self.__logger)
+                                          logger=self.__logger,
+                                          shareWeights=shareWeights,
+                                          journal=journal, launcher=launcher,
+                                          deviceMemory=deviceMemory,
+                                          cpus=cpus, placement=placement,
+                                          backfill=backfill, monitor=monitor,
+                                          killGracesec=killGracesec,
+                                          hungsec=hungsec, killHung=killHung,
+                                          codeCache=self.__codeCache)
         fe = self.__frontend
         fe.add_url_rule('/deviceutilization', 'getDeviceUtilization',
                         self.__getDeviceUtilization)
@@ -44,11 +327,40 @@ class GPUPeasyServer:
         fe.add_url_rule('/successfuljobs', 'getSuccessfulJobs',
                         self.__getSuccessfulJobs)
         fe.add_url_rule('/failedjobs', 'getFailedJobs', self.__getFailedJobs)
+        fe.add_url_rule('/runningjobs', 'getRunningJobs',
+                        self.__getRunningJobs)
         fe.add_url_rule('/addnewjob', 'addNewJob', self.__addNewJob,
                         methods=['POST'])
+        fe.add_url_rule('/addjobs', 'addJobs', self.__addJobs,
+                        methods=['POST'])
         fe.add_url_rule('/availabledevices', 'getAvailableGPUList',
                         self.__getAvailableGPUList)
+        fe.add_url_rule('/setdevices', 'setDevices', self.__setDevices,
+                        methods=['POST'])
+        fe.add_url_rule('/adddevices', 'addDevices', self.__addDevices,
+                        methods=['POST'])
+        fe.add_url_rule('/removedevices', 'removeDevices',
+                        self.__removeDevices, methods=['POST'])
+        fe.add_url_rule('/draindevices', 'drainDevices', self.__drainDevices,
+                        methods=['POST'])
+        fe.add_url_rule('/undraindevices', 'undrainDevices',
+                        self.__undrainDevices, methods=['POST'])
         fe.add_url_rule('/jobinfo/<jobID>', 'getJobInfo', self.__getJobInfo)
+        fe.add_url_rule('/canceljob/<jobID>', 'cancelJob', self.__cancelJob,
+                        methods=['POST'])
+        fe.add_url_rule('/killjob/<jobID>', 'killJob', self.__killJob,
+                        methods=['POST'])
+        fe.add_url_rule('/rerun', 'rerunJobs', self.__rerunJobs,
+                        methods=['POST'])
+        fe.add_url_rule('/events', 'getEvents', self.__getEvents)
+        if coordinator:
+            fe.add_url_rule('/worker/register', 'registerWorker',
+                            self.__registerWorker, methods=['POST'])
+            fe.add_url_rule('/worker/heartbeat', 'workerHeartbeat',
+                            self.__workerHeartbeat, methods=['POST'])
+            fe.add_url_rule('/workers', 'getWorkers', self.__getWorkers)
+        # Seconds between keep-alive comments on idle event streams.
+        self.__keepalivesec = 15
 
     def __setupLogging(self, logdir, debug):
         if logdir is None:
@@ -62,28 +374,6 @@ class GPUPeasyServer:
         logfile = open(logfile, 'a+')
         self.__logger = Logger(fstdout=logfile, debug=debug)
 
-    def __validateJob(self, jobName, jobOutFile, jobCommand):
-        '''
-        Returns false if error occurred along with error message.
-        Else, returns true with None as message
-        If user wants to implement custom validator, it should be part of the
-        GUI layer and not the core server.
-        '''
-        jobOutF = jobOutFile
-        if len(jobCommand) == 0:
-            message = 'No jobs were submitted'
-            return False, message
-        if len(jobName) == 0:
-            message = 'No job name was provided'
-            return False, message
-        if len(jobOutF) == 0:
-            message = 'Output file not specified'
-            return False, message
-        if os.path.exists(jobOutF):
-            message = 'Output file already exists: %s' % jobOutF
-            return False, message
-        return True, None
-
     # URL Handlers
     def __getAvailableGPUList(self):
         '''
@@ -91,20 +381,128 @@ class GPUPeasyServer:
             {
              'status': 'successful' or 'failed'
              'value' : a list of devices
+             'draining': the devices that take no new jobs and are removed
+                once their jobs exit
              }
         '''
         backend = self.__backend
         ret = backend.getAvailableGPUList()
-        ret = {'status': 'successful', 'value': ret}
+        ret = {'status': 'successful', 'value': ret,
+               'draining': backend.getDrainingDevices()}
         return jsonify(ret)
 
+    def __getDeviceList(self):
+        '''
+        Returns the 'devices' list of a POSTed json, in the gpuList format,
+        and an error message if there is none.
+        '''
+        data = request.get_json(silent=True)
+        if data is None or 'devices' not in data:
+            return None, 'Key \'devices\' required'
+        devices = data['devices']
+        if not isinstance(devices, list) or \
+                not all(isinstance(x, str) for x in devices):
+            return None, 'Devices should be a list of strings'
+        return devices, None
+
+    def __setDevices(self):
+        '''
+        Only accepts POST, with json {'devices': list of devices in the
+        gpuList format}. Makes it the list of available devices: devices
+        not in it are drained (see /draindevices).
+
+        returns json:
+            {'status': 'successful' or 'failed',
+             'message': error message if failed}
+        '''
+        devices, msg = self.__getDeviceList()
+        if devices is None:
+            return jsonify({'status': 'failed', 'message': msg})
+        self.__backend.setAvailableGPU(devices)
+        return jsonify({'status': 'successful'})
+
+    def __addDevices(self):
+        '''
+        Only accepts POST, with json {'devices': list of devices in the
+        gpuList format}. Jobs are scheduled on the devices right away.
+        Listing a device twice adds two slots. Adding a draining device
+        stops the drain.
+
+        returns json:
+            {'status': 'successful' or 'failed',
+             'message': error message if failed}
+        '''
+        devices, msg = self.__getDeviceList()
+        if devices is None:
+            return jsonify({'status': 'failed', 'message': msg})
+        self.__backend.addDevices(devices)
+        return jsonify({'status': 'successful'})
+
+    def __removeDevices(self):
+        '''
+        Only accepts POST, with json {'devices': list of devices}. Removes one
+        slot for every entry. Busy slots are removed when their job exits.
+
+        returns json:
+            {'status': 'successful' or 'failed',
+             'message': error message if failed,
+             'value': number of slots removed}
+        '''
+        devices, msg = self.__getDeviceList()
+        if devices is None:
+            return jsonify({'status': 'failed', 'message': msg})
+        ret = self.__backend.removeDevices(devices)
+        return jsonify({'status': 'successful', 'value': ret})
+
+    def __drainDevices(self):
+        '''
+        Only accepts POST, with json {'devices': list of devices}. No new
+        jobs are scheduled on the devices; running jobs are left to finish,
+        after which the devices are removed.
+
+        returns json:
+            {'status': 'successful' or 'failed',
+             'message': error message if failed,
+             'removed': devices removed at once (they were idle),
+             'draining': devices waiting for their jobs to exit}
+        '''
+        devices, msg = self.__getDeviceList()
+        if devices is None:
+            return jsonify({'status': 'failed', 'message': msg})
+        removed, draining = self.__backend.drainDevices(devices)
+        return jsonify({'status': 'successful', 'removed': removed,
+                        'draining': draining})
+
+    def __undrainDevices(self):
+        '''
+        Only accepts POST, with json {'devices': list of devices}. Draining
+        devices take jobs again.
+
+        returns json:
+            {'status': 'successful' or 'failed',
+             'message': error message if failed,
+             'value': the devices that were draining}
+        '''
+        devices, msg = self.__getDeviceList()
+        if devices is None:
+            return jsonify({'status': 'failed', 'message': msg})
+        ret = self.__backend.undrainDevices(devices)
+        return jsonify({'status': 'successful', 'value': ret})
+
     def __getDeviceUtilization(self):
         '''
         returns json:
             {'status': 'successful' or 'failed',
             'value': A list of dict each of the following structure:
                 {'jobid': jobid, 'jobName': jobname,
-                'jobCommand': jobCommand, 'gpu': gpu}
+                'jobCommand': jobCommand, 'gpu': gpu,
+                'devices': devices, 'gpuShare': gpuShare},
+            'devices': {device: {'slots', 'share', 'memory',
+                'usedMemory', 'jobs', 'admitting'}}, see
+                GPUSchedulerCore.getDeviceUsage,
+            'telemetry': {'age': seconds, 'devices': {gpu: {'memoryTotal',
+                'memoryUsed', 'utilization', 'pids'}}} or None, see
+                gpupeasy.core.telemetry
             }
         '''
         backend = self.__backend
@@ -114,79 +512,165 @@ class GPUPeasyServer:
             command = ' '.join(job.commandList)
             gpu = job.gpu
             jobD = {'jobID': job.jobid, 'jobName': job.name,
-                    'jobCommand': command, 'gpu': gpu}
+                    'jobCommand': command, 'gpu': gpu,
+                    'devices': job.devices, 'gpuShare': job.gpuShare}
             jobs.append(jobD)
-        ret = {'status':'successful', 'value': jobs}
+        ret = {'status':'successful', 'value': jobs,
+               'devices': backend.getDeviceUsage(),
+               'telemetry': backend.getDeviceTelemetry()}
         return jsonify(ret)
 
+    def __listJobs(self, listName, getter):
+        '''
+        Common handler for the job listings. Supports:
+            If-None-Match: Responds with 304 if the listing did not change
+                since the ETag was issued.
+            ?since=<version>: Only jobs that entered the listing after
+                version, plus the ids of those that left it ('removed').
+            ?limit=<N>: At most N entries. If 'more' is true, request
+                again with since set to the returned 'version'.
+        Without since and limit the whole listing is returned, in queue
+        order.
+        '''
+        backend = self.__backend
+        version = backend.getListVersion(listName)
+        etag = '%s-%d' % (listName, version)
+        if request.if_none_match.contains(etag):
+            resp = Response(status=304)
+            resp.set_etag(etag)
+            return resp
+        since = request.args.get('since', None)
+        limit = request.args.get('limit', None)
+        if since is None and limit is None:
+            jobs = [jobToDict(job) for job in getter()]
+            ret = {'status': 'successful', 'value': jobs, 'version': version}
+        else:
+            try:
+                since = int(since) if since is not None else 0
+                limit = int(limit) if limit is not None else None
+                assert limit is None or limit > 0
+            except (ValueError, AssertionError):
+                msg = 'since and limit should be positive integers'
+                return jsonify({'status': 'failed', 'message': msg})
+            changes = backend.getJobChanges(listName, since, limit)
+            jobs = []
+            for job, _, jobVersion in changes['jobs']:
+                jobD = jobToDict(job)
+                jobD['version'] = jobVersion
+                jobs.append(jobD)
+            ret = {'status': 'successful', 'value': jobs,
+                   'removed': changes['removed'],
+                   'version': changes['version'],
+                   'more': changes['more'], 'full': changes['full']}
+        resp = jsonify(ret)
+        resp.set_etag(etag)
+        return resp
+
     def __getScheduledJobs(self):
         '''
         returns josn:
             {'status': 'successful' or 'failed',
+            'version': listing version, see __listJobs,
             'value': A list of dict each of the following structure:
                 {
                     'jobid': jobid,
                     'jobName': jobname,
                     'jobCommand': jobCommand,
+                    'priority': priority,
+                    'project': project,
+                    'returnCode': None,
+                    'gpu': None,
                 }
             }
+        The list is in the order in which jobs will be scheduled.
         '''
-        backend = self.__backend
-        ret = backend.getJobsToSchedule()
-        jobs = []
-        for job in ret:
-            command = ' '.join(job.commandList)
-            jobD = {'jobID': job.jobid, 'jobName': job.name,
-                    'jobCommand': command}
-            jobs.append(jobD)
-        ret = {'status':'successful', 'value': jobs}
-        return jsonify(ret)
+        return self.__listJobs(LIST_SCHEDULED,
+                               self.__backend.getJobsToSchedule)
 
     def __getSuccessfulJobs(self):
         '''
         returns josn:
             {'status': 'successful' or 'failed',
+            'version': listing version, see __listJobs,
             'value': A list of dict each of the following structure:
                 {
                     'jobid': jobid,
                     'jobName': jobname,
                     'jobCommand': jobCommand,
+                    'priority': priority,
+                    'project': project,
+                    'returnCode': returnCode,
+                    'gpu': gpu the job ran on,
                 }
             }
         '''
-        backend = self.__backend
-        ret = backend.getSucceededJobs()
-        jobs = []
-        for job in ret:
-            command = ' '.join(job.commandList)
-            jobD = {'jobID': job.jobid, 'jobName': job.name,
-                    'jobCommand': command, 'returnCode': job.returncode}
-            jobs.append(jobD)
-        ret = {'status':'successful', 'value': jobs}
-        return jsonify(ret)
+        return self.__listJobs(LIST_SUCCEEDED,
+                               self.__backend.getSucceededJobs)
 
     def __getFailedJobs(self):
         '''
         returns josn:
             {'status': 'successful' or 'failed',
+            'version': listing version, see __listJobs,
             'value': A list of dict each of the following structure:
                 {
                     'jobid': jobid,
                     'jobName': jobname,
                     'jobCommand': jobCommand,
+                    'priority': priority,
+                    'project': project,
+                    'returnCode': returnCode,
+                    'gpu': gpu the job ran on,
                 }
             }
         '''
+        return self.__listJobs(LIST_FAILED, self.__backend.getFailedJobs)
+
+    def __getEvents(self):
+        '''
+        A server-sent event stream of job and device changes. Events:
+            hello: {'version': version}, sent once on connect.
+            job: a job state transition, see GPUSchedulerCore.subscribe.
+            device: a device was taken or released.
+            resync: {'version': version}, the client fell behind and
+                events were dropped. Refetch the listings.
+        The SSE id of job and device events is the state version, which can
+        be passed as ?since= to the listing end-points.
+        '''
         backend = self.__backend
-        ret = backend.getFailedJobs()
-        jobs = []
-        for job in ret:
-            command = ' '.join(job.commandList)
-            jobD = {'jobID': job.jobid, 'jobName': job.name,
-                    'jobCommand': command, 'returnCode': job.returncode}
-            jobs.append(jobD)
-        ret = {'status':'successful', 'value': jobs}
-        return jsonify(ret)
+        # Subscribe before reading the version so that nothing is missed.
+        sub = backend.subscribe()
+        keepalivesec = self.__keepalivesec
+
+        def stream():
+            try:
+                msg = {'version': backend.getVersion()}
+                yield formatSSE(msg, event='hello')
+                while True:
+                    event = sub.get(timeout=keepalivesec)
+                    if sub.overflowed:
+                        sub.clearOverflow()
+                        msg = {'version': backend.getVersion()}
+                        yield formatSSE(msg, event='resync')
+                        continue
+                    if event is None:
+                        yield ': keep-alive\n\n'
+                        continue
+                    yield formatSSE(event, event=event['type'],
+                                    eventId=event['version'])
+            finally:
+                backend.unsubscribe(sub)
+
+        headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        return Response(stream(), mimetype='text/event-stream',
+                        headers=headers)
+
+    def __getRunningJobs(self):
+        '''
+        Same as /scheduledjobs, for running jobs. 'gpu' is the device each
+        job runs on.
+        '''
+        return self.__listJobs(LIST_RUNNING, self.__backend.getRunningJobs)
 
     def __getJobInfo(self, jobID):
         '''
@@ -198,31 +682,133 @@ class GPUPeasyServer:
                     'jobname':jobname',
                     'jobCOmmand': 'jobCommand',
                     'outFile' : outFiel,
-                    'status': current status
-
+                    'status': current status,
+                    'priority': priority,
+                    'project': project,
+                    'gpu': gpu, 'devices': devices,
+                    'gpus', 'gpuShare', 'memory', 'cpus': resources asked,
+                    'pid': pid of the job while it runs on this machine,
+                    'health': {'processes', 'cpuSeconds', 'outputBytes',
+                        'idlesec', 'hung'} of a running job as of the last
+                        check, see GPUSchedulerCore.getJobHealth,
+                    'retry': the retry policy or None,
+                    'retryAt': when a job waiting to be retried is queued,
+                    'attempts': list of finished runs, each {'attempt',
+                        'state', 'returnCode', 'gpu', 'devices',
+                        'startedAt', 'endedAt'} (times since the epoch),
+                    'snapshot': key of the code snapshot the job runs from,
+                    'sourceCommand': the command as submitted, if it was
+                        rewritten to run from the snapshot,
                 }
             }
         '''
-        ret = self.__backend.getJobInfo(jobID)
-        if ret is None:
+        job, state = self.__backend.getJobInfo(jobID)
+        if job is None:
             msg = {'status': 'failed', 'value': {},
                    'message': 'Job (jobid :%s) jot found' % jobID,
                   }
             return jsonify(msg)
-        job = ret
         msg = {'status': 'successful',
                'value': {
                    'jobid': job.jobid,
                    'jobName': job.name,
                    'jobCommand': ' '.join(job.commandList),
                    'outFile': job.stdoutF,
-                   'status': job.status,
+                   'status': state,
                    'returnCode' : job.returncode,
+                   'priority': job.priority,
+                   'project': job.project,
+                   'gpu': job.gpu,
+                   'devices': job.devices,
+                   'gpus': job.gpus,
+                   'gpuShare': job.gpuShare,
+                   'memory': job.memory,
+                   'cpus': job.cpus,
+                   'pid': None,
+                   'health': None,
+                   'retry': None if job.retry is None else job.retry.toDict(),
+                   'retryAt': job.retryAt,
+                   'attempts': job.attempts,
+                   'snapshot': job.snapshot,
+                   'sourceCommand': None,
                },
                'message': {},
               }
+        if job.sourceCommand is not None:
+            msg['value']['sourceCommand'] = ' '.join(job.sourceCommand)
+        if state == STATE_RUNNING and job.subprocess is not None:
+            msg['value']['pid'] = job.subprocess.pid
+            msg['value']['health'] = self.__backend.getJobHealth(job.jobid)
         return jsonify(msg)
 
+    def __cancelJob(self, jobID):
+        '''
+        Only accepts POST. Removes a queued job from the queue; it is then
+        listed with the failed jobs, in state 'Cancelled'.
+
+        returns json:
+            {'status': 'successful' or 'failed',
+             'message': what was done, or why not}
+        '''
+        ret, msg = self.__backend.cancelJob(jobID)
+        status = 'successful' if ret else 'failed'
+        return jsonify({'status': status, 'message': msg})
+
+    def __rerunJobs(self):
+        '''
+        Only accepts POST, with json {'jobIDs': list of job ids}. Puts the
+        failed, killed or cancelled jobs among them back in the queue; their
+        earlier runs are kept in 'attempts' (see /jobinfo) and the output of
+        the new run is appended to the same file.
+
+        returns json:
+            {'status': 'successful' or 'failed',
+             'message': error message if failed,
+             'numRequeued': number of jobs queued again,
+             'value': one {'jobID', 'status', 'message'} per job, in order}
+        '''
+        failed = {'status': 'failed'}
+        data = request.get_json(silent=True)
+        if data is None or 'jobIDs' not in data:
+            failed['message'] = 'Key \'jobIDs\' required'
+            return jsonify(failed)
+        jobIDs = data['jobIDs']
+        if not isinstance(jobIDs, list):
+            failed['message'] = 'jobIDs should be a list'
+            return jsonify(failed)
+        results = self.__backend.rerunJobs(jobIDs)
+        value = [{'jobID': jobID, 'message': msg,
+                  'status': 'successful' if ok else 'failed'}
+                 for jobID, (ok, msg) in zip(jobIDs, results)]
+        return jsonify({'status': 'successful', 'value': value,
+                        'numRequeued': sum(ok for ok, _ in results)})
+
+    def __killJob(self, jobID):
+        '''
+        Only accepts POST, optionally with json {'gracesec': seconds}. Sends
+        SIGTERM to the process group of a running job and SIGKILL if it is
+        still running gracesec seconds later (killGracesec by default). The
+        job is listed with the failed jobs, in state 'Killed', and its
+        devices are released as soon as it exits.
+
+        returns json:
+            {'status': 'successful' or 'failed',
+             'message': what was done, or why not}
+        '''
+        data = request.get_json(silent=True) or {}
+        gracesec = data.get('gracesec', None)
+        if gracesec is not None:
+            try:
+                gracesec = float(gracesec)
+            except (TypeError, ValueError):
+                gracesec = -1
+            if gracesec < 0:
+                return jsonify({'status': 'failed', 'message':
+                                'gracesec should be a non-negative number'})
+        ret, msg = self.__backend.killJob(jobID, gracesec=gracesec)
+        status = 'successful' if ret else 'failed'
+        return jsonify({'status': status, 'message': msg})
+
     def __addNewJob(self):
         '''
         This method is connected to a URL that only accepts POST.
@@ -231,6 +817,22 @@ class GPUPeasyServer:
             1. jobName : String
             2. outFile : String
             3. jobCommand : List parsable by python subprocess module
+        and optionally,
+            4. priority : Integer, higher is scheduled first (default 0)
+            5. project : String tag used for fair-share (default 'default')
+            6. gpus : Number of devices needed (default 1)
+            7. gpuShare : Fraction of each device needed (default 1.0)
+            8. memory : Memory estimate per device in MB (default None)
+            9. cpus : CPU cores needed (default 0)
+            10. retry : When to run the job again if it fails, a dict with
+                the keys maxAttempts, backoff, factor, maxBackoff,
+                exitCodes and patterns (default None, never). See
+                gpupeasy.core.retry.RetryPolicy.
+            11. snapshot : true to run the job from a copy of the code
+                under the directory of its script, taken now, or
+                {'root': directory} to copy a larger tree. Needs
+                codeCacheDir (default false). See
+                gpupeasy.core.snapshot.CodeCache.
 
         Note that it is the callers responsibility to make sure that the
         jobCommand list is parsable by subprocess. No checks are performed by
@@ -249,30 +851,15 @@ class GPUPeasyServer:
         if 'job' not in data:
             failed['message'] = 'Key \'job\' not found'
             return jsonify(failed)
-        job = data['job']
-        keys = ['outFile', 'jobName', 'jobCommand']
-        for key in keys:
-            if key not in job:
-                failed['message'] = 'Key \'%s\' not found' % key
-                return jsonify(failed)
-        jobName, outFile = job['jobName'], job['outFile']
-        jobCommand = job['jobCommand']
-        ret, msg = self.__validateJob(jobName, outFile, jobCommand)
-        if ret is False:
-            failed['message'] = msg
-            return jsonify(failed)
-        try:
-            fp = open(outFile, 'a+')
-        except:
-            msg = 'Could not open output file: %s' % outFile
+        job, msg = parseJob(data['job'], self.__codeCache)
+        if job is None:
             failed['message'] = msg
             return jsonify(failed)
-        fp.close()
 
-        job = Job(jobName, jobCommand, stdoutF=outFile)
         ret, jobid = self.__backend.addNewJob(job)
         if ret is False:
-            msg = 'Could not add new job: %s. Check logs for details' % jobName
+            releaseOutFile(job, self.__codeCache)
+            msg = 'Could not add new job: %s. Check logs for details' % job.name
             failed['message'] = msg
             return jsonify(failed)
 
@@ -280,16 +867,137 @@ class GPUPeasyServer:
                    'jobID': jobid}
         return jsonify(success)
 
-    def run(self, host, port):
+    def __addJobs(self):
+        '''
+        Bulk version of /addnewjob. Only accepts POST. The body is either a
+        json with the key 'jobs' indexing a list of job dictionaries (see
+        /addnewjob), or, with content type application/x-ndjson, one job
+        dictionary per line.
+
+        Valid jobs are added to the queue together; invalid ones do not stop
+        the rest of the batch.
+
+        returns json:
+            {
+                'status': 'successful' or 'failed',
+                'message': error message if failed,
+                'numAdded': number of jobs added,
+                'numFailed': number of jobs rejected,
+                'value': A list with one dict per submitted job, in order:
+                    {'status': 'successful' or 'failed',
+                     'jobID': jobid or None,
+                     'message': error message or None}
+            }
+        '''
+        failed = {'status': 'failed'}
+        if request.mimetype == 'application/x-ndjson':
+            try:
+                lines = request.get_data(as_text=True).splitlines()
+                jobList = [json.loads(x) for x in lines if len(x.strip()) > 0]
+            except ValueError as e:
+                failed['message'] = 'Malformed NDJSON: %s' % str(e)
+                return jsonify(failed)
+        else:
+            data = request.get_json(silent=True)
+            if data is None:
+                failed['message'] = 'No JSON data was found'
+                return jsonify(failed)
+            if 'jobs' not in data or not isinstance(data['jobs'], list):
+                failed['message'] = 'Key \'jobs\' not found'
+                return jsonify(failed)
+            jobList = data['jobs']
+
+        ret = addJobBatch(self.__backend, jobList, self.__codeCache)
+        return jsonify(ret)
+
+    def __registerWorker(self):
+        '''
+        Only accepts POST, with json:
+            {'worker': unique name of the worker,
+             'devices': list of its devices, in the gpuList format}
+        returns json:
+            {'status': 'successful' or 'failed',
+             'message': error message if failed,
+             'heartbeatsec': seconds between heartbeats}
+        '''
+        failed = {'status': 'failed'}
+        data = request.get_json(silent=True)
+        if data is None or 'worker' not in data or 'devices' not in data:
+            failed['message'] = 'Keys \'worker\' and \'devices\' required'
+            return jsonify(failed)
+        devices = data['devices']
+        if not isinstance(devices, list) or \
+                not all(isinstance(x, str) for x in devices):
+            failed['message'] = 'Devices should be a list of strings'
+            return jsonify(failed)
+        try:
+            self.__cluster.register(str(data['worker']), devices)
+        except ValueError as e:
+            failed['message'] = str(e)
+            return jsonify(failed)
+        return jsonify({'status': 'successful',
+                        'heartbeatsec': self.__cluster.heartbeatsec})
+
+    def __workerHeartbeat(self):
+        '''
+        Only accepts POST, with json:
+            {'worker': name,
+             'running': jobids running on the worker,
+             'finished': list of {'jobID': jobid, 'returnCode': returnCode}
+                for jobs that exited since the last successful heartbeat}
+        returns json:
+            {'status': 'successful' or 'failed',
+             'message': error message if failed,
+             'reregister': True if the worker is not known (any more),
+             'launch': list of jobs to start, each
+                {'jobID', 'jobName', 'jobCommand' (list), 'outFile', 'gpu'},
+             'kill': jobids to kill}
+        '''
+        failed = {'status': 'failed'}
+        data = request.get_json(silent=True)
+        try:
+            name = str(data['worker'])
+            running = [int(x) for x in data['running']]
+            finished = [(int(x['jobID']), int(x['returnCode']))
+                        for x in data['finished']]
+        except (TypeError, KeyError, ValueError):
+            failed['message'] = 'Malformed heartbeat'
+            return jsonify(failed)
+        launch, kill = self.__cluster.heartbeat(name, running, finished)
+        if launch is None:
+            failed['message'] = 'Unknown worker: %s' % name
+            failed['reregister'] = True
+            return jsonify(failed)
+        launch = [{'jobID': job.jobid, 'jobName': job.name,
+                   'jobCommand': job.commandList, 'outFile': job.stdoutF,
+                   'gpu': gpu} for job, gpu in launch]
+        return jsonify({'status': 'successful', 'launch': launch,
+                        'kill': kill})
+
+    def __getWorkers(self):
+        '''
+        returns json:
+            {'status': 'successful',
+             'value': {name: {'devices': devices,
+                              'lastSeen': seconds since last heartbeat,
+                              'jobs': jobids assigned to it}}}
+        '''
+        return jsonify({'status': 'successful',
+                        'value': self.__cluster.getNodes()})
+
+    def run(self, host, port, server='flask', threads=16):
+        '''
+        Starts the scheduler and serves the API. server and threads are
+        passed to gpupeasy.serving.serveApp; use server='waitress' in
+        production.
+        '''
         if not self.__backend.startDaemon():
             return False
-        # if user_reloader is set to true, then flask will call initializer
-        # twice. This means that two instances of GPUSchedulerCore will be
-        # started. (You only run and interact with one though).
+        if self.__cluster is not None:
+            self.__cluster.start(self.__backend)
         self.__logger.pDebug('Starting GPUPeasy server on %s:%s' %(host, port))
-        self.__frontend.run(debug=False, host=host, port=port,
-                            use_reloader=False)
-
+        serveApp(self.__frontend, host, port, server=server, threads=threads,
+                 logger=self.__logger)
 
 if __name__ == '__main__':
     gpu = GPUPeasyServer(['0', '1'], debug=True)
@@ -0,0 +1,287 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+from collections import Counter
+from gpupeasy.utils import Logger
+
+# Files copied into a snapshot: the code and the configuration it reads.
+SOURCE_SUFFIXES = ('.py', '.sh', '.json', '.yaml', '.yml', '.toml', '.cfg',
+                   '.ini')
+# Suffixes that mark the script of a command.
+SCRIPT_SUFFIXES = ('.py', '.sh')
+
+
+class CodeCache:
+    '''
+    A content-addressed cache of the code jobs run, so that a job runs the
+    code as it was when it was queued and not as it is when it starts.
+
+    snapshot() copies the source files under the directory of the job's
+    script (the snapshot root) into the cache and points the command at the
+    copy. Files are stored once per content, in objects/, and every
+    snapshot is a tree of hard links to them in trees/<key>, key being the
+    hash of the tree. The thousands of jobs of a grid, which share a
+    script, share one snapshot; a snapshot of a tree that changed in one
+    file only costs that file.
+
+    A snapshot is referenced by the jobs that run from it, from snapshot()
+    till release(), and removed with the files no other snapshot links to
+    when the last reference goes.
+
+        cache = CodeCache('/tmp/gpupeasy/code')
+        cache.snapshot(job)  # job.commandList now runs from the cache
+
+    Public functions:
+        snapshot(job, root)
+        acquire(key)
+        release(key)
+        collect()
+        getUsage()
+    '''
+    def __init__(self, cacheDir, suffixes=SOURCE_SUFFIXES,
+                 maxBytes=100 * 1024 * 1024, logger=None):
+        '''
+        cacheDir: The directory to keep the snapshots in. Created if it does
+            not exist. It should be on one filesystem (for the hard links)
+            and, with worker nodes, visible to them at the same path.
+        suffixes: Files with these suffixes are copied.
+        maxBytes: Largest snapshot, in bytes. Guards against a root that is
+            not a source tree, e.g. a home directory.
+        '''
+        self.__logger = logger
+        if logger is None:
+            self.__logger = Logger()
+        self.__cacheDir = os.path.abspath(cacheDir)
+        self.__objectsDir = os.path.join(self.__cacheDir, 'objects')
+        self.__treesDir = os.path.join(self.__cacheDir, 'trees')
+        for d in [self.__objectsDir, self.__treesDir]:
+            if not os.path.exists(d):
+                os.makedirs(d)
+        self.__suffixes = tuple(suffixes)
+        self.__maxBytes = int(maxBytes)
+        # path -> ((size, mtime, inode), digest), so that unchanged files
+        # are not read again.
+        self.__digests = {}
+        self.__refs = Counter()
+        # Serializes snapshots and evictions: an eviction removes the
+        # objects no tree links to, which a snapshot in progress may be
+        # about to link.
+        self.__lock = threading.Lock()
+
+    def __treePath(self, key):
+        return os.path.join(self.__treesDir, key)
+
+    def __listFiles(self, root):
+        # Returns the sorted relative paths of the files to copy.
+        files = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')
+                           and d != '__pycache__']
+            rel = os.path.relpath(dirpath, root)
+            for name in filenames:
+                if name.startswith('.') or not name.endswith(self.__suffixes):
+                    continue
+                files.append(os.path.normpath(os.path.join(rel, name)))
+        return sorted(files)
+
+    def __storeObject(self, path):
+        '''
+        Returns the digest of the file at path and makes sure objects/ has
+        a read-only copy of it. A file is only read if its size, mtime or
+        inode changed since it was last stored.
+        '''
+        st = os.stat(path)
+        sig = (st.st_size, st.st_mtime_ns, st.st_ino)
+        cached = self.__digests.get(path)
+        if cached is not None and cached[0] == sig:
+            if os.path.exists(os.path.join(self.__objectsDir, cached[1])):
+                return cached[1]
+        # Hash what is copied rather than the file, which may be written
+        # to meanwhile.
+        tmp = os.path.join(self.__objectsDir, '.tmp-%d' % os.getpid())
+        h = hashlib.sha256()
+        with open(path, 'rb') as src, open(tmp, 'wb') as dst:
+            for chunk in iter(lambda: src.read(1 << 20), b''):
+                h.update(chunk)
+                dst.write(chunk)
+        digest = h.hexdigest()
+        # Executable scripts stay executable.
+        os.chmod(tmp, 0o555 if st.st_mode & 0o111 else 0o444)
+        obj = os.path.join(self.__objectsDir, digest)
+        if os.path.exists(obj):
+            os.remove(tmp)
+        else:
+            os.rename(tmp, obj)
+        self.__digests[path] = (sig, digest)
+        return digest
+
+    def __buildTree(self, key, manifest):
+        tree = self.__treePath(key)
+        if os.path.isdir(tree):
+            return tree
+        tmp = self.__treePath('.tmp-' + key)
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        for rel, digest in manifest:
+            dst = os.path.join(tmp, rel)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            obj = os.path.join(self.__objectsDir, digest)
+            try:
+                os.link(obj, dst)
+            except OSError:
+                # No hard links on this filesystem.
+                shutil.copy2(obj, dst)
+        with open(tree + '.json', 'w') as fp:
+            json.dump(manifest, fp)
+        os.rename(tmp, tree)
+        return tree
+
+    def snapshot(self, job, root=None):
+        '''
+        Snapshots the code of job and rewrites job.commandList to run it
+        from the snapshot: the script (the first argument naming a .py or
+        .sh file) and every other argument naming a file of the snapshot
+        are replaced by their copies. The command as submitted is kept in
+        job.sourceCommand, and snapshotting a job again (e.g. a rerun) takes
+        the code as it is now. Takes a reference on the snapshot, stored in
+        job.snapshot.
+
+        root: The directory to snapshot, e.g. the root of a repository
+            whose packages the script imports. Defaults to the root of the
+            job's last snapshot, or the directory of the script.
+
+        Raises ValueError if the command has no script, or the script is
+        not under root, and OSError if the files cannot be copied.
+        '''
+        command = job.sourceCommand
+        if command is None:
+            command = list(job.commandList)
+        if root is None:
+            root = job.snapshotRoot
+        script = None
+        for arg in command:
+            if arg.endswith(SCRIPT_SUFFIXES) and os.path.isfile(arg):
+                script = os.path.abspath(arg)
+                break
+        if script is None:
+            raise ValueError('No .py or .sh script found in the command')
+        if root is None:
+            root = os.path.dirname(script)
+        root = os.path.abspath(root)
+        if os.path.commonpath([root, script]) != root:
+            raise ValueError('Script %s is not under %s' % (script, root))
+        with self.__lock:
+            files = self.__listFiles(root)
+            size = sum(os.path.getsize(os.path.join(root, f)) for f in files)
+            if size > self.__maxBytes:
+                raise ValueError('Snapshot of %s too large (%d bytes)' %
+                                 (root, size))
+            manifest = [(f, self.__storeObject(os.path.join(root, f)))
+                        for f in files]
+            key = hashlib.sha256(json.dumps(manifest).encode())
+            key = key.hexdigest()[:24]
+            tree = self.__buildTree(key, manifest)
+            self.__refs[key] += 1
+        included = set(files)
+        commandList = []
+        for arg in command:
+            rel = os.path.relpath(os.path.abspath(arg), root)
+            if os.path.isfile(arg) and rel in included:
+                arg = os.path.join(tree, rel)
+            commandList.append(arg)
+        job.sourceCommand = command
+        job.commandList = commandList
+        job.snapshot = key
+        job.snapshotRoot = root
+        return key
+
+    def acquire(self, key):
+        '''
+        Takes another reference on the snapshot key. Returns False if it is
+        not in the cache.
+        '''
+        with self.__lock:
+            if not os.path.isdir(self.__treePath(key)):
+                return False
+            self.__refs[key] += 1
+            return True
+
+    def release(self, key):
+        '''
+        Drops a reference on the snapshot key, removing it once no job
+        references it.
+        '''
+        with self.__lock:
+            if self.__refs[key] > 1:
+                self.__refs[key] -= 1
+                return
+            del self.__refs[key]
+            self.__evict(key)
+
+    def __evict(self, key):
+        tree = self.__treePath(key)
+        digests = []
+        try:
+            with open(tree + '.json', 'r') as fp:
+                digests = [digest for _, digest in json.load(fp)]
+        except (OSError, ValueError):
+            pass
+        shutil.rmtree(tree, ignore_errors=True)
+        try:
+            os.remove(tree + '.json')
+        except OSError:
+            pass
+        for digest in set(digests):
+            self.__removeObject(digest)
+        self.__logger.pDebug("Evicted code snapshot", key)
+
+    def __removeObject(self, digest):
+        # Objects no tree links to any more. Trees holding copies (no hard
+        # links) do not count, which is harmless: objects are only read to
+        # build trees.
+        obj = os.path.join(self.__objectsDir, digest)
+        try:
+            if os.stat(obj).st_nlink == 1:
+                os.remove(obj)
+        except OSError:
+            pass
+
+    def collect(self):
+        '''
+        Removes the snapshots no job references, e.g. those left by an
+        earlier run of the server, and the objects only they used. Returns
+        the number of snapshots removed.
+        '''
+        removed = 0
+        with self.__lock:
+            for name in os.listdir(self.__treesDir):
+                path = self.__treePath(name)
+                if name.startswith('.tmp-'):
+                    shutil.rmtree(path, ignore_errors=True)
+                    continue
+                if not os.path.isdir(path) or name in self.__refs:
+                    continue
+                self.__evict(name)
+                removed += 1
+            used = set()
+            for key in self.__refs:
+                try:
+                    with open(self.__treePath(key) + '.json', 'r') as fp:
+                        used.update(digest for _, digest in json.load(fp))
+                except (OSError, ValueError):
+                    pass
+            for name in os.listdir(self.__objectsDir):
+                if name not in used:
+                    os.remove(os.path.join(self.__objectsDir, name))
+        return removed
+
+    def getUsage(self):
+        '''
+        Returns {'snapshots': number of snapshots, 'references': number of
+        jobs referencing them}.
+        '''
+        with self.__lock:
+            return {'snapshots': len(self.__refs),
+                    'references': sum(self.__refs.values())}
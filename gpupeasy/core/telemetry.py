@@ -0,0 +1,226 @@
+import json
+import time
+import threading
+from gpupeasy.utils import Logger
+
+try:
+    import pynvml
+except ImportError:
+    pynvml = None
+
+
+class TelemetryProvider:
+    '''
+    Reads the state of the GPUs of this machine. sample() returns
+    {gpu: {'memoryTotal', 'memoryUsed' (MB), 'utilization' (%), 'pids'}}
+    where gpu is the device index as a string, as in CUDA_VISIBLE_DEVICES.
+    It may raise an exception (e.g. OSError) if the state cannot be read.
+    '''
+    def sample(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class NVMLProvider(TelemetryProvider):
+    '''
+    Samples the GPUs through NVML. Requires pynvml
+    (pip install nvidia-ml-py).
+
+    NVML numbers devices in PCI bus order. Run the server with
+    CUDA_DEVICE_ORDER=PCI_BUS_ID so that CUDA numbers them the same way.
+    '''
+    def __init__(self):
+        if pynvml is None:
+            raise ImportError('pynvml is not installed. Install it with '
+                              '`pip install nvidia-ml-py`')
+        pynvml.nvmlInit()
+        self.__count = pynvml.nvmlDeviceGetCount()
+
+    def sample(self):
+        MB = 1024 * 1024
+        ret = {}
+        for i in range(self.__count):
+            handle = pynvml.nvmlDeviceGetHandleByIndex(i)
+            memory = pynvml.nvmlDeviceGetMemoryInfo(handle)
+            util = pynvml.nvmlDeviceGetUtilizationRates(handle)
+            try:
+                procs = pynvml.nvmlDeviceGetComputeRunningProcesses(handle)
+                pids = [proc.pid for proc in procs]
+            except pynvml.NVMLError:
+                pids = []
+            ret[str(i)] = {'memoryTotal': memory.total // MB,
+                           'memoryUsed': memory.used // MB,
+                           'utilization': util.gpu, 'pids': pids}
+        return ret
+
+    def close(self):
+        pynvml.nvmlShutdown()
+
+
+class FileProvider(TelemetryProvider):
+    '''
+    Reads the samples from a JSON file in the format of sample(). Lets the
+    telemetry be tested, or fed by another tool, on machines without GPUs:
+
+        {"0": {"memoryTotal": 16000, "memoryUsed": 15000,
+               "utilization": 100}}
+    '''
+    def __init__(self, path):
+        self.__path = path
+
+    def sample(self):
+        with open(self.__path, 'r') as fp:
+            samples = json.load(fp)
+        ret = {}
+        for gpu, s in samples.items():
+            ret[str(gpu)] = {'memoryTotal': int(s['memoryTotal']),
+                             'memoryUsed': int(s['memoryUsed']),
+                             'utilization': int(s.get('utilization', 0)),
+                             'pids': list(s.get('pids', []))}
+        return ret
+
+
+def makeProvider(telemetry):
+    '''
+    Returns the provider for the telemetry option of GPUPeasyServer: 'nvml'
+    or the path of a FileProvider file.
+    '''
+    if telemetry == 'nvml':
+        return NVMLProvider()
+    return FileProvider(telemetry)
+
+
+class DeviceMonitor:
+    '''
+    Samples a TelemetryProvider every samplesec seconds on a thread of its
+    own and keeps the last sample, so that the scheduler never waits on the
+    provider.
+
+    admit() tells the scheduler whether a device can take another job: a
+    device is skipped if it has less free memory than the job's estimate
+    (or minFreeMemory), which catches memory held by processes GPUPeasy
+    does not know about, or if it is busier than maxUtilization while none
+    of our jobs runs there. If sampling fails for 5 * samplesec seconds,
+    devices are admitted as if there was no telemetry.
+
+    Public functions:
+        start(onChange)
+        stop()
+        admit(device, memory, running)
+        getSamples()
+    '''
+    def __init__(self, provider, samplesec=2, maxUtilization=90,
+                 minFreeMemory=0, logger=None):
+        '''
+        provider: A TelemetryProvider.
+        samplesec: Seconds between samples.
+        maxUtilization: Utilization (%) above which an idle device is
+            considered in use by someone else.
+        minFreeMemory: Free memory (MB) a device needs to take a job without
+            a memory estimate.
+        '''
+        self.__logger = logger
+        if logger is None:
+            self.__logger = Logger()
+        self.__provider = provider
+        self.__samplesec = float(samplesec)
+        self.__maxUtilization = maxUtilization
+        self.__minFreeMemory = int(minFreeMemory)
+        self.__samples = {}
+        self.__sampledAt = None
+        self.__failing = False
+        self.__onChange = None
+        self.__quit = threading.Event()
+        self.__samplerThr = None
+
+    def start(self, onChange=None):
+        '''
+        onChange: Called (from the sampler thread) when a device may admit
+            jobs it did not admit before.
+        '''
+        self.__onChange = onChange
+        self.__quit.clear()
+        self.__sample()
+        self.__samplerThr = threading.Thread(target=self.__samplerThread,
+                                             name='device-monitor',
+                                             daemon=True)
+        self.__samplerThr.start()
+
+    def stop(self):
+        self.__quit.set()
+        if self.__samplerThr is not None:
+            self.__samplerThr.join()
+            self.__samplerThr = None
+        self.__provider.close()
+
+    def __samplerThread(self):
+        while not self.__quit.wait(self.__samplesec):
+            self.__sample()
+
+    def __sample(self):
+        try:
+            samples = self.__provider.sample()
+        except Exception as e:
+            # Providers talk to drivers and files; keep sampling whatever
+            # goes wrong.
+            if not self.__failing:
+                self.__logger.pWarn('Device telemetry failed:', str(e))
+            self.__failing = True
+            return
+        if self.__failing:
+            self.__logger.pInfo('Device telemetry back')
+        self.__failing = False
+        prev = self.__samples
+        # Replaced, never modified, so readers need no lock.
+        self.__samples = samples
+        self.__sampledAt = time.monotonic()
+        if self.__onChange is not None and self.__cleared(prev, samples):
+            self.__onChange()
+
+    def __cleared(self, prev, samples):
+        for gpu, s in samples.items():
+            old = prev.get(gpu)
+            if old is None:
+                return True
+            if s['memoryUsed'] < old['memoryUsed']:
+                return True
+            if s['utilization'] <= self.__maxUtilization < old['utilization']:
+                return True
+        return False
+
+    def __fresh(self):
+        if self.__sampledAt is None:
+            return False
+        return time.monotonic() - self.__sampledAt < 5 * self.__samplesec
+
+    def admit(self, device, memory=None, running=0):
+        '''
+        Returns False if the last sample says device cannot take a job
+        needing memory MB. running is the number of our jobs on it. Devices
+        of worker nodes, and devices without samples, are always admitted.
+        '''
+        if '/' in device or not self.__fresh():
+            return True
+        samples = self.__samples
+        need = max(memory or 0, self.__minFreeMemory)
+        for gpu in device.split(','):
+            s = samples.get(gpu)
+            if s is None:
+                continue
+            if s['memoryTotal'] - s['memoryUsed'] < need:
+                return False
+            if running == 0 and s['utilization'] > self.__maxUtilization:
+                return False
+        return True
+
+    def getSamples(self):
+        '''
+        Returns {'age': seconds since the last sample (None if there is
+        none), 'devices': the last sample, see TelemetryProvider}.
+        '''
+        age = None
+        if self.__sampledAt is not None:
+            age = time.monotonic() - self.__sampledAt
+        return {'age': age, 'devices': self.__samples}
@@ -0,0 +1,161 @@
+import os
+import time
+import signal
+import subprocess
+import requests
+from gpupeasy.utils import Logger
+
+
+class WorkerAgent:
+    '''
+    Runs the jobs a coordinator (a GPUPeasyServer with coordinator=True)
+    assigns to this machine.
+
+    The agent registers its devices with the coordinator and sends a
+    heartbeat every heartbeatsec seconds (as told by the coordinator) with
+    the jobs it is running and those that finished. The reply tells it which
+    jobs to start and which to kill. Job output files are written to the
+    paths given at submission, so the coordinator and the workers should
+    share the file system the jobs write to.
+
+    If the coordinator cannot be reached, jobs keep running and their
+    results are reported once it is back. If the coordinator no longer knows
+    the worker (it was declared dead and its jobs were handed out again),
+    its jobs are killed and the worker registers afresh.
+    '''
+    def __init__(self, coordinator, name, gpuList, logger=None,
+                 retrysec=2, timeout=(3.05, 10)):
+        '''
+        coordinator: host:port of the coordinator.
+        name: A unique name for this worker (no '/').
+        gpuList: The devices of this machine, in the format of
+            GPUPeasyServer's gpuList.
+        retrysec: Seconds to wait before retrying an unreachable
+            coordinator.
+        '''
+        self.__logger = logger
+        if logger is None:
+            self.__logger = Logger()
+        self.__url = 'http://%s/worker' % coordinator
+        self.__name = name
+        self.__gpuList = list(gpuList)
+        self.__retrysec = retrysec
+        self.__timeout = timeout
+        self.__session = requests.Session()
+        self.__heartbeatsec = 2
+        self.__registered = False
+        # jobid -> (Popen, stdout file)
+        self.__running = {}
+        # (jobid, returncode) not yet acknowledged by the coordinator.
+        self.__finished = []
+        self.__quitFlag = False
+
+    def __post(self, endpoint, data):
+        try:
+            resp = self.__session.post(self.__url + endpoint, json=data,
+                                       timeout=self.__timeout)
+            return resp.json()
+        except (requests.RequestException, ValueError) as e:
+            self.__logger.pWarn('Coordinator request failed:', str(e))
+            return None
+
+    def __register(self):
+        ret = self.__post('/register', {'worker': self.__name,
+                                        'devices': self.__gpuList})
+        if ret is None:
+            return False
+        if ret['status'] != 'successful':
+            self.__logger.pError('Registration failed:', ret['message'])
+            return False
+        self.__heartbeatsec = ret['heartbeatsec']
+        self.__registered = True
+        self.__logger.pInfo('Registered with coordinator as', self.__name)
+        return True
+
+    def __launch(self, jobD):
+        jobid = jobD['jobID']
+        env = os.environ.copy()
+        env['CUDA_VISIBLE_DEVICES'] = jobD['gpu']
+        self.__logger.pInfo('Starting job', jobid, 'on gpu', jobD['gpu'])
+        try:
+            stdout = open(jobD['outFile'], 'w+')
+        except OSError as e:
+            self.__logger.pError('Could not open', jobD['outFile'], str(e))
+            self.__finished.append((jobid, -1))
+            return
+        try:
+            proc = subprocess.Popen(jobD['jobCommand'], stdin=None,
+                                    stdout=stdout, stderr=subprocess.STDOUT,
+                                    env=env, start_new_session=True)
+        except (OSError, ValueError) as e:
+            self.__logger.pError('Could not start job', jobid, str(e))
+            stdout.close()
+            self.__finished.append((jobid, -1))
+            return
+        self.__running[jobid] = (proc, stdout)
+
+    def __kill(self, jobid):
+        proc, stdout = self.__running.pop(jobid)
+        self.__logger.pWarn('Killing job', jobid)
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        proc.wait()
+        stdout.close()
+
+    def __collect(self):
+        for jobid in list(self.__running.keys()):
+            proc, stdout = self.__running[jobid]
+            if proc.poll() is None:
+                continue
+            del self.__running[jobid]
+            stdout.close()
+            self.__finished.append((jobid, proc.returncode))
+
+    def __heartbeat(self):
+        finished = list(self.__finished)
+        data = {'worker': self.__name,
+                'running': list(self.__running.keys()),
+                'finished': [{'jobID': j, 'returnCode': rc}
+                             for j, rc in finished]}
+        ret = self.__post('/heartbeat', data)
+        if ret is None:
+            return False
+        if ret.get('reregister', False):
+            # Declared dead: the jobs have been handed to other workers.
+            self.__logger.pWarn('Coordinator does not know this worker.',
+                                'Registering again')
+            for jobid in list(self.__running.keys()):
+                self.__kill(jobid)
+            self.__finished = []
+            self.__registered = False
+            return False
+        if ret['status'] != 'successful':
+            self.__logger.pError('Heartbeat failed:', ret['message'])
+            return False
+        self.__finished = self.__finished[len(finished):]
+        for jobid in ret['kill']:
+            if jobid in self.__running:
+                self.__kill(jobid)
+        for jobD in ret['launch']:
+            self.__launch(jobD)
+        return True
+
+    def run(self):
+        '''
+        Blocks, serving the coordinator, till stop() is called.
+        '''
+        while not self.__quitFlag:
+            if not self.__registered and not self.__register():
+                time.sleep(self.__retrysec)
+                continue
+            self.__collect()
+            if not self.__heartbeat():
+                time.sleep(self.__retrysec)
+                continue
+            time.sleep(self.__heartbeatsec)
+        self.__logger.pInfo('Worker', self.__name, 'exiting')
+
+    def stop(self):
+        self.__quitFlag = True
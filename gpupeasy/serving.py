@@ -0,0 +1,52 @@
+from werkzeug.serving import WSGIRequestHandler
+
+from gpupeasy.utils import Logger
+
+try:
+    import waitress
+except ImportError:
+    waitress = None
+
+# Servers that serveApp() can run a Flask app on.
+SERVERS = ['flask', 'waitress']
+
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    # The default handler speaks HTTP/1.0 and closes every connection. With
+    # HTTP/1.1 the web GUI can keep its connections to the core open.
+    protocol_version = 'HTTP/1.1'
+
+
+def serveApp(app, host, port, server='flask', threads=16, logger=None):
+    '''
+    Serves the Flask app on host:port until interrupted.
+
+    server: 'flask' for the Flask development server (a thread per
+        connection) or 'waitress' for the waitress WSGI server, which must be
+        installed (pip install waitress).
+    threads: Number of worker threads of waitress. Every open event stream
+        (/events, /followlogfile) holds on to a thread for as long as the
+        client is connected, so leave enough for them and for requests.
+
+    Both servers run the app in this process, so the one GPUSchedulerCore
+    that the app wraps is shared by all threads. Do not use servers that
+    fork worker processes: every worker would run its own scheduler.
+    '''
+    if logger is None:
+        logger = Logger()
+    assert server in SERVERS, 'Unknown server: %s' % server
+    if server == 'waitress':
+        if waitress is None:
+            raise ImportError('waitress is not installed. Install it with '
+                              '`pip install waitress` or use the flask server')
+        logger.pInfo('Serving on %s:%s with waitress (%d threads)' %
+                     (host, port, threads))
+        # send_bytes=1 flushes every chunk so that event streams are not
+        # held back in the output buffer.
+        waitress.serve(app, host=host, port=int(port), threads=threads,
+                       send_bytes=1, ident='gpupeasy')
+        return
+    # If use_reloader is set to true, then flask will call initializer twice.
+    # This means that two instances of GPUSchedulerCore will be started.
+    app.run(debug=False, host=host, port=port, use_reloader=False,
+            threaded=True, request_handler=KeepAliveRequestHandler)
@@ -1,6 +1,153 @@
+import os
+import json
+import queue
+import heapq
+import asyncio
+import time
+import itertools
 import threading
+from collections import deque, OrderedDict
 from datetime import datetime, timedelta
 
+def procStartTime(pid):
+    '''
+    Returns the start time of pid (in clock ticks since boot) from /proc, or
+    None if it cannot be read. Used to tell a process apart from a later one
+    that reused its pid.
+    '''
+    try:
+        with open('/proc/%d/stat' % pid, 'r') as fp:
+            stat = fp.read()
+    except (OSError, ValueError):
+        return None
+    # The command name can contain spaces; fields resume after the last ')'.
+    fields = stat[stat.rfind(')') + 2:].split()
+    try:
+        return int(fields[19])
+    except (IndexError, ValueError):
+        return None
+
+
+def pidAlive(pid, startTime=None):
+    '''
+    Returns True if pid exists and, when startTime is given, is the same
+    process that had that start time.
+    '''
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    if startTime is None:
+        return True
+    currStart = procStartTime(pid)
+    return currStart is None or currStart == startTime
+
+
+def signalGroup(pid, sig):
+    '''
+    Sends sig to the process group led by pid, i.e. to the job and every
+    process it started (jobs are launched in a session of their own), or to
+    pid alone if it leads no group. Returns False if there is nothing left
+    to signal.
+    '''
+    try:
+        os.killpg(pid, sig)
+        return True
+    except ProcessLookupError:
+        pass
+    except PermissionError:
+        return False
+    try:
+        os.kill(pid, sig)
+    except (ProcessLookupError, PermissionError):
+        return False
+    return True
+
+
+def tailFile(path, n, blockSize=65536, maxBytes=4 * 1024 * 1024):
+    '''
+    Returns (data, size): the last n lines of the file at path as bytes and
+    the size of the file when it was read, to be used as the offset for
+    readFrom(). Reads blocks backwards from the end of the file, so the cost
+    depends on the size of the tail and not of the file. At most maxBytes
+    are returned. If n <= 0, the file is read from the start instead, and
+    the offset returned is where that read stopped.
+    '''
+    with open(path, 'rb') as fp:
+        fp.seek(0, os.SEEK_END)
+        size = fp.tell()
+        if n <= 0:
+            fp.seek(0)
+            data = fp.read(maxBytes)
+            return data, len(data)
+        pos = size
+        blocks = []
+        newlines = 0
+        # A trailing newline terminates the last line; it does not start one.
+        skipLast = True
+        while pos > 0 and newlines <= n and size - pos < maxBytes:
+            readSize = min(blockSize, pos)
+            pos -= readSize
+            fp.seek(pos)
+            block = fp.read(readSize)
+            blocks.append(block)
+            newlines += block.count(b'\n')
+            if skipLast and block.endswith(b'\n'):
+                newlines -= 1
+            skipLast = False
+        data = b''.join(reversed(blocks))
+    # Drop everything before the n-th newline from the end.
+    cut = len(data)
+    if data.endswith(b'\n'):
+        cut -= 1
+    for _ in range(n):
+        cut = data.rfind(b'\n', 0, cut)
+        if cut < 0:
+            break
+    if cut >= 0:
+        data = data[cut + 1:]
+    return data[-maxBytes:], size
+
+
+def readFrom(path, offset, maxBytes=4 * 1024 * 1024):
+    '''
+    Returns (data, offset): up to maxBytes bytes of the file at path starting
+    at offset, and the offset to read from next. If the file is now smaller
+    than offset (truncated or replaced), reading restarts from 0.
+    '''
+    with open(path, 'rb') as fp:
+        fp.seek(0, os.SEEK_END)
+        size = fp.tell()
+        if offset > size or offset < 0:
+            offset = 0
+        fp.seek(offset)
+        data = fp.read(maxBytes)
+    return data, offset + len(data)
+
+
+def splitUTF8(data):
+    '''
+    Returns the number of bytes at the start of data that form complete
+    UTF-8 characters, so that a chunk cut at an arbitrary byte offset can
+    be decoded without mangling its last character.
+    '''
+    # Look back at most 3 bytes for the lead byte of a multi-byte character.
+    for i in range(1, min(4, len(data) + 1)):
+        byte = data[-i]
+        if byte & 0xC0 == 0x80:
+            # Continuation byte, keep looking
+            continue
+        if byte & 0x80 == 0:
+            return len(data)
+        needed = 2 if byte & 0xE0 == 0xC0 else 3 if byte & 0xF0 == 0xE0 else 4
+        if needed > i:
+            return len(data) - i
+        return len(data)
+    return len(data)
+
+
 class Logger:
 
     def __init__(self, fstdout=None, debug=False):
@@ -46,7 +193,8 @@ class Logger:
 
 class LockedList:
     def __init__(self):
-        self.__container = list()
+        # A deque so that pop() from the front is O(1).
+        self.__container = deque()
         self.__mutex = threading.Lock()
 
     def lock(self):
@@ -64,8 +212,7 @@ class LockedList:
         val = None
         self.__mutex.acquire()
         if len(self.__container) != 0:
-            val = self.__container[0]
-            del self.__container[0]
+            val = self.__container.popleft()
         self.__mutex.release()
         return val
 
@@ -117,3 +264,557 @@ class LockedList:
             return
         del self.__container[key]
         return
+
+
+class LockedQueue:
+    '''
+    A thread-safe FIFO queue with O(1) append, pop and removal by key.
+
+    Elements are indexed by key(elem) (the element itself if key is None),
+    which has to be unique among queued elements. Consumers can block in
+    pop() till an element is available instead of polling.
+
+    Subclasses change the ordering by overriding the _init, _put, _get,
+    _peek, _remove, _take, _values and _first hooks. These are always called
+    with the lock held.
+    '''
+    def __init__(self, key=None):
+        self.__key = key
+        self.__mutex = threading.Lock()
+        self.__notEmpty = threading.Condition(self.__mutex)
+        self._init()
+
+    def _init(self):
+        self._container = OrderedDict()
+
+    def _put(self, k, elem):
+        self._container[k] = elem
+
+    def _get(self):
+        return self._container.popitem(last=False)[1]
+
+    def _peek(self):
+        return next(iter(self._container.values()))
+
+    def _remove(self, k):
+        return self._container.pop(k)
+
+    def _take(self, k):
+        return self._remove(k)
+
+    def _values(self):
+        return list(self._container.values())
+
+    def _first(self, n):
+        return list(itertools.islice(self._container.values(), n))
+
+    def _getKey(self, elem):
+        if self.__key is None:
+            return elem
+        return self.__key(elem)
+
+    def lock(self):
+        self.__mutex.acquire()
+
+    def release(self):
+        self.__mutex.release()
+
+    def append(self, elem):
+        self.extend([elem])
+
+    def push(self, elem):
+        self.append(elem)
+
+    def extend(self, elems):
+        '''
+        Adds all elements under a single lock acquisition. Raises ValueError,
+        without adding anything, if a key is already queued.
+        '''
+        elems = [(self._getKey(elem), elem) for elem in elems]
+        with self.__notEmpty:
+            keys = set()
+            for k, elem in elems:
+                if k in self._container or k in keys:
+                    raise ValueError('Duplicate key in queue: %s' % str(k))
+                keys.add(k)
+            for k, elem in elems:
+                self._put(k, elem)
+            self.__notEmpty.notify(len(elems))
+
+    def pop(self, block=False, timeout=None):
+        '''
+        Removes and returns the first element. Returns None if the queue is
+        empty. If block is True, waits up to timeout seconds (forever if
+        timeout is None) for an element first.
+        '''
+        with self.__notEmpty:
+            if block:
+                self.__notEmpty.wait_for(lambda: len(self._container) > 0,
+                                         timeout)
+            if len(self._container) == 0:
+                return None
+            return self._get()
+
+    def peek(self):
+        with self.__mutex:
+            if len(self._container) == 0:
+                return None
+            return self._peek()
+
+    def remove(self, k):
+        '''
+        Removes and returns the element with key k, None if not queued.
+        '''
+        with self.__mutex:
+            if k not in self._container:
+                return None
+            return self._remove(k)
+
+    def take(self, k):
+        '''
+        Removes and returns the element with key k, None if not queued. Unlike
+        remove(), this counts as the element being served (out of order), for
+        queues where this matters.
+        '''
+        with self.__mutex:
+            if k not in self._container:
+                return None
+            return self._take(k)
+
+    def get(self, k):
+        with self.__mutex:
+            return self._container.get(k)
+
+    def __contains__(self, k):
+        return k in self._container
+
+    def __len__(self):
+        return len(self._container)
+
+    def getCurrVals(self, unsafe=False):
+        '''
+        Returns a copy of the elements in queue order. See
+        LockedList.getCurrVals for the unsafe option.
+        '''
+        if unsafe:
+            return self._values()
+        with self.__mutex:
+            return self._values()
+
+    def getFirstVals(self, n):
+        '''
+        Returns a copy of the first n elements in queue order, without
+        copying the rest of the queue.
+        '''
+        with self.__mutex:
+            return self._first(n)
+
+
+class LockedPriorityQueue(LockedQueue):
+    '''
+    A LockedQueue ordered by priority(elem), smallest first. Elements with
+    equal priority are served in FIFO order. append and pop are O(log n);
+    remove is O(1) and leaves a marker in the heap that is skipped on pop.
+    '''
+    __REMOVED = object()
+
+    def __init__(self, key=None, priority=None):
+        self.__priority = priority
+        super().__init__(key=key)
+
+    def _init(self):
+        # _container maps key -> heap entry [priority, seq, elem]
+        self._container = {}
+        self.__heap = []
+        self.__counter = itertools.count()
+        self.__nRemoved = 0
+
+    def __getPriority(self, elem):
+        if self.__priority is None:
+            return 0
+        return self.__priority(elem)
+
+    def __prune(self):
+        heap = self.__heap
+        while heap and heap[0][-1] is self.__REMOVED:
+            heapq.heappop(heap)
+            self.__nRemoved -= 1
+        # Do not let removed markers dominate the heap.
+        if self.__nRemoved > 1024 and self.__nRemoved > len(heap) // 2:
+            self.__heap = [e for e in heap if e[-1] is not self.__REMOVED]
+            heapq.heapify(self.__heap)
+            self.__nRemoved = 0
+
+    def _put(self, k, elem):
+        entry = [self.__getPriority(elem), next(self.__counter), elem]
+        self._container[k] = entry
+        heapq.heappush(self.__heap, entry)
+
+    def _get(self):
+        self.__prune()
+        entry = heapq.heappop(self.__heap)
+        elem = entry[-1]
+        del self._container[self._getKey(elem)]
+        return elem
+
+    def _peek(self):
+        self.__prune()
+        return self.__heap[0][-1]
+
+    def _remove(self, k):
+        entry = self._container.pop(k)
+        elem = entry[-1]
+        entry[-1] = self.__REMOVED
+        self.__nRemoved += 1
+        # Jobs are mostly taken from the head: do not let their markers pile
+        # up there, where _first walks.
+        self.__prune()
+        return elem
+
+    def _values(self):
+        entries = sorted(self._container.values(), key=lambda e: e[:2])
+        return [e[-1] for e in entries]
+
+    def _first(self, n):
+        # Walks the heap in order from its root, so that this costs
+        # O(n log n) rather than a pass over the whole queue. Removed markers
+        # are walked through but not returned.
+        heap, vals = self.__heap, []
+        frontier = [(heap[0][:2], 0)] if heap else []
+        while frontier and len(vals) < n:
+            _, i = heapq.heappop(frontier)
+            if heap[i][-1] is not self.__REMOVED:
+                vals.append(heap[i][-1])
+            for c in (2 * i + 1, 2 * i + 2):
+                if c < len(heap):
+                    heapq.heappush(frontier, (heap[c][:2], c))
+        return vals
+
+    def get(self, k):
+        entry = super().get(k)
+        if entry is None:
+            return None
+        return entry[-1]
+
+
+class LockedFairShareQueue(LockedQueue):
+    '''
+    A LockedQueue that shares dispatches among tags (projects, users) in
+    proportion to their weights. Within a tag, elements are ordered by
+    priority(elem), smallest first, and FIFO among equal priorities.
+
+    Tags are served by stride scheduling: each tag has a pass value that
+    grows by 1/weight whenever one of its elements is popped, and pop()
+    serves the active tag with the smallest pass. A tag that becomes active
+    starts at the current virtual time so that it cannot claim the share it
+    did not use while idle. Tags without a weight get weight 1.
+    '''
+    def __init__(self, key=None, priority=None, tag=None, weights=None):
+        self.__priority = priority
+        self.__tag = tag
+        self.__weights = dict(weights or {})
+        super().__init__(key=key)
+
+    def _init(self):
+        # _container maps key -> tag of the element
+        self._container = {}
+        self.__queues = {}
+        self.__pass = {}
+        self.__vtime = 0.0
+
+    def __getTag(self, elem):
+        if self.__tag is None:
+            return None
+        return self.__tag(elem)
+
+    def __weight(self, tag):
+        return float(self.__weights.get(tag, 1.0))
+
+    def setWeights(self, weights):
+        self.lock()
+        self.__weights = dict(weights)
+        self.release()
+
+    def getWeights(self):
+        return dict(self.__weights)
+
+    def __nextTag(self, passes=None):
+        passes = self.__pass if passes is None else passes
+        active = [t for t, q in self.__queues.items() if len(q) > 0]
+        return min(active, key=lambda t: (passes[t], str(t)))
+
+    def _put(self, k, elem):
+        tag = self.__getTag(elem)
+        if tag not in self.__queues:
+            self.__queues[tag] = LockedPriorityQueue(
+                key=self._getKey, priority=self.__priority)
+        queue = self.__queues[tag]
+        if len(queue) == 0:
+            self.__pass[tag] = max(self.__pass.get(tag, 0.0), self.__vtime)
+        queue.append(elem)
+        self._container[k] = tag
+
+    def _get(self):
+        tag = self.__nextTag()
+        elem = self.__queues[tag].pop()
+        self.__vtime = self.__pass[tag]
+        self.__pass[tag] += 1.0 / self.__weight(tag)
+        del self._container[self._getKey(elem)]
+        return elem
+
+    def _peek(self):
+        return self.__queues[self.__nextTag()].peek()
+
+    def _remove(self, k):
+        tag = self._container.pop(k)
+        return self.__queues[tag].remove(k)
+
+    def _take(self, k):
+        # Served out of order: charge the tag as pop() would.
+        tag = self._container[k]
+        elem = self._remove(k)
+        self.__pass[tag] += 1.0 / self.__weight(tag)
+        return elem
+
+    def _values(self):
+        return self._first(None)
+
+    def _first(self, n):
+        # Replays the dispatch order on a copy of the pass values.
+        passes = dict(self.__pass)
+        pending = {}
+        for tag, tagQueue in self.__queues.items():
+            if len(tagQueue) > 0:
+                if n is None:
+                    pending[tag] = deque(tagQueue.getCurrVals())
+                else:
+                    pending[tag] = deque(tagQueue.getFirstVals(n))
+        vals = []
+        while len(pending) > 0 and (n is None or len(vals) < n):
+            tag = min(pending, key=lambda t: (passes[t], str(t)))
+            vals.append(pending[tag].popleft())
+            passes[tag] += 1.0 / self.__weight(tag)
+            if len(pending[tag]) == 0:
+                del pending[tag]
+        return vals
+
+    def get(self, k):
+        self.lock()
+        try:
+            if k not in self._container:
+                return None
+            return self.__queues[self._container[k]].get(k)
+        finally:
+            self.release()
+
+
+def formatSSE(data, event=None, eventId=None):
+    '''
+    Formats data (json serializable) as a server-sent event.
+    '''
+    msg = ''
+    if eventId is not None:
+        msg += 'id: %s\n' % str(eventId)
+    if event is not None:
+        msg += 'event: %s\n' % event
+    msg += 'data: %s\n\n' % json.dumps(data)
+    return msg
+
+
+class Subscription:
+    '''
+    The receiving end of an EventBroadcaster. Events are buffered in a
+    bounded queue; if the subscriber falls behind by more than maxsize
+    events, further events are dropped and overflowed is set. The subscriber
+    should then resynchronize (and call clearOverflow()).
+    '''
+    def __init__(self, maxsize):
+        self.__queue = queue.Queue(maxsize)
+        self.overflowed = False
+
+    def put(self, event):
+        try:
+            self.__queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout=None):
+        '''
+        Returns the next event, or None if there was none for timeout
+        seconds.
+        '''
+        try:
+            return self.__queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def clearOverflow(self):
+        while True:
+            try:
+                self.__queue.get_nowait()
+            except queue.Empty:
+                break
+        self.overflowed = False
+
+
+class AsyncSubscription:
+    '''
+    The asyncio counterpart of Subscription, for subscribers running on an
+    event loop. put() must be called from the loop's thread.
+    '''
+    def __init__(self, maxsize):
+        self.__queue = asyncio.Queue(maxsize)
+        self.overflowed = False
+
+    def put(self, event):
+        try:
+            self.__queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self, timeout=None):
+        '''
+        Returns the next event, or None if there was none for timeout
+        seconds.
+        '''
+        try:
+            return await asyncio.wait_for(self.__queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def clearOverflow(self):
+        while True:
+            try:
+                self.__queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+        self.overflowed = False
+
+
+class EventBroadcaster:
+    '''
+    Fans out events to any number of subscribers. publish() never blocks.
+    subscription is the type of subscription handed out, Subscription or
+    AsyncSubscription.
+    '''
+    def __init__(self, maxsize=10000, subscription=Subscription):
+        self.__maxsize = maxsize
+        self.__subscription = subscription
+        self.__subscribers = []
+        self.__mutex = threading.Lock()
+
+    def subscribe(self):
+        sub = self.__subscription(self.__maxsize)
+        with self.__mutex:
+            self.__subscribers.append(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self.__mutex:
+            if sub in self.__subscribers:
+                self.__subscribers.remove(sub)
+
+    def publish(self, event):
+        with self.__mutex:
+            subscribers = list(self.__subscribers)
+        for sub in subscribers:
+            sub.put(event)
+
+    def __len__(self):
+        return len(self.__subscribers)
+
+
+class TTLCache:
+    '''
+    A thread safe memo of values that expire ttl seconds after they are set.
+    '''
+    def __init__(self, ttl, maxsize=1024):
+        self.__ttl = ttl
+        self.__maxsize = maxsize
+        self.__data = OrderedDict()
+        self.__mutex = threading.Lock()
+
+    def get(self, key):
+        '''
+        Returns the cached value or None if it is missing or expired.
+        '''
+        with self.__mutex:
+            if key not in self.__data:
+                return None
+            expires, value = self.__data[key]
+            if expires < time.monotonic():
+                del self.__data[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.__ttl
+        with self.__mutex:
+            self.__data[key] = (time.monotonic() + ttl, value)
+            self.__data.move_to_end(key)
+            while len(self.__data) > self.__maxsize:
+                self.__data.popitem(last=False)
+
+    def invalidate(self, key=None):
+        '''
+        Drops key, or everything if key is None.
+        '''
+        with self.__mutex:
+            if key is None:
+                self.__data.clear()
+            else:
+                self.__data.pop(key, None)
+
+
+class LatencyStats:
+    '''
+    Thread safe per-key latency counters. Keeps the count, total and maximum
+    and the last window samples of each key for percentiles.
+    '''
+    def __init__(self, window=1000):
+        self.__window = window
+        self.__stats = {}
+        self.__mutex = threading.Lock()
+
+    def __entry(self, key):
+        if key not in self.__stats:
+            self.__stats[key] = {'count': 0, 'cached': 0, 'errors': 0,
+                                 'total': 0.0, 'max': 0.0,
+                                 'recent': deque(maxlen=self.__window)}
+        return self.__stats[key]
+
+    def record(self, key, seconds, cached=False):
+        with self.__mutex:
+            st = self.__entry(key)
+            if cached:
+                st['cached'] += 1
+                return
+            st['count'] += 1
+            st['total'] += seconds
+            st['max'] = max(st['max'], seconds)
+            st['recent'].append(seconds)
+
+    def recordError(self, key):
+        with self.__mutex:
+            self.__entry(key)['errors'] += 1
+
+    def summary(self):
+        '''
+        Returns {key: {'count', 'cached', 'errors', 'meanms', 'p50ms',
+        'p95ms', 'maxms'}}. Percentiles are over the recent window.
+        '''
+        ret = {}
+        with self.__mutex:
+            for key, st in self.__stats.items():
+                recent = sorted(st['recent'])
+                n = len(recent)
+                ret[key] = {
+                    'count': st['count'], 'cached': st['cached'],
+                    'errors': st['errors'],
+                    'meanms': 1000 * st['total'] / max(st['count'], 1),
+                    'p50ms': 1000 * recent[n // 2] if n else 0.0,
+                    'p95ms': 1000 * recent[int(n * 0.95)] if n else 0.0,
+                    'maxms': 1000 * st['max'],
+                }
+        return ret
@@ -2,26 +2,83 @@ import os
 import json
 import shlex
 import re
-from flask import Flask, flash, redirect, jsonify, url_for
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from flask import Flask, flash, redirect, jsonify, url_for, Response
 from flask import render_template, request, session, abort
 import requests
-import subprocess
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from gpupeasy.core.server import GPUPeasyServer
+from gpupeasy.serving import serveApp
+from gpupeasy.utils import EventBroadcaster, formatSSE
+from gpupeasy.utils import tailFile, readFrom, splitUTF8
+from gpupeasy.utils import TTLCache, LatencyStats
 
 
 class GPUPeasyWebGUI:
-    def __init__(self, coreHost, corePort, debug=False):
+    def __init__(self, coreHost, corePort, debug=False, timeout=(3.05, 30),
+                 retries=2, poolSize=16):
+        '''
+        timeout: (connect, read) timeout in seconds for requests to the core.
+        retries: Number of times a request that failed to connect (or a GET
+            that failed in any way) is retried.
+        poolSize: Number of keep-alive connections kept open to the core.
+        '''
         self.__frontend = Flask(__name__)
         self.__cHost = coreHost
         self.__cPort = corePort
         self.__debug = debug
 
+        # All requests to the core go through one session so that
+        # connections are reused. Only connection errors are retried for
+        # POSTs, as the core might have acted on a POST that timed out.
+        self.__timeout = timeout
+        self.__session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=0.1,
+                      allowed_methods=frozenset(['GET']),
+                      status_forcelist=[502, 503, 504],
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=poolSize,
+                              max_retries=retry)
+        self.__session.mount('http://', adapter)
+        # Independent core requests are made concurrently on this pool.
+        self.__corePool = ThreadPoolExecutor(max_workers=4,
+                                             thread_name_prefix='core-request')
+        # Short lived memo of core GET responses, see __makeCoreRequest.
+        self.__coreCache = TTLCache(ttl=1)
+        self.__coreStats = LatencyStats()
+
         # Used to sync with backend for lazy updates.
         # That is, data is sent to the web-gui iff the internal statelist
-        # and backends list differs, indicating and update.
-        self.__successList = []
-        self.__failedList = []
-        self.__scheduledList = []
+        # and backends list differs, indicating and update. Each list keeps
+        # the listing version and ETag last seen and the jobs by jobID; see
+        # __syncJobList. A list's lock is held while it is synced, and
+        # syncLock while any list is read or modified.
+        self.__successList = self.__newJobList()
+        self.__failedList = self.__newJobList()
+        self.__scheduledList = self.__newJobList()
+        self.__runningList = self.__newJobList()
+        self.__syncLock = threading.Lock()
+        self.__syncPageSize = 1000
+
+        # Live view of the core. A listener thread follows the core's /events
+        # stream and applies job transitions to the lists above. While it is
+        # connected, pages are rendered from the lists without querying the
+        # core. jobVersions holds the state version each job was last seen
+        # at, so that stale updates are ignored.
+        self.__liveConnected = threading.Event()
+        self.__jobVersions = {}
+        self.__allDevices = None
+        self.__eventThr = None
+        self.__reconnectsec = 2
+        # Browsers are told about changes through our own /events.
+        self.__browserEvents = EventBroadcaster(maxsize=100)
+        # jobID -> output file. Logs are only served for known jobs.
+        self.__outFiles = {}
+        self.__followsec = 0.5
 
         fe = self.__frontend
         fe.add_url_rule('/message', 'messageTest',
@@ -43,27 +100,62 @@ class GPUPeasyWebGUI:
                         self.__getScheduledJobs)
         fe.add_url_rule('/loadlogfile', 'loadLogFile',
                         self.__loadLogFile, methods=['POST'])
+        fe.add_url_rule('/followlogfile/<jobID>', 'followLogFile',
+                        self.__followLogFile)
+        fe.add_url_rule('/events', 'getEvents', self.__getEvents)
+        fe.add_url_rule('/corestats', 'getCoreStats', self.__getCoreStats)
 
-    def __makeCoreRequest(self, url, method, data=None):
+    def __newJobList(self):
+        return {'version': 0, 'etag': None, 'jobs': {},
+                'lock': threading.Lock()}
+
+    def __makeCoreRequest(self, url, method, data=None, headers=None,
+                          cacheTTL=None):
         '''
+        cacheTTL: If set, a successful GET response is memoized for cacheTTL
+            seconds and returned for the same url until then.
+
         Returns: Response, message
             Response is None in the event of an error and an error message will
             be provided as message.
         '''
         assert method in ['GET', 'POST'], 'Invalid method: %s' % method
+        # Per endpoint latency, with job ids folded away.
+        endpoint = re.sub(r'/\d+', '/<id>', urlparse(url).path)
+        if cacheTTL is not None and method == 'GET':
+            resp = self.__coreCache.get(url)
+            if resp is not None:
+                self.__coreStats.record(endpoint, 0.0, cached=True)
+                return resp, None
+        start = time.perf_counter()
         try:
             if method == 'GET':
-                resp = requests.get(url)
+                resp = self.__session.get(url, headers=headers,
+                                          timeout=self.__timeout)
             elif method == 'POST':
-                resp = requests.post(url, json=data)
+                resp = self.__session.post(url, json=data, headers=headers,
+                                           timeout=self.__timeout)
         except requests.ConnectionError:
+            self.__coreStats.recordError(endpoint)
             return None, 'Connection error on url: %s' % url
         except requests.Timeout:
+            self.__coreStats.recordError(endpoint)
             return None, 'Connection timeout on url: %s' % url
         except requests.TooManyRedirects:
+            self.__coreStats.recordError(endpoint)
             return None, 'Too many redirects on url: %s' % url
+        self.__coreStats.record(endpoint, time.perf_counter() - start)
+        if cacheTTL is not None and resp.status_code == 200:
+            self.__coreCache.set(url, resp, ttl=cacheTTL)
         return resp, None
 
+    def __getCoreStats(self):
+        '''
+        Returns json with the latency of requests to the core per endpoint.
+        '''
+        return jsonify({'status': 'successful',
+                        'value': self.__coreStats.summary()})
+
     def __validateJob(self, jobName, jobOutFile, jobCommand):
         '''
         returns false if error occurred along with error message.
@@ -96,6 +188,24 @@ class GPUPeasyWebGUI:
         url = 'http://%s:%s/addnewjob' % (self.__cHost, self.__cPort)
         return self.__makeCoreRequest(url, method='POST', data=js)
 
+    def __addJobs(self, jobs, snapshot=False):
+        '''
+        jobs: A list of (jobName, jobOutFile, jobCommand) tuples. All jobs
+            are submitted in a single request to the core's /addjobs.
+        snapshot: Run the jobs from a snapshot of their code, see the core's
+            /addnewjob.
+        '''
+        js = {'jobs': []}
+        for jobName, jobOutfile, jobCommand in jobs:
+            js['jobs'].append({
+                'jobName': jobName,
+                'outFile': jobOutfile,
+                'jobCommand': jobCommand,
+                'snapshot': snapshot
+            })
+        url = 'http://%s:%s/addjobs' % (self.__cHost, self.__cPort)
+        return self.__makeCoreRequest(url, method='POST', data=js)
+
     def __cleanJobListString(self, string):
         jobList = string.strip()
         jobList = jobList.replace('\n', ' ').replace('\r', ' ')
@@ -215,69 +325,107 @@ class GPUPeasyWebGUI:
             msg = {'errorMessage': retmsg}
             return redirect(url_for('index', messages=json.dumps(msg)))
         sucMsg = 'Jobs successfully passed onto scheduler.\n'
+        jobs = []
         for job in jobList:
             jobS = job.split(';;')
             jobS = [x.strip() for x in jobS]
             jobS = [x for x in jobS if len(x) > 0]
             jobName, jobOutF, jobCommand = jobS[0], jobS[1], jobS[2]
             jobCommand = self.__parseCommand(jobCommand)
-            resp, msg = self.__addJob(jobName, jobOutF, jobCommand)
-            if resp is None:
-                message = 'Could not add job: %s. Scheduler' % jobName
-                message += ' Scheduler returned error '
-                message += 'message: %s' % (msg)
-                sucMsg += message + '\n\n'
-            status, msg = resp.json()['status'], resp.json()['message']
-            if status != 'successful':
+            jobs.append((jobName, jobOutF, jobCommand))
+        snapshot = request.form.get('snapshot') == 'on'
+        resp, msg = self.__addJobs(jobs, snapshot=snapshot)
+        if resp is None:
+            message = 'Could not add jobs. Scheduler returned error '
+            message += 'message: %s' % (msg)
+            msg = {'errorMessage': message}
+            return redirect(url_for('index', messages=json.dumps(msg)))
+        resp = resp.json()
+        if resp['status'] != 'successful':
+            message = 'Could not add jobs. Scheduler returned error '
+            message += 'message: %s' % str(resp['message'])
+            msg = {'errorMessage': message}
+            return redirect(url_for('index', messages=json.dumps(msg)))
+        for (jobName, _, _), ret in zip(jobs, resp['value']):
+            if ret['status'] != 'successful':
                 message = 'Could not add job [%s]: ' % jobName
                 message += ' Scheduler returned error'
-                message += ' message: %s' % str(msg)
+                message += ' message: %s' % str(ret['message'])
                 sucMsg += message + '\n\n'
 
         message = {'infoMessage': sucMsg}
         return redirect(url_for('index', messages=json.dumps(message)))
 
-    def __getDeviceUtilization(self):
+    def __fetchAllDevices(self):
         '''
-        Returns template
+        Returns the list of devices and None, or None and an error message.
         '''
-        url = 'http://%s:%s/deviceutilization' % (self.__cHost, self.__cPort)
-        utilization, msg = self.__makeCoreRequest(url, method='GET')
-        if utilization is None:
-            return render_template('deviceutilization.html', errorMessage=msg)
-
         url = 'http://%s:%s/availabledevices' % (self.__cHost, self.__cPort)
-        allDiv, msg = self.__makeCoreRequest(url, method='GET')
+        allDiv, msg = self.__makeCoreRequest(url, method='GET', cacheTTL=5)
         if allDiv is None:
-            return render_template('deviceutilization.html', errorMessage=msg)
-
-        utilization = utilization.json()
+            return None, msg
         allDiv = allDiv.json()
-        if utilization['status'] != 'successful':
-            msg = 'Could not fetch utilization info from core server'
-            return render_template('deviceutilization.html', errorMessage=msg)
         if allDiv['status'] != 'successful':
             msg = 'Could not fetch all devices info from core server'
-            return render_template('deviceutilization.html', errorMessage=msg)
+            return None, msg
+        return allDiv['value'], None
+
+    def __fetchDeviceState(self):
+        '''
+        Returns the device usage and the telemetry samples of the core, see
+        its /deviceutilization. Both are empty if they cannot be fetched;
+        the device page is shown without them.
+        '''
+        url = 'http://%s:%s/deviceutilization' % (self.__cHost, self.__cPort)
+        resp, msg = self.__makeCoreRequest(url, method='GET', cacheTTL=2)
+        if resp is None:
+            return {}, {}
+        resp = resp.json()
+        if resp['status'] != 'successful':
+            return {}, {}
+        telemetry = resp.get('telemetry') or {}
+        return resp.get('devices', {}), telemetry.get('devices', {})
+
+    def __getDeviceUtilization(self):
+        '''
+        Returns template
+        '''
+        state = self.__corePool.submit(self.__fetchDeviceState)
+        if self.__liveConnected.is_set():
+            allDevices = self.__allDevices
+        else:
+            running = self.__corePool.submit(self.__syncJobList,
+                                             'runningjobs', self.__runningList)
+            allDevices, msg = self.__fetchAllDevices()
+            msg = running.result() or msg
+            if msg is not None:
+                return render_template('deviceutilization.html',
+                                       errorMessage=msg)
+        with self.__syncLock:
+            running = list(self.__runningList['jobs'].values())
 
         ret = {}
-        for gpu in allDiv['value']:
-            ret[gpu] = {'name': gpu, 'idle': True, 'job': {}}
-
-        for job in utilization['value']:
-            gpu = job['gpu']
-            # GPU should be key
-            assert gpu in ret, 'Internal error. Invalid invariant'
-            # not two jobs should be scheduled on a GPU
-            assert ret[gpu]['idle'] == True, 'Internal error. Invalid invariant'
-            ret[gpu]['job'] = job
-            ret[gpu]['idle'] = False
+        for gpu in allDevices:
+            ret[gpu] = {'name': gpu, 'idle': True, 'jobs': []}
+
+        # Jobs can share a device and span several.
+        for job in running:
+            for gpu in job.get('devices') or [job['gpu']]:
+                if gpu not in ret:
+                    # Removed while the job runs.
+                    ret[gpu] = {'name': gpu, 'idle': True, 'jobs': []}
+                ret[gpu]['jobs'].append(job)
+                ret[gpu]['idle'] = False
+        usage, samples = state.result()
+        for gpu, info in ret.items():
+            info['usage'] = usage.get(gpu)
+            info['sample'] = samples.get(gpu)
         return render_template('deviceutilization.html', devices=ret)
 
     def __getJobInfo(self, jobID):
         url = 'http://%s:%s/jobinfo/%d' % (self.__cHost, self.__cPort,
                                            int(jobID))
-        jobInfo, msg = self.__makeCoreRequest(url, method='GET')
+        jobInfo, msg = self.__makeCoreRequest(url, method='GET', cacheTTL=1)
         if jobInfo is None:
             msg = 'None %s' %  msg
             return render_template('jobinfo.html', errorMessage=msg)
@@ -288,96 +436,337 @@ class GPUPeasyWebGUI:
         jobInfo = js['value']
         return render_template('jobinfo.html', **jobInfo)
 
+    def __getJobOutFile(self, jobID):
+        '''
+        Returns the output file of jobID and None, or None and an error
+        message if the core does not know the job.
+        '''
+        try:
+            jobID = int(jobID)
+        except ValueError:
+            return None, 'Invalid job id: %s' % str(jobID)
+        if jobID in self.__outFiles:
+            return self.__outFiles[jobID], None
+        url = 'http://%s:%s/jobinfo/%d' % (self.__cHost, self.__cPort, jobID)
+        jobInfo, msg = self.__makeCoreRequest(url, method='GET')
+        if jobInfo is None:
+            return None, msg
+        js = jobInfo.json()
+        if js['status'] != 'successful':
+            return None, 'Job (%d) not found in backend' % jobID
+        outFile = js['value']['outFile']
+        self.__outFiles[jobID] = outFile
+        return outFile, None
+
     def __loadLogFile(self):
         '''
         Only accepts POST
-        filename, last N. N can be negative to read from start.
+        jobID, last N. N can be negative to read from start.
+        If offset is given instead of lastN, only the bytes written after
+        offset are returned.
+
+        returns json:
+            {'status': 'successful' or 'failed',
+             'value': log text or error message,
+             'offset': the offset to pass to read what comes next}
         '''
-        filename = request.form['fileName']
-        N = request.form['lastN']
-        N = int(N)
-        ret = {'status': 'failed', 'value': ''}
+        ret = {'status': 'failed', 'value': '', 'offset': 0}
+        filename, msg = self.__getJobOutFile(request.form['jobID'])
+        if filename is None:
+            ret['value'] = msg
+            return jsonify(ret)
         if not os.path.exists(filename):
             msg = 'File not found: %s' % filename
             ret['value'] = msg
-            return jsonify(msg)
-        f = subprocess.Popen(['tail','-n', '%d' % N, filename],
-                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        f.wait()
-        if f.returncode != 0:
+            return jsonify(ret)
+        try:
+            if 'offset' in request.form:
+                offset = int(request.form['offset'])
+                data, offset = readFrom(filename, offset)
+            else:
+                N = int(request.form['lastN'])
+                data, offset = tailFile(filename, N)
+            # Leave a character cut in half (by the writer, or by maxBytes)
+            # for next time.
+            complete = splitUTF8(data)
+            offset -= len(data) - complete
+            data = data[:complete]
+        except ValueError:
+            ret['value'] = 'lastN and offset should be integers'
+            return jsonify(ret)
+        except OSError as e:
             msg = 'Could not read file: %s\n' % (filename)
-            msg += 'tail returned error code %d' % (f.returncode)
+            msg += str(e)
             ret['value'] = msg
             return jsonify(ret)
-        lines = f.stdout.readlines()
-        lines = [x.decode('utf-8') for x in lines]
-        lines = ''.join(lines)
         ret['status'] = 'successful'
-        ret['value'] = lines
+        ret['value'] = data.decode('utf-8', errors='replace')
+        ret['offset'] = offset
         return jsonify(ret)
 
-    def __getSuccessfulJobs(self):
+    def __followLogFile(self, jobID):
         '''
-        TODO:
-        Maintain an internal list. Fetch from backend. Only send data if the
-        internal state differs from backend
-        '''
-        url = 'http://%s:%s/successfuljobs' % (self.__cHost, self.__cPort)
-        successfulJobs, msg = self.__makeCoreRequest(url, method='GET')
-        if successfulJobs is None:
-            return render_template('queue.html', errorMessage=msg)
-        ret = successfulJobs.json()
-        if ret['status'] != 'successful':
-            msg = 'Error: GPUPeasy scheduler server returned an error'
-            return render_template('queue.html', errorMessage=msg)
-        ret = ret['value']
-        if len(ret) == 0:
-            emptyMessage="No successful jobs"
+        A server-sent event stream that follows the output file of jobID,
+        like tail -f, starting at ?offset= (default: end of file) or at
+        Last-Event-ID on reconnects. Sends
+            data: {'value': new text, 'offset': offset after it}
+        whenever the file grows.
+        '''
+        filename, msg = self.__getJobOutFile(jobID)
+        if filename is None or not os.path.exists(filename):
+            msg = msg or 'File not found: %s' % filename
+            return jsonify({'status': 'failed', 'value': msg})
+        # A reconnecting EventSource resumes from the last offset it saw.
+        offset = request.headers.get('Last-Event-ID')
+        if offset is None:
+            offset = request.args.get('offset', os.path.getsize(filename))
+        try:
+            offset = int(offset)
+        except ValueError:
+            msg = 'offset should be an integer'
+            return jsonify({'status': 'failed', 'value': msg})
+        followsec = self.__followsec
+
+        def stream(offset):
+            idle = 0
+            while True:
+                try:
+                    data, newOffset = readFrom(filename, offset)
+                except OSError:
+                    break
+                # Hold back a character cut in half by the writer.
+                complete = splitUTF8(data)
+                newOffset -= len(data) - complete
+                data = data[:complete]
+                if len(data) > 0:
+                    idle = 0
+                    msg = {'value': data.decode('utf-8', errors='replace'),
+                           'offset': newOffset}
+                    yield formatSSE(msg, eventId=newOffset)
+                else:
+                    idle += followsec
+                    if idle >= 15:
+                        idle = 0
+                        yield ': keep-alive\n\n'
+                    time.sleep(followsec)
+                offset = newOffset
+
+        headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        return Response(stream(offset), mimetype='text/event-stream',
+                        headers=headers)
+
+    def __syncJobList(self, endpoint, cache):
+        '''
+        Brings cache up to date with the core listing at endpoint. Only the
+        changes since the cached version are fetched (in pages), and nothing
+        at all if the core answers 304 to the cached ETag.
+
+        Returns None on success and an error message otherwise.
+        '''
+        with cache['lock']:
+            while True:
+                url = 'http://%s:%s/%s?since=%d&limit=%d'
+                url = url % (self.__cHost, self.__cPort, endpoint,
+                             cache['version'], self.__syncPageSize)
+                headers = {}
+                if cache['etag'] is not None:
+                    headers['If-None-Match'] = cache['etag']
+                resp, msg = self.__makeCoreRequest(url, method='GET',
+                                                   headers=headers)
+                if resp is None:
+                    return msg
+                if resp.status_code == 304:
+                    return None
+                ret = resp.json()
+                if ret['status'] != 'successful':
+                    return 'Error: GPUPeasy scheduler server returned an error'
+                with self.__syncLock:
+                    self.__applyJobChanges(cache, ret)
+                if not ret['more']:
+                    cache['etag'] = resp.headers.get('ETag', None)
+                    return None
+
+    def __applyJobChanges(self, cache, ret):
+        versions = self.__jobVersions
+        if ret['full']:
+            cache['jobs'] = {}
+        for jobID in ret['removed']:
+            # Unless an event already told us about a later change
+            if versions.get(jobID, 0) <= ret['version']:
+                cache['jobs'].pop(jobID, None)
+        for job in ret['value']:
+            jobID = job['jobID']
+            if versions.get(jobID, 0) > job['version']:
+                continue
+            versions[jobID] = job['version']
+            cache['jobs'][jobID] = job
+        cache['version'] = ret['version']
+
+    def __renderJobList(self, endpoint, cache, emptyMessage):
+        if not self.__liveConnected.is_set():
+            msg = self.__syncJobList(endpoint, cache)
+            if msg is not None:
+                return render_template('queue.html', errorMessage=msg)
+        with self.__syncLock:
+            jobs = [cache['jobs'][k] for k in sorted(cache['jobs'])]
+        if len(jobs) == 0:
             return render_template('queue.html', emptyMessage=emptyMessage)
-        return render_template('queue.html', jobs=ret)
+        return render_template('queue.html', jobs=jobs)
+
+    def __getSuccessfulJobs(self):
+        '''
+        Renders the successful jobs from the internal list, which is synced
+        with the backend through delta requests.
+        '''
+        return self.__renderJobList('successfuljobs', self.__successList,
+                                    "No successful jobs")
 
     def __getFailedJobs(self):
         '''
-        TODO:
-        Maintain an internal list. Fetch from backend. Only send data if the
-        internal state differs from backend
-        '''
-        url = 'http://%s:%s/failedjobs' % (self.__cHost, self.__cPort)
-        failedJobs, msg = self.__makeCoreRequest(url, method='GET')
-        if failedJobs is None:
-            return render_template('queue.html', errorMessage=msg)
-        ret = failedJobs.json()
-        if ret['status'] != 'successful':
-            msg = 'Error: GPUPeasy scheduler server returned an error'
-            return render_template('queue.html', errorMessage=msg)
-        ret = ret['value']
-        if len(ret) == 0:
-            emptyMessage="No jobs have failed"
-            return render_template('queue.html', emptyMessage=emptyMessage)
-        return render_template('queue.html', jobs=ret)
+        Renders the failed jobs from the internal list, which is synced with
+        the backend through delta requests.
+        '''
+        return self.__renderJobList('failedjobs', self.__failedList,
+                                    "No jobs have failed")
 
     def __getScheduledJobs(self):
         '''
-        TODO:
-        Maintain an internal list. Fetch from backend. Only send data if the
-        internal state differs from backend
-        '''
-        url = 'http://%s:%s/scheduledjobs' % (self.__cHost, self.__cPort)
-        scheduledjobs, msg = self.__makeCoreRequest(url, method='GET')
-        if scheduledjobs is None:
-            return render_template('queue.html', errorMessage=msg)
-        ret = scheduledjobs.json()
-        if ret['status'] != 'successful':
-            msg = 'Error: GPUPeasy scheduler server returned an error'
-            return render_template('queue.html', errorMessage=msg)
-        ret = ret['value']
-        if len(ret) == 0:
-            emptyMessage="No jobs scheduled"
-            return render_template('queue.html', emptyMessage=emptyMessage)
-        return render_template('queue.html', jobs=ret)
-
-    def run(self, host, port):
-        self.__frontend.run(debug=False, host=host, port=port)
+        Renders the scheduled jobs from the internal list, which is synced
+        with the backend through delta requests. Jobs are listed by jobID.
+        '''
+        return self.__renderJobList('scheduledjobs', self.__scheduledList,
+                                    "No jobs scheduled")
+
+    def __listOfState(self, state):
+        lists = {
+            'Scheduled': self.__scheduledList,
+            'Running': self.__runningList,
+            'Succeeded': self.__successList,
+        }
+        return lists.get(state, self.__failedList)
+
+    def __applyJobEvent(self, event):
+        jobID = event['jobID']
+        with self.__syncLock:
+            if self.__jobVersions.get(jobID, 0) >= event['version']:
+                return
+            self.__jobVersions[jobID] = event['version']
+            job = {k: event[k] for k in ['jobID', 'jobName', 'jobCommand',
+                                         'priority', 'project',
+                                         'returnCode', 'gpu', 'devices']}
+            job['version'] = event['version']
+            for cache in [self.__scheduledList, self.__runningList,
+                          self.__successList, self.__failedList]:
+                cache['jobs'].pop(jobID, None)
+            self.__listOfState(event['state'])['jobs'][jobID] = job
+
+    def __resync(self):
+        '''
+        Syncs all lists and the device list with the core. Returns None on
+        success, else an error message.
+        '''
+        futures = []
+        for endpoint, cache in [('scheduledjobs', self.__scheduledList),
+                                ('runningjobs', self.__runningList),
+                                ('successfuljobs', self.__successList),
+                                ('failedjobs', self.__failedList)]:
+            futures.append(self.__corePool.submit(self.__syncJobList,
+                                                  endpoint, cache))
+        self.__coreCache.invalidate()
+        allDevices, msg = self.__fetchAllDevices()
+        for future in futures:
+            msg = future.result() or msg
+        if msg is not None:
+            return msg
+        self.__allDevices = allDevices
+        return None
+
+    def __iterSSE(self, resp):
+        '''
+        Yields (event, data) for each server-sent event in the response.
+        '''
+        event, data = None, []
+        for line in resp.iter_lines(decode_unicode=True):
+            if line is None:
+                continue
+            if len(line) == 0:
+                if len(data) > 0:
+                    yield event, json.loads('\n'.join(data))
+                event, data = None, []
+                continue
+            if line.startswith(':'):
+                continue
+            field, _, value = line.partition(':')
+            value = value[1:] if value.startswith(' ') else value
+            if field == 'event':
+                event = value
+            elif field == 'data':
+                data.append(value)
+
+    def __eventListenerThread(self):
+        url = 'http://%s:%s/events' % (self.__cHost, self.__cPort)
+        while True:
+            try:
+                # The core sends a keep-alive every 15 seconds.
+                with self.__session.get(url, stream=True,
+                                        timeout=(5, 60)) as resp:
+                    for event, data in self.__iterSSE(resp):
+                        if event in ['hello', 'resync']:
+                            self.__liveConnected.clear()
+                            if self.__resync() is None:
+                                self.__liveConnected.set()
+                        elif event == 'job':
+                            self.__applyJobEvent(data)
+                        elif event == 'devicelist':
+                            self.__allDevices = data['devices']
+                        self.__browserEvents.publish({'type': event})
+            except (requests.RequestException, ValueError):
+                pass
+            self.__liveConnected.clear()
+            time.sleep(self.__reconnectsec)
+
+    def __getEvents(self):
+        '''
+        A server-sent event stream for the browser. Sends an event (job,
+        device, devicelist, hello or resync) whenever the live view changes
+        so that the page can reload the affected panels.
+        '''
+        sub = self.__browserEvents.subscribe()
+
+        def stream():
+            try:
+                yield formatSSE({}, event='hello')
+                while True:
+                    event = sub.get(timeout=15)
+                    if sub.overflowed:
+                        sub.clearOverflow()
+                        yield formatSSE({}, event='resync')
+                        continue
+                    if event is None:
+                        yield ': keep-alive\n\n'
+                        continue
+                    yield formatSSE({}, event=event['type'])
+            finally:
+                self.__browserEvents.unsubscribe(sub)
+
+        headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        return Response(stream(), mimetype='text/event-stream',
+                        headers=headers)
+
+    def __startEventListener(self):
+        if self.__eventThr is not None:
+            return
+        self.__eventThr = threading.Thread(target=self.__eventListenerThread,
+                                           name='core-event-listener',
+                                           daemon=True)
+        self.__eventThr.start()
+
+    def run(self, host, port, server='flask', threads=16):
+        '''
+        server and threads are passed to gpupeasy.serving.serveApp.
+        '''
+        self.__startEventListener()
+        serveApp(self.__frontend, host, port, server=server, threads=threads)
 
 
 
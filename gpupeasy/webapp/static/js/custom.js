@@ -10,27 +10,100 @@ function initialization(){
   ajaxGetJobStatus();
 }
 
+// Reload the panels at most once every 250ms while events keep coming.
+var refreshPending = false;
+function scheduleRefresh(){
+  if (refreshPending) {
+    return;
+  }
+  refreshPending = true;
+  setTimeout(function() {
+    refreshPending = false;
+    ajaxGetJobStatus();
+  }, 250);
+}
+
+// Listen to job/device changes pushed by the GUI server. Returns false if the
+// browser does not support server-sent events.
+function subscribeJobEvents(){
+  if (!window.EventSource) {
+    return false;
+  }
+  var source = new EventSource('events');
+  ['job', 'device', 'devicelist', 'resync'].forEach(function(name) {
+    source.addEventListener(name, scheduleRefresh);
+  });
+  return true;
+}
+
 $(document).ready(function() {
   // show animation for 1/2 a second
   setTimeout(initialization, 500);
-  // Update every 10 seconds
-  setInterval(ajaxGetJobStatus, 10000);
+  if (subscribeJobEvents()) {
+    // Pushed events do the work; poll rarely in case the stream drops.
+    setInterval(ajaxGetJobStatus, 60000);
+  } else {
+    // Update every 10 seconds
+    setInterval(ajaxGetJobStatus, 10000);
+  }
 });
 
+// textAreaId -> {'offset': .., 'source': EventSource or null}
+var logFollowers = {};
+
 function loadLogLines(formId, textAreaId) {
   // Assume that element has a form
-  var gt = document.getElementById(formId);
-  var fileName = gt.elements['fileName']['value'];
-  var N = gt.elements['lastN']['value'];
+  stopFollowing(textAreaId);
   // Post the form data and get the jquery response
   var formData = $('#' + formId).serializeArray();
   var resp = $.post(
     '/loadlogfile', // URL
     formData, // Data
     function(response) { // Call-back
-      textAreaId = '#' + textAreaId
-      console.log(response);
-      $(textAreaId).text(response['value']);
+      $('#' + textAreaId).text(response['value']);
+      logFollowers[textAreaId] = {'offset': response['offset'],
+                                  'source': null};
     }, 'json' // Response type
   );
 }
+
+function stopFollowing(textAreaId) {
+  var f = logFollowers[textAreaId];
+  if (f && f['source']) {
+    f['source'].close();
+    f['source'] = null;
+    return true;
+  }
+  return false;
+}
+
+function followLogLines(formId, textAreaId, buttonId) {
+  // Appends output to the text area as the job writes it, starting where
+  // the last Load stopped. Pressing the button again stops following.
+  if (stopFollowing(textAreaId)) {
+    $('#' + buttonId).val('Follow');
+    return;
+  }
+  if (!window.EventSource) {
+    return;
+  }
+  var gt = document.getElementById(formId);
+  var jobID = gt.elements['jobID']['value'];
+  var url = '/followlogfile/' + encodeURIComponent(jobID);
+  var f = logFollowers[textAreaId];
+  if (f) {
+    url += '?offset=' + f['offset'];
+  } else {
+    $('#' + textAreaId).text('');
+    f = logFollowers[textAreaId] = {'offset': 0, 'source': null};
+  }
+  var source = new EventSource(url);
+  source.onmessage = function(e) {
+    var msg = JSON.parse(e.data);
+    var area = $('#' + textAreaId);
+    area.text(area.text() + msg['value']);
+    f['offset'] = msg['offset'];
+  };
+  f['source'] = source;
+  $('#' + buttonId).val('Stop');
+}
@@ -13,13 +13,24 @@
 #   - Removes scripts
 #   - Removes dump folder
 # cbuild: clean and build.
+# submit: Submit the jobs of a built project to a GPUPeasy server.
+#
+# Large grids can be built in bounded memory with --chunk-size N: the grid is
+# then expanded, filtered and written N points at a time.
 
 import itertools
+import hashlib
+import inspect
+import mmap
+import pickle
+import shlex
 import os
 import shutil
+import numpy as np
 import pandas as pd
 import argparse
-from tqdm import trange
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
 from gridgenerator.utils import CLog as lg
 
 
@@ -29,6 +40,11 @@ class GridConfigBase:
         self.__call_called = False
         self.__grid_dict = {}
         self.__grid_str_func = {}
+        # Constraints, see tie_param, add_conditional_param and
+        # add_constraint.
+        self.__ties = {}
+        self.__conditions = {}
+        self.__predicates = []
         self.OUT_BASE_DIR = OUT_BASE_DIR
         self.SCRIPT = SCRIPT
         self.SUMMARY_KEYS = SUMMARY_KEYS
@@ -36,6 +52,48 @@ class GridConfigBase:
     def add_param(self, keystring, val):
         self.__grid_dict[keystring] = val
 
+    def tie_param(self, keystring, source, func=None):
+        """
+        Adds a parameter whose value follows that of `source`: the same
+        value, or `func(value)`. It is not enumerated on its own, e.g.
+        `tie_param('--pool-dim1', '--pool-dim0')`.
+        """
+        self.__ties[keystring] = (source, func)
+
+    def add_conditional_param(self, keystring, val, when):
+        """
+        Adds a parameter that only takes the values `val` on grid points
+        matching `when`, a dict mapping keystrings to a value or a list of
+        values. Elsewhere it is left out of the command (its value is None),
+        e.g. `add_conditional_param('--momentum', [0.9, 0.99],
+        {'--optimizer': 'sgd'})`.
+        """
+        self.__grid_dict[keystring] = val
+        self.__conditions[keystring] = {
+            k: list(v) if isinstance(v, (list, tuple, set)) else [v]
+            for k, v in when.items()}
+
+    def add_constraint(self, keys, predicate):
+        """
+        Rejects the grid points on which `predicate(*values of keys)` is
+        False, e.g. `add_constraint(('--shortc-in', '--shortc-out'),
+        lambda a, b: a < b)`. Points missing one of the keys (see
+        add_conditional_param) are not checked.
+        """
+        self.__predicates.append((tuple(keys), predicate))
+
+    def get_constraints(self):
+        """
+        Returns {'ties': {keystring: (source, func)}, 'conditions':
+        {keystring: when}, 'predicates': [(keys, predicate)]}.
+        """
+        return {'ties': self.__ties, 'conditions': self.__conditions,
+                'predicates': self.__predicates}
+
+    def has_constraints(self):
+        return len(self.__ties) + len(self.__conditions) + \
+            len(self.__predicates) > 0
+
     def var_to_key(self, var):
         #ARG_A_B_C
         var = '--' + '-'.join(var[4:].split('_'))
@@ -64,6 +122,14 @@ class GridConfigBase:
     def reject_invalid(self):
         raise NotImplementedError
 
+    def is_valid(self, params):
+        """
+        Row-wise alternative to `reject_invalid`, used when that is not
+        overridden: return False to reject the grid point `params`, a dict
+        mapping keystrings to values.
+        """
+        raise NotImplementedError
+
     def extractor(self, keys, alldata):
         """
         Return a dict of value, for each element in keys. This will be used to
@@ -71,12 +137,41 @@ class GridConfigBase:
         """
         raise NotImplementedError
 
+    def extract_incremental(self, keys, newdata, state):
+        """
+        Optional incremental `extractor`, so that the logs of running jobs
+        are not parsed from the start on every summary. `newdata` holds the
+        lines appended to the log since the last call and `state` what that
+        call returned (None on the first call). Return (values, state):
+        values as `extractor` returns them, for the whole log so far, and a
+        picklable state for the next call.
+        """
+        raise NotImplementedError
+
+    def extract_stream(self, keys, log):
+        """
+        Optional `extractor` for logs too large to read as one string:
+        `log` is a LogStream over the memory-mapped log, to read only what
+        is needed, e.g. the last lines for final metrics, and to stop once
+        every key is found. Return the values as `extractor` does.
+        """
+        raise NotImplementedError
+
     def show(self, dfsumm):
         """
         override to display summary dataframe
         """
         raise NotImplementedError
 
+    def __getstate__(self):
+        # Configs are pickled to be sent to summarizer workers, which do not
+        # build grids: leave the tie functions and predicates, often
+        # lambdas that cannot be pickled, behind.
+        state = self.__dict__.copy()
+        state['_GridConfigBase__ties'] = {}
+        state['_GridConfigBase__predicates'] = []
+        return state
+
     def __repr__(self):
         if self.__doc__:
             return self.__doc__
@@ -86,17 +181,138 @@ class GridConfigBase:
         return self.__repr__()
 
 
+def grid_columns(cfg):
+    """
+    The columns of the grid of `cfg`: its parameters, each followed by the
+    parameters tied to it.
+    """
+    ties = cfg.get_constraints()['ties']
+    tied_to = {}
+    for key, (source, _) in ties.items():
+        tied_to.setdefault(source, []).append(key)
+    columns = []
+    stack = list(reversed(list(cfg.get_paramdict().keys())))
+    while len(stack) > 0:
+        key = stack.pop()
+        columns.append(key)
+        stack.extend(reversed(tied_to.get(key, [])))
+    missing = [k for k in ties if k not in columns]
+    if len(missing) > 0:
+        raise ValueError(f"Parameters tied to unknown sources: {missing}")
+    return columns
+
+
+def enumerate_grid(cfg):
+    """
+    Yields the valid points of the grid of `cfg` as tuples, in the order of
+    `grid_columns`, by backtracking over its parameters: a partial assignment
+    that breaks a constraint is dropped with every point it would have
+    expanded to. Without constraints, this is itertools.product.
+    """
+    param_dict = cfg.get_paramdict()
+    cons = cfg.get_constraints()
+    ties, conditions = cons['ties'], cons['conditions']
+    columns = grid_columns(cfg)
+    # The parameter that sets each column: itself or the one it is tied to.
+    root = {}
+    for key in columns:
+        source = key
+        while source in ties:
+            source = ties[source][0]
+        root[key] = source
+    for keys in [list(w.keys()) for w in conditions.values()] + \
+            [list(keys) for keys, _ in cons['predicates']]:
+        unknown = [k for k in keys if k not in root]
+        if len(unknown) > 0:
+            raise ValueError(f"Constraint on unknown parameters: {unknown}")
+    # Parameters in order, but conditional ones after those they look at.
+    order, placed, visiting = [], set(), set()
+
+    def place(key):
+        if key in placed:
+            return
+        if key in visiting:
+            raise ValueError(f"Circular conditions on {key}")
+        visiting.add(key)
+        for dep in conditions.get(key, {}):
+            place(root[dep])
+        visiting.discard(key)
+        placed.add(key)
+        order.append(key)
+
+    for key in param_dict:
+        place(key)
+    depth = {key: order.index(root[key]) for key in columns}
+    # The tied columns set by each parameter, in column order, and the
+    # predicates that can be checked once it is set.
+    tied = [[k for k in columns if k in ties and root[k] == key]
+            for key in order]
+    checks = [[] for _ in order]
+    for keys, predicate in cons['predicates']:
+        checks[max(depth[k] for k in keys)].append((keys, predicate))
+    n = len(order)
+    if n == 0:
+        return
+    assign = {}
+
+    def values(d):
+        key = order[d]
+        when = conditions.get(key)
+        if when is not None and \
+                any(assign[k] not in vals for k, vals in when.items()):
+            return iter([None])
+        return iter(param_dict[key])
+
+    def valid(d):
+        for key in tied[d]:
+            source, func = ties[key]
+            value = assign[source]
+            assign[key] = value if func is None or value is None \
+                else func(value)
+        for keys, predicate in checks[d]:
+            args = [assign[k] for k in keys]
+            if any(a is None for a in args):
+                continue
+            if not predicate(*args):
+                return False
+        return True
+
+    iters = [None] * n
+    iters[0] = values(0)
+    d = 0
+    while d >= 0:
+        for value in iters[d]:
+            assign[order[d]] = value
+            if not valid(d):
+                continue
+            if d == n - 1:
+                yield tuple(assign[k] for k in columns)
+                continue
+            d += 1
+            iters[d] = values(d)
+            break
+        else:
+            d -= 1
+
+
 class ValidGridGenerator():
 
-    def __init__(self, job_name, cfg):
+    def __init__(self, job_name, cfg, chunk_size=None):
         '''
         Does a bunch of checks for grid search and generates a gpu-peasy file
         containing valid grid points only.
 
+        chunk_size: If set, `create_grid_gpupeasy` expands the grid lazily,
+            filtering and writing chunk_size points at a time, so that
+            memory does not grow with the size of the grid. `reject_invalid`
+            then only ever sees one chunk and should decide on every row on
+            its own (no filters across rows, e.g. de-duplication).
+
         Not the most beautiful peace of system.
         '''
         self.job_name = job_name
         self.cfg = cfg
+        self.chunk_size = chunk_size
 
     def __get_valid_outdir__(self):
         '''
@@ -129,18 +345,17 @@ class ValidGridGenerator():
         cfg, job_name = self.cfg, self.job_name
         out_top_dir = self.__get_valid_outdir__()
         lg.info("Project:\n\n", self.cfg, "\n")
-        combsdf, job_list = self.__create_grid()
         fname = job_name + '.esy'
-        f = open(fname, 'w+')
-        for job in job_list:
-            name, outf = job['name'], job['out_file']
-            cmd = job['cmd']
-            print(name, file=f, end=';;\n')
-            print(outf, file=f, end=';;\n')
-            print(cmd, file=f, end=';;;\n\n')
         csv_name = job_name + '.csv'
-        combsdf.to_csv(csv_name, index=False)
-        lg.info("\n", combsdf)
+        f = open(fname, 'w+')
+        if self.chunk_size is None:
+            combsdf, job_list = self.__create_grid()
+            self.__write_esy(f, job_list)
+            combsdf.to_csv(csv_name, index=False)
+            lg.info("\n", combsdf)
+        else:
+            self.__create_grid_streaming(out_top_dir, f, csv_name)
+        f.flush()
         lg.info("Copying grid to top directory:", out_top_dir)
         shutil.copy('./' + fname, out_top_dir)
         shutil.copy('./' + csv_name, out_top_dir)
@@ -167,39 +382,161 @@ class ValidGridGenerator():
         return df, combsdf
     
     def __create_grid(self, ordering=None):
-        cfg, job_name = self.cfg, self.job_name
+        cfg = self.cfg
         out_top_dir = self.__get_valid_outdir__()
         param_dict = cfg.get_paramdict()
-        combs = [param_dict[keystr] for keystr in param_dict.keys()]
-        # Get all possible point on the grid.
-        combs = list(itertools.product(*combs))
-        # We've lost our keystring information; restore it.
-        combsdf = pd.DataFrame(combs)
-        combsdf.columns = param_dict.keys()
-        combsdf = cfg.reject_invalid(combsdf).reset_index(drop=True)
+        if cfg.has_constraints():
+            combsdf = self.__constrained_frame(list(enumerate_grid(cfg)))
+        else:
+            combs = [param_dict[keystr] for keystr in param_dict.keys()]
+            # Get all possible point on the grid.
+            combs = list(itertools.product(*combs))
+            # We've lost our keystring information; restore it.
+            combsdf = pd.DataFrame(combs)
+            combsdf.columns = param_dict.keys()
+        combsdf = self.__filter(combsdf).reset_index(drop=True)
         assert len(combsdf) > 0, "No valid configurations found!"
-        combs = combsdf.to_dict('records')
-        out_dir_list = []
+        job_list = self.__make_jobs(combsdf, out_top_dir, 0, ordering)
+        combsdf['JOB_DIR'] = [os.path.dirname(job['out_file'])
+                              for job in job_list]
+        return combsdf, job_list
+
+    def __create_grid_streaming(self, out_top_dir, f, csv_name):
+        '''
+        Same as __create_grid, a chunk at a time: the jobs of every chunk are
+        written to f and their rows appended to csv_name before the next
+        chunk is expanded.
+        '''
+        num_valid = 0
+        for chunk in self.iter_grid(self.chunk_size):
+            chunk = self.__filter(chunk).reset_index(drop=True)
+            if len(chunk) == 0:
+                continue
+            job_list = self.__make_jobs(chunk, out_top_dir, num_valid)
+            self.__write_esy(f, job_list)
+            chunk['JOB_DIR'] = [os.path.dirname(job['out_file'])
+                                for job in job_list]
+            chunk.to_csv(csv_name, index=False, mode='a' if num_valid else 'w',
+                         header=num_valid == 0)
+            num_valid += len(chunk)
+        assert num_valid > 0, "No valid configurations found!"
+        if self.cfg.has_constraints():
+            # Only valid points are enumerated; there is no total to give.
+            lg.info(f"{num_valid} valid configurations")
+        else:
+            lg.info(f"{num_valid} valid configurations out of "
+                    f"{self.grid_size()}")
+
+    def grid_size(self):
+        '''
+        Number of points on the grid, before rejecting invalid ones. Tied
+        parameters do not count. With constraints, this is the size of the
+        product the constraints cut down, not of the grid enumerated.
+        '''
+        param_dict = self.cfg.get_paramdict()
+        size = 1
+        for vals in param_dict.values():
+            size *= len(vals)
+        return size
+
+    def iter_grid(self, chunk_size):
+        '''
+        Yields the points of the grid, in the order of itertools.product, as
+        DataFrames of at most chunk_size rows. Points are computed from their
+        index, so only the current chunk is ever held in memory. Grids with
+        constraints are enumerated with enumerate_grid instead.
+        '''
+        if self.cfg.has_constraints():
+            points = enumerate_grid(self.cfg)
+            while True:
+                rows = list(itertools.islice(points, chunk_size))
+                if len(rows) == 0:
+                    return
+                yield self.__constrained_frame(rows)
+        param_dict = self.cfg.get_paramdict()
+        keys = list(param_dict.keys())
+        # Columns get the dtype pandas gives them in the whole grid.
+        columns = [pd.Series(list(param_dict[k])).values for k in keys]
+        sizes = [len(col) for col in columns]
+        # Like itertools.product, the last parameter varies fastest.
+        strides = [1] * len(sizes)
+        for i in range(len(sizes) - 2, -1, -1):
+            strides[i] = strides[i + 1] * sizes[i + 1]
+        total = self.grid_size()
+        for start in range(0, total, chunk_size):
+            index = np.arange(start, min(start + chunk_size, total),
+                              dtype=np.int64)
+            chunk = {key: col[(index // stride) % size] for key, col, size,
+                     stride in zip(keys, columns, sizes, strides)}
+            yield pd.DataFrame(chunk, columns=keys)
+
+    def __constrained_frame(self, rows):
+        '''
+        The DataFrame of rows from enumerate_grid. Columns get the dtype of
+        their values, so that every chunk of a grid gets the same, except
+        for conditional parameters: these keep their values as given (e.g.
+        ints, not floats) next to None in an object column.
+        '''
+        cfg = self.cfg
+        param_dict = cfg.get_paramdict()
+        constraints = cfg.get_constraints()
+        conditional = set(constraints['conditions'])
+        columns = grid_columns(cfg)
+        # Parameters tied to a conditional one can be None as well.
+        for key in columns:
+            if constraints['ties'].get(key, (None,))[0] in conditional:
+                conditional.add(key)
+        combsdf = pd.DataFrame(rows, columns=columns, dtype=object)
+        for key in columns:
+            if key in conditional:
+                continue
+            if key in param_dict:
+                dtype = pd.Series(list(param_dict[key])).dtype
+                combsdf[key] = combsdf[key].astype(dtype)
+            else:
+                combsdf[key] = combsdf[key].infer_objects()
+        return combsdf
+
+    def __filter(self, combsdf):
+        cfg = self.cfg
+        reject = getattr(cfg.reject_invalid, '__func__', None)
+        if reject is not GridConfigBase.reject_invalid:
+            return cfg.reject_invalid(combsdf)
+        if type(cfg).is_valid is GridConfigBase.is_valid:
+            # Constraints only, or nothing to reject.
+            return combsdf
+        keep = [cfg.is_valid(params) for params in combsdf.to_dict('records')]
+        return combsdf[np.array(keep, dtype=bool)]
+
+    def __make_jobs(self, combsdf, out_top_dir, first_id, ordering=None):
+        '''
+        Creates the job directories of the grid points in combsdf, numbered
+        from first_id, and returns their jobs.
+        '''
+        cfg, job_name = self.cfg, self.job_name
         job_list = []
-        for j, params in enumerate(combs):
+        for j, params in enumerate(combsdf.to_dict('records'), first_id):
             arg_str = ''
-            if ordering is None:
-                keyordering = params.keys()
+            keyordering = params.keys() if ordering is None else ordering
             for key in keyordering:
                 if pd.notnull(params[key]):
                     arg_str += ' ' + key + ' ' + str(params[key])
             name = '%s_job_%s' % (job_name, j)
             outdir = os.path.join(out_top_dir, name)
-            out_dir_list.append(outdir)
             os.mkdir(outdir)
             cmd = f'python -u {cfg.SCRIPT} --out-dir {outdir} {arg_str}'
             outputfile = os.path.join(outdir, 'gpupeasy_logs.out')
-            # Use print to write to file
             job_list.append({'name': name, 'out_file': outputfile,
                              'cmd': cmd})
+        return job_list
 
-        combsdf['JOB_DIR'] = out_dir_list
-        return combsdf, job_list
+    def __write_esy(self, f, job_list):
+        for job in job_list:
+            name, outf = job['name'], job['out_file']
+            cmd = job['cmd']
+            print(name, file=f, end=';;\n')
+            print(outf, file=f, end=';;\n')
+            print(cmd, file=f, end=';;;\n\n')
 
     def clean(self):
         cfg, job_name = self.cfg, self.job_name
@@ -244,12 +581,287 @@ class ValidGridGenerator():
         lg.info("Done.")
 
 
-def summarizer(projname, gridconfig):
+def _overrides(gridconfig, name):
+    method = getattr(gridconfig, name)
+    return getattr(method, '__func__', method) is not \
+        getattr(GridConfigBase, name)
+
+
+def extractor_version(gridconfig):
+    """
+    A hash of the source of the extractor(s) of `gridconfig`, its
+    SUMMARY_KEYS and its EXTRACTOR_VERSION attribute if any (bump it when
+    code the extractor calls changes). Cached summaries made by another
+    version are not used.
+    """
+    parts = [repr(gridconfig.SUMMARY_KEYS),
+             repr(getattr(gridconfig, 'EXTRACTOR_VERSION', None))]
+    for name in ['extractor', 'extract_incremental', 'extract_stream']:
+        method = getattr(gridconfig, name)
+        method = getattr(method, '__func__', method)
+        try:
+            parts.append(inspect.getsource(method))
+        except (OSError, TypeError):
+            parts.append(method.__qualname__)
+    return hashlib.sha1('\n'.join(parts).encode()).hexdigest()[:16]
+
+
+class LogStream:
+    """
+    A read-only view of a log for `extract_stream`, memory-mapped so that
+    only the pages read are loaded and nothing is decoded up front. Lines
+    are decoded as UTF-8 when yielded, without their newline; the last
+    line of a running job may be incomplete.
+
+        for line in log.reversed_lines():
+            if line.startswith('final accuracy:'):
+                return {'accuracy': [float(line.split()[-1])]}
+
+    `buffer` is the mmap itself (b'' for an empty log), for bytes regular
+    expressions over the whole log: `re.search(rb'...', log.buffer)`.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.buffer = b''
+        self.__file = None
+        if path is not None and os.path.getsize(path) > 0:
+            self.__file = open(path, 'rb')
+            self.buffer = mmap.mmap(self.__file.fileno(), 0,
+                                    access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def lines(self, start=0):
+        """
+        Yields the lines of the log from byte `start` on.
+        """
+        buf, pos, size = self.buffer, start, len(self.buffer)
+        while pos < size:
+            end = buf.find(b'\n', pos)
+            if end < 0:
+                end = size
+            yield buf[pos:end].decode('utf-8')
+            pos = end + 1
+
+    def reversed_lines(self):
+        """
+        Yields the lines of the log from the last one to the first.
+        """
+        buf, end = self.buffer, len(self.buffer)
+        if end == 0:
+            return
+        if buf[end - 1:end] == b'\n':
+            end -= 1
+        while end >= 0:
+            start = buf.rfind(b'\n', 0, end) + 1
+            yield buf[start:end].decode('utf-8')
+            end = start - 1
+
+    def chunks(self, size=1 << 20):
+        """
+        Yields the log as strings of whole lines of about `size` bytes, for
+        regular expressions that should not see the whole log at once.
+        """
+        buf, pos, total = self.buffer, 0, len(self.buffer)
+        while pos < total:
+            end = buf.find(b'\n', min(pos + size, total) - 1)
+            end = total if end < 0 else end + 1
+            yield buf[pos:end].decode('utf-8')
+            pos = end
+
+    def tail(self, nbytes):
+        """
+        The whole lines of the last `nbytes` bytes of the log, as a string,
+        or the last line if it is longer.
+        """
+        buf = self.buffer
+        start = max(len(buf) - nbytes, 0)
+        if start > 0:
+            end = buf.find(b'\n', start - 1)
+            if end < 0 or end == len(buf) - 1:
+                end = buf.rfind(b'\n', 0, len(buf) - 1)
+            start = end + 1
+        return buf[start:].decode('utf-8')
+
+    def close(self):
+        if self.__file is None:
+            return
+        try:
+            self.buffer.close()
+        except BufferError:
+            # An extractor kept a view of the buffer; the mapping goes
+            # with it.
+            pass
+        self.__file.close()
+        self.__file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class LogSummarizer:
+    """
+    Summarizes the logs of jobs with the extractor of a grid config, reusing
+    the cached summary of a log that did not change (same path, size and
+    mtime, same extractor version). With `extract_incremental`, a log that
+    grew is only parsed from where the cached summary stopped. A log can
+    also be rewritten, e.g. GPUPeasy truncates the log of a job it runs
+    again, so the cache entry keeps a hash of the bytes just before that
+    offset and the log is parsed from the start if they changed. Otherwise
+    `extract_stream` is preferred to `extractor` if defined.
+    """
+
+    # Bytes before the offset of an incremental summary that are hashed.
+    PREFIX_BYTES = 64 * 1024
+
+    def __init__(self, gridconfig):
+        self.keys = gridconfig.SUMMARY_KEYS
+        self.extractor = gridconfig.extractor
+        self.incremental = None
+        if _overrides(gridconfig, 'extract_incremental'):
+            self.incremental = gridconfig.extract_incremental
+        self.stream = None
+        if _overrides(gridconfig, 'extract_stream'):
+            self.stream = gridconfig.extract_stream
+        self.version = extractor_version(gridconfig)
+
+    def __extract(self, f):
+        # The values of the whole log at f, or of an empty log if f is None.
+        if self.stream is not None:
+            with LogStream(f) as log:
+                return self.stream(self.keys, log)
+        data = ''
+        if f is not None:
+            with open(f, 'r') as fp:
+                data = fp.read()
+        return self.extractor(self.keys, data)
+
+    def summarize(self, job_dir, cached=None):
+        """
+        Returns (values, error, entry): the dict the extractor returned, an
+        error message or None, and the cache entry of the log (None if it
+        should not be cached). `cached` is the cache entry of the last run.
+        If the log could not be read or the extractor failed on it, values
+        has one None per key. Jobs without a log are summarized as an empty
+        log.
+        """
+        keys = self.keys
+        f = os.path.join(job_dir, 'gpupeasy_logs.out')
+        if not os.path.exists(f):
+            f = os.path.join(job_dir, 'slurm.log')
+        try:
+            if not os.path.exists(f):
+                return self.__extract(None), "Log file not found", None
+            return self.__summarize(f, cached)
+        except Exception as e:
+            # One bad log should not stop the summary of the others.
+            return {k: [None] for k in keys}, f"{type(e).__name__}: {e}", \
+                None
+
+    def __summarize(self, f, cached):
+        st = os.stat(f)
+        entry = {'path': f, 'size': st.st_size, 'mtime': st.st_mtime_ns,
+                 'version': self.version, 'offset': 0, 'prefix': None,
+                 'state': None, 'values': None}
+        same = cached is not None and cached['path'] == f and \
+            cached['version'] == self.version
+        if same and cached['size'] == st.st_size and \
+                cached['mtime'] == st.st_mtime_ns:
+            return cached['values'], None, cached
+        if self.incremental is None:
+            entry['values'] = self.__extract(f)
+            return entry['values'], None, entry
+        offset, state = 0, None
+        with open(f, 'rb') as fp:
+            if same and cached['state'] is not None and \
+                    cached['offset'] <= st.st_size and \
+                    cached.get('prefix') == \
+                    self.__prefix(fp, cached['offset']):
+                offset, state = cached['offset'], cached['state']
+            fp.seek(offset)
+            data = fp.read(st.st_size - offset)
+            # Whole lines only: a running job may be half way through one.
+            end = data.rfind(b'\n') + 1
+            values, state = self.incremental(
+                self.keys, data[:end].decode('utf-8'), state)
+            entry.update({'offset': offset + end, 'state': state,
+                          'values': values,
+                          'prefix': self.__prefix(fp, offset + end)})
+        return values, None, entry
+
+    def __prefix(self, fp, offset):
+        # The hash of the bytes of fp just before offset.
+        start = max(offset - self.PREFIX_BYTES, 0)
+        fp.seek(start)
+        return hashlib.sha1(fp.read(offset - start)).hexdigest()
+
+
+def summary_cache_path(projname, gridconfig):
+    """
+    The summary cache of a project, next to its `.csv`.
+    """
+    exp_path = os.path.join(gridconfig.OUT_BASE_DIR, projname)
+    return os.path.join(exp_path, projname + '.summary.pkl')
+
+
+def load_summary_cache(path):
+    """
+    Returns the cache entries, by job directory, stored at `path`. An
+    unreadable cache is treated as empty.
+    """
+    if not os.path.exists(path):
+        return {}
+    try:
+        return pd.read_pickle(path).to_dict('index')
+    except Exception as e:
+        lg.warning(f"Ignoring summary cache {path}: {e}")
+        return {}
+
+
+def save_summary_cache(path, entries):
+    # One row per job directory, one column per entry field.
+    df = pd.DataFrame.from_dict(entries, orient='index')
+    tmp = path + '.tmp'
+    df.to_pickle(tmp)
+    os.replace(tmp, path)
+
+
+# The LogSummarizer of a summarizer worker process, set once per worker
+# rather than sent with every file.
+_worker_summarizer = None
+
+
+def _init_summarize_worker(log_summarizer):
+    global _worker_summarizer
+    _worker_summarizer = log_summarizer
+
+
+def _summarize_log_worker(args):
+    return _worker_summarizer.summarize(*args)
+
+
+def summarizer(projname, gridconfig, workers=None, chunk_size=16,
+               use_cache=True):
         """
         A quick way to provide and extract summaries. Needs the `extractor()`
-        function and `SUMMARY_KEYS` to be defined.
+        (or `extract_stream()`) function and `SUMMARY_KEYS` to be defined.
+
+        workers: Number of processes reading and summarizing the logs in
+            parallel, None to do it in this process. Worth it when reading
+            the logs is slow (e.g. over NFS) or `extractor()` is.
+        chunk_size: Number of logs sent to a worker at a time.
+        use_cache: Reuse the summaries of logs that did not change since the
+            last run, kept in `projname.summary.pkl` next to the `.csv`.
+            See LogSummarizer.
+
+        Logs that cannot be read, or that the extractor fails on, are logged
+        and get None for every key.
         """
-        extractor = gridconfig.extractor
         keys = gridconfig.SUMMARY_KEYS
         assert keys is not None, "No keys provided to summarize"
         exp_path = gridconfig.OUT_BASE_DIR
@@ -259,28 +871,100 @@ def summarizer(projname, gridconfig):
         dfpath = os.path.join(exp_path, projname + '.csv')
         paramdf = pd.read_csv(dfpath)
         file_list = paramdf['JOB_DIR'].values
+        log_summarizer = LogSummarizer(gridconfig)
+        cache_path = summary_cache_path(projname, gridconfig)
+        cache = load_summary_cache(cache_path) if use_cache else {}
+        tasks = [(d, cache.get(d)) for d in file_list]
         valdict = {k: [] for k in keys}
-        with trange(len(file_list)) as t:
-            for i in t:
-                f = os.path.join(file_list[i], 'gpupeasy_logs.out')
-                if not os.path.exists(f):
-                    f = os.path.join(file_list[i], 'slurm.log')
-                if os.path.exists(f):
-                    t.set_description(f'Processing: {f}')
-                    with open(f, 'r') as fp:
-                        data = fp.read()
-                        ret = extractor(keys, data)
-                else:
-                    lg.warning("Log file not found: ", file_list[i])
-                    ret = extractor(keys, '')
-                # Description will be displayed on the left
-                for key in keys:
-                    valdict[key].extend(ret[key])
+        if workers is not None:
+            try:
+                # Sent to every worker, whatever the start method.
+                pickle.dumps(log_summarizer)
+            except Exception as e:
+                lg.warning(f"Summarizing serially, the grid config cannot "
+                           f"be sent to workers: {e}")
+                workers = None
+        if workers is None:
+            results = (log_summarizer.summarize(*t) for t in tasks)
+            pool = None
+        else:
+            pool = ProcessPoolExecutor(max_workers=workers,
+                                       initializer=_init_summarize_worker,
+                                       initargs=(log_summarizer,))
+            # In the order of file_list.
+            results = pool.map(_summarize_log_worker, tasks,
+                               chunksize=chunk_size)
+        entries, reused = {}, 0
+        try:
+            with tqdm(results, total=len(file_list)) as t:
+                for (job_dir, cached), (ret, error, entry) in zip(tasks, t):
+                    # Description will be displayed on the left
+                    t.set_description(f'Processing: {job_dir}')
+                    if error is not None:
+                        lg.warning(f"{job_dir}: {error}")
+                    if entry is not None:
+                        entries[job_dir] = entry
+                        reused += entry == cached
+                    for key in keys:
+                        valdict[key].extend(ret[key])
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+        if use_cache:
+            save_summary_cache(cache_path, entries)
+            lg.info(f"Reused {reused} of {len(file_list)} cached summaries")
         for key in keys:
             paramdf[key] = valdict[key]
         return paramdf
 
 
+def read_esy(fname):
+    """
+    Parses a `.esy` file written by `create_grid_gpupeasy` into a list of
+    (name, out_file, command list) tuples.
+    """
+    with open(fname, 'r') as f:
+        content = f.read()
+    jobs = []
+    for job in content.split(';;;'):
+        jobS = [x.strip() for x in job.split(';;')]
+        jobS = [x for x in jobS if len(x) > 0]
+        if len(jobS) == 0:
+            continue
+        assert len(jobS) == 3, f"Malformed job in {fname}: {job}"
+        jobs.append((jobS[0], jobS[1], shlex.split(jobS[2])))
+    return jobs
+
+
+def submit_grid(projname, server, chunk_size=5000):
+    """
+    Submits the jobs in `projname.esy` to the GPUPeasy server at
+    `server` (host:port) through its bulk `/addjobs` end-point. Jobs are
+    tagged with `projname` as their project.
+    """
+    # Only needed for this action.
+    import requests
+    fname = projname + '.esy'
+    assert os.path.exists(fname), f"Not found: {fname}. Run build first."
+    jobs = read_esy(fname)
+    url = f'http://{server}/addjobs'
+    added, failed = 0, 0
+    for i in range(0, len(jobs), chunk_size):
+        chunk = jobs[i:i + chunk_size]
+        js = {'jobs': [{'jobName': name, 'outFile': outf, 'jobCommand': cmd,
+                        'project': projname} for name, outf, cmd in chunk]}
+        resp = requests.post(url, json=js).json()
+        if resp['status'] != 'successful':
+            lg.fail("Submission failed: ", resp['message'])
+            exit(1)
+        for (name, _, _), ret in zip(chunk, resp['value']):
+            if ret['status'] != 'successful':
+                lg.warning(f"Could not add {name}: {ret['message']}")
+        added += resp['numAdded']
+        failed += resp['numFailed']
+    lg.info(f"Submitted {added} jobs to {server} ({failed} failed)")
+
+
 def CLIArgs():
     hstr = """v0.1\nA simple program to generate valid configurations supported
     by GPUPease for grid-searches. The exact grid is configured through the use
@@ -289,8 +973,17 @@ def CLIArgs():
     parser = argparse.ArgumentParser(description=hstr)
     parser.add_argument("-p", "--proj-name", help="Project name to use",
                         required=True)
+    parser.add_argument("-s", "--server", default='localhost:8844',
+                        help="GPUPeasy server (host:port) for submit")
+    parser.add_argument("-c", "--chunk-size", type=int, default=None,
+                        help="Build large grids this many points at a " +
+                        "time, in bounded memory")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="Summarize logs in this many processes")
+    parser.add_argument("--no-cache", action='store_true',
+                        help="Parse every log again when summarizing")
     parser.add_argument("action", help="Action to take in " +
-                        "[summarize, build, clean, cbuild]")
+                        "[summarize, build, clean, cbuild, submit]")
     args = parser.parse_args()
     return args
 
@@ -303,11 +996,11 @@ def driver(grid_dict):
     args = CLIArgs()
     proj_name = args.proj_name
     action = args.action
-    ALL_ACTIONS = ['build', 'clean', 'cbuild', 'summarize']
+    ALL_ACTIONS = ['build', 'clean', 'cbuild', 'summarize', 'submit']
     #__init__()__call__()
     grid = grid_dict[proj_name]()
     grid()
-    gridgen = ValidGridGenerator(proj_name, grid)
+    gridgen = ValidGridGenerator(proj_name, grid, chunk_size=args.chunk_size)
     assert action in ALL_ACTIONS
     lg.info("Performing: ", action)
     if action == 'clean':
@@ -318,5 +1011,8 @@ def driver(grid_dict):
         gridgen.clean()
         gridgen.create_grid_gpupeasy()
     elif action == 'summarize':
-        df = summarizer(proj_name, grid)
+        df = summarizer(proj_name, grid, workers=args.workers,
+                        use_cache=not args.no_cache)
         grid.show(df)
+    elif action == 'submit':
+        submit_grid(proj_name, args.server)
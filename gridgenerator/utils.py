@@ -1,9 +1,14 @@
-import torch.nn.functional as F
 import inspect
 import os
 import traceback
 from pprint import pprint
 
+# Only extract_image_patches1 needs torch; the grid generator does not.
+try:
+    import torch.nn.functional as F
+except ImportError:
+    F = None
+
 
 def extract_image_patches1(images, kh, kw, sh=1, sw=1, pad_h=0, pad_w=0):
     '''
@@ -14,6 +19,8 @@ def extract_image_patches1(images, kh, kw, sh=1, sw=1, pad_h=0, pad_w=0):
     sh, sw: Stride on height and width between patches.
     pad_h, pad_w: Padding on width and height.
     '''
+    if F is None:
+        raise ImportError('torch is not installed')
     lg = CLog
     msg = "Invalid shape. We expect [batch, channels, H, W]"
     assert len(images.shape) == 4, msg
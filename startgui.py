@@ -8,7 +8,11 @@ if __name__ == "__main__":
     guiHost = '0.0.0.0'
     guiPort = '4005'
     debug = True
+    # 'flask' (development server) or 'waitress' (pip install waitress)
+    server = 'flask'
+    threads = 16
     ## End Configuration
 
     frontend = GPUPeasyWebGUI(backendHost, backendPort, debug=debug)
-    frontend.run(host=guiHost, port=guiPort)
+    frontend.run(host=guiHost, port=guiPort, server=server,
+                 threads=threads)
@@ -11,6 +11,42 @@ if __name__ == '__main__':
     host = '0.0.0.0'
     port = '8844'
     logdir = '/tmp/gpupeasy/'
+    # Directory to journal jobs to, e.g. '/tmp/gpupeasy/journal/', so that
+    # queues are restored on restart. None to start with empty queues.
+    journalDir = None
+    # Set to True to run jobs on worker machines (see startworker.py)
+    # instead of, or as well as, the devices in gpuList.
+    coordinator = False
+    # Memory in MB of the devices, e.g. {'0': 16000}, for jobs declaring a
+    # memory estimate, and the cores jobs can claim. None to not enforce.
+    deviceMemory = None
+    cpus = None
+    # 'best' or 'first' fit, and whether small jobs may start while a large
+    # one waits for devices.
+    placement = 'best'
+    backfill = True
+    # 'nvml' (pip install nvidia-ml-py) to keep jobs off GPUs that are busy
+    # or short of memory, or a JSON file of samples (see
+    # gpupeasy/core/telemetry.py). None to trust gpuList.
+    telemetry = None
+    # Seconds /killjob waits after SIGTERM before sending SIGKILL.
+    killGracesec = 10
+    # Seconds without CPU use or output after which a running job is
+    # reported hung (None to not check), and whether to kill hung jobs.
+    hungsec = None
+    killHung = False
+    # Directory for the code snapshots of jobs submitted with 'snapshot',
+    # e.g. '/tmp/gpupeasy/code/'. None to not allow snapshots.
+    codeCacheDir = None
+    # 'flask' (development server) or 'waitress' (pip install waitress)
+    server = 'flask'
+    threads = 16
     ## End configuration
-    gpu = GPUPeasyServer(gpuList, debug=debug, logdir=logdir)
-    gpu.run(host=host, port=port)
+    gpu = GPUPeasyServer(gpuList, debug=debug, logdir=logdir,
+                         journalDir=journalDir, coordinator=coordinator,
+                         deviceMemory=deviceMemory, cpus=cpus,
+                         placement=placement, backfill=backfill,
+                         telemetry=telemetry, killGracesec=killGracesec,
+                         hungsec=hungsec, killHung=killHung,
+                         codeCacheDir=codeCacheDir)
+    gpu.run(host=host, port=port, server=server, threads=threads)
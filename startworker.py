@@ -0,0 +1,21 @@
+#!/usr/bin/env python
+import sys
+import socket
+from gpupeasy.core.worker import WorkerAgent
+
+
+if __name__ == '__main__':
+    ## Configuration
+    # host:port of the server started with coordinator = True
+    coordinator = 'localhost:8844'
+    # Unique per machine. Can be overridden with the first argument, to run
+    # several workers on one machine.
+    name = socket.gethostname()
+    gpuList = [
+        '0', '1', '2', '3',
+    ]
+    ## End configuration
+    if len(sys.argv) > 1:
+        name = sys.argv[1]
+    worker = WorkerAgent(coordinator, name, gpuList)
+    worker.run()